@@ -0,0 +1,125 @@
+"""Micro-benchmark of report frame encoding, against the original per-report encoder.
+
+    python -m benchmarks.encoding --output encoding.json
+    python -m benchmarks.encoding --compare encoding.json
+
+Reports encodes/sec (or frames/sec for bulk encoding) for common and random
+states, plus the speedup over the original ``SwitchReport.to_bytes`` loop.
+Output has the same shape as ``benchmarks.hotpaths`` so ``--compare`` works
+the same way.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.hotpaths import _git_revision, compare
+from mcp_service import switch_protocol
+from mcp_service.switch_protocol import (
+    SwitchButton,
+    SwitchReport,
+    encode_block,
+    encode_report,
+    pack_reports,
+)
+
+def legacy_to_bytes(report: SwitchReport) -> bytes:
+    """The original SwitchReport.to_bytes: a new list per report and a bit loop."""
+    command = [
+        (report.button >> 8) & 0xFF,
+        report.button & 0xFF,
+        report.HAT & 0xFF,
+        report.LX & 0xFF,
+        report.LY & 0xFF,
+        report.RX & 0xFF,
+        report.RY & 0xFF,
+    ]
+    packet: List[int] = []
+    n = 0
+    bits = 0
+    for b in command:
+        n = (n << 8) | (b & 0xFF)
+        bits += 8
+        while bits >= 7:
+            bits -= 7
+            packet.append((n >> bits) & 0x7F)
+            n &= (1 << bits) - 1
+    while len(packet) < 8:
+        packet.append(0)
+    packet = packet[:8]
+    packet[7] |= 0x80
+    return bytes(packet)
+
+def _rate(fn: Callable[[], object], items: int, rounds: int) -> float:
+    """Best-of-``rounds`` items/sec for one call of ``fn`` that encodes ``items`` frames."""
+    best = float("inf")
+    for _ in range(rounds):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return round(items / best, 1)
+
+def bench(count: int, rounds: int, seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    common = [SwitchReport(button=rng.choice(list(SwitchButton)).value) for _ in range(count)]
+    states = [
+        (rng.randrange(1 << 14), rng.randrange(9), rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        for _ in range(count)
+    ]
+    reports = [SwitchReport(*s) for s in states]
+    for report in reports[:1000]:
+        assert report.to_bytes() == legacy_to_bytes(report)
+    columns = [list(c) for c in zip(*states)]
+
+    results = {
+        "legacy.common.perSec": _rate(lambda: [legacy_to_bytes(r) for r in common], count, rounds),
+        "legacy.random.perSec": _rate(lambda: [legacy_to_bytes(r) for r in reports], count, rounds),
+        "legacy.construct.perSec": _rate(lambda: [legacy_to_bytes(SwitchReport(*s)) for s in states], count, rounds),
+        "toBytes.common.perSec": _rate(lambda: [r.to_bytes() for r in common], count, rounds),
+        "toBytes.random.perSec": _rate(lambda: [r.to_bytes() for r in reports], count, rounds),
+        "toBytes.construct.perSec": _rate(lambda: [SwitchReport(*s).to_bytes() for s in states], count, rounds),
+        "encodeReport.random.perSec": _rate(lambda: [encode_report(*s) for s in states], count, rounds),
+        "encodeBlock.random.perSec": _rate(lambda: encode_block(*columns), count, rounds),
+        "packReports.random.perSec": _rate(lambda: pack_reports(reports), count, rounds),
+    }
+    results["speedup.common"] = round(results["toBytes.common.perSec"] / results["legacy.common.perSec"], 2)
+    results["speedup.random"] = round(results["toBytes.random.perSec"] / results["legacy.random.perSec"], 2)
+    results["speedup.block"] = round(results["encodeBlock.random.perSec"] / results["legacy.random.perSec"], 2)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="EasyCon report encoding micro-benchmark")
+    parser.add_argument("--count", type=int, default=20000, help="frames per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    parser.add_argument("--compare", help="baseline results JSON to diff against")
+    args = parser.parse_args()
+
+    results = bench(args.count, args.rounds, args.seed)
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": switch_protocol.np is not None,
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print("\n".join(compare(results, baseline)), file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
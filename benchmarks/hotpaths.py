@@ -0,0 +1,204 @@
+"""Benchmarks for the serial and HTTP hot paths, run against the pty emulator.
+
+    python -m benchmarks.hotpaths --output results.json
+    python -m benchmarks.hotpaths --latency-ms 1 --jitter-ms 0.3 --compare results.json
+
+Results are a flat JSON map of metric name to number, plus run metadata, so
+two runs (e.g. before and after a change) can be diffed with ``--compare``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from mcp_service.async_serial import AsyncEasyConSerial
+from mcp_service.emulator import EasyConEmulator, PtyEmulator
+from mcp_service.switch_protocol import SwitchButton, SwitchReport
+from mcp_service.timeline import RESET_FRAME
+from mcp_service.trace import TraceRecorder
+
+# 数值越小越好的指标（其余为吞吐量，越大越好）
+LOWER_IS_BETTER = ("Ms", "Us", "busy", "failed")
+
+def _percentiles(samples: List[float], prefix: str) -> Dict[str, float]:
+    q = statistics.quantiles(samples, n=100)
+    return {
+        f"{prefix}.meanMs": round(statistics.fmean(samples), 4),
+        f"{prefix}.p50Ms": round(q[49], 4),
+        f"{prefix}.p95Ms": round(q[94], 4),
+        f"{prefix}.p99Ms": round(q[98], 4),
+    }
+
+async def bench_serial(port: str, frames: int) -> Dict[str, float]:
+    """Report frames/sec through AsyncEasyConSerial, stop-and-wait and pipelined."""
+    link = AsyncEasyConSerial()
+    link.connect(port)
+    try:
+        await link.handshake()
+        press = SwitchReport(button=SwitchButton.A.value).to_bytes()
+        rtts = []
+        start = time.perf_counter()
+        for i in range(frames):
+            t = time.perf_counter_ns()
+            await link.transact(press if i % 2 == 0 else RESET_FRAME)
+            rtts.append((time.perf_counter_ns() - t) / 1e6)
+        transact_s = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as tmp:
+            recorder = TraceRecorder(os.path.join(tmp, "bench.trace"))
+            link.trace = recorder.channel("bench")
+            start = time.perf_counter()
+            for i in range(frames):
+                await link.transact(press if i % 2 == 0 else RESET_FRAME)
+            traced_s = time.perf_counter() - start
+            link.trace = None
+            recorder.close()
+        start = time.perf_counter()
+        async with link.pipeline(window=4) as pipe:
+            for i in range(frames):
+                await pipe.submit(press if i % 2 == 0 else RESET_FRAME)
+        pipeline_s = time.perf_counter() - start
+        return {
+            "serial.transact.framesPerSec": round(frames / transact_s, 1),
+            **_percentiles(rtts, "serial.transact.rtt"),
+            "serial.transactTraced.framesPerSec": round(frames / traced_s, 1),
+            "serial.pipeline4.framesPerSec": round(frames / pipeline_s, 1),
+            "serial.pipeline4.busy": pipe.window.busy,
+        }
+    finally:
+        link.disconnect()
+
+def bench_http(port: str, presses: int, sequences: int, batch_size: int) -> Dict[str, float]:
+    """Per-press latency, sequence drift and /batch throughput through the FastAPI app, plus the same over /mcp."""
+    from fastapi.testclient import TestClient
+
+    from mcp_service import server
+
+    results: Dict[str, float] = {}
+    with TestClient(server.app) as client:
+        _ok(client.post("/connect", json={"port": port}))
+        _ok(client.post("/init"))
+
+        latencies = []
+        for _ in range(presses):
+            t = time.perf_counter_ns()
+            _ok(client.post("/press/button", json={"button": "A", "durationMs": 0}))
+            latencies.append((time.perf_counter_ns() - t) / 1e6)
+        results.update(_percentiles(latencies, "http.press"))
+
+        def tool_call(i: int, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+            return {"jsonrpc": "2.0", "id": i, "method": "tools/call", "params": {"name": name, "arguments": arguments}}
+
+        latencies = []
+        for i in range(presses):
+            t = time.perf_counter_ns()
+            _ok(client.post("/mcp", json=tool_call(i, "press_button", {"button": "A", "durationMs": 0})))
+            latencies.append((time.perf_counter_ns() - t) / 1e6)
+        results.update(_percentiles(latencies, "mcp.press"))
+
+        steps = [{"type": "button", "button": "A", "durationMs": 10}, {"type": "wait", "durationMs": 10}] * 10
+        for mode, config in (("default", {}), ("precision", {"precision": True})):
+            _ok(client.post("/timing/config", json=config))
+            timings = [
+                _ok(client.post("/sequence", json={"steps": steps}))["timing"] for _ in range(sequences)
+            ]
+            results[f"sequence.{mode}.driftMs"] = round(statistics.fmean(t["driftMs"] for t in timings), 4)
+            results[f"sequence.{mode}.meanLateMs"] = round(statistics.fmean(t["meanLateMs"] for t in timings), 4)
+            results[f"sequence.{mode}.maxLateMs"] = max(t["maxLateMs"] for t in timings)
+        _ok(client.post("/timing/config", json={}))
+
+        commands = [{"type": "button", "button": "B", "durationMs": 0}] * batch_size
+        t = time.perf_counter()
+        body = _ok(client.post("/batch", json={"commands": commands}))
+        elapsed = time.perf_counter() - t
+        results["batch.commandsPerSec"] = round(batch_size / elapsed, 1)
+        results["batch.failed"] = sum(1 for r in body["results"] if not r["ok"])
+
+        calls = [tool_call(i, "press_button", {"button": "B", "durationMs": 0}) for i in range(batch_size)]
+        t = time.perf_counter()
+        body = _ok(client.post("/mcp", json=calls))
+        elapsed = time.perf_counter() - t
+        results["mcp.batch.callsPerSec"] = round(batch_size / elapsed, 1)
+        results["mcp.batch.failed"] = sum(1 for r in body if r["result"]["isError"])
+        client.post("/disconnect")
+    return results
+
+def _ok(response) -> Any:
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.url.path}: {response.status_code} {response.text}")
+    return response.json()
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def _emulated(args, run: Callable[[str], Dict[str, float]]) -> Dict[str, float]:
+    device = EasyConEmulator(busy_rate=args.busy_rate, seed=args.seed)
+    with PtyEmulator(device, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=args.seed) as emu:
+        return run(emu.port)
+
+def compare(current: Dict[str, float], baseline: Dict[str, float]) -> List[str]:
+    lines = []
+    for name, value in current.items():
+        base = baseline.get(name)
+        if not isinstance(base, (int, float)):
+            lines.append(f"{name:40s} {value:>12} (new)")
+            continue
+        if not base:
+            lines.append(f"{name:40s} {base:>12} -> {value:>12}")
+            continue
+        change = (value - base) / abs(base) * 100
+        worse = change > 0 if name.endswith(LOWER_IS_BETTER) else change < 0
+        flag = "  worse" if worse and abs(change) >= 5 else ""
+        lines.append(f"{name:40s} {base:>12} -> {value:>12} {change:+7.1f}%{flag}")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="EasyCon hot path benchmarks")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--presses", type=int, default=300)
+    parser.add_argument("--sequences", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="emulated reply latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="emulated reply jitter")
+    parser.add_argument("--busy-rate", type=float, default=0.0, help="fraction of frames the emulator answers Busy")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    parser.add_argument("--compare", help="baseline results JSON to diff against")
+    args = parser.parse_args()
+
+    results: Dict[str, float] = {}
+    results.update(_emulated(args, lambda port: asyncio.run(bench_serial(port, args.frames))))
+    results.update(_emulated(args, lambda port: bench_http(port, args.presses, args.sequences, args.batch_size)))
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "emulator": {"latencyMs": args.latency_ms, "jitterMs": args.jitter_ms, "busyRate": args.busy_rate},
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print("\n".join(compare(results, baseline)), file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
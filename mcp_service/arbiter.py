@@ -0,0 +1,199 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from mcp_service.metrics import Histogram
+
+# 优先级即下标，数值越小越先执行
+PRIORITIES = ("interactive", "normal", "background")
+PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BACKGROUND = range(len(PRIORITIES))
+
+# 排队等待直方图桶上界（秒）
+QUEUE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+
+GRANTED = object()  # future result: the link is yours, play the timeline yourself
+
+def priority_index(name: str) -> int:
+    try:
+        return PRIORITIES.index(name)
+    except ValueError:
+        raise ValueError(f"Unknown priority: {name}")
+
+class Turn:
+    """A timeline waiting for, or holding, a device."""
+
+    __slots__ = ("priority", "timeline", "repeat", "progress", "trace_steps", "enqueuedNs", "waitNs", "future", "loop")
+
+    def __init__(self, priority: int, timeline: Any, repeat: int = 1, progress: Any = None, trace_steps: bool = False):
+        self.priority = priority
+        self.timeline = timeline
+        self.repeat = repeat
+        self.progress = progress
+        self.trace_steps = trace_steps
+        self.enqueuedNs = time.perf_counter_ns()
+        self.waitNs = 0
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+def _resolve(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None):
+    if future.done():
+        return
+    if isinstance(error, asyncio.CancelledError):
+        future.cancel()
+    elif error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class LinkArbiter:
+    """Hands a device to one timeline at a time, by priority and FIFO within a priority.
+
+    The run holding the device checks at every step boundary for a waiting
+    run that outranks it (``take()``) and plays it inline through its own
+    send path, so it works the same for stop-and-wait, pipelined and pinned
+    runs. Otherwise waiting runs get the device in order when the holder
+    calls ``release()``. Queue wait is recorded per priority.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues: Tuple[Deque[Turn], ...] = tuple(deque() for _ in PRIORITIES)
+        self._holder: Optional[int] = None
+        # 有更高优先级的请求在等待：固定线程上的运行等 signal，事件循环上的等 _async_signal
+        self.signal = threading.Event()
+        self._async_signal: Optional[asyncio.Event] = None
+        self.wait: Dict[str, Histogram] = {name: Histogram(QUEUE_BUCKETS) for name in PRIORITIES}
+        self.preemptions = 0
+
+    @property
+    def async_signal(self) -> asyncio.Event:
+        if self._async_signal is None:
+            self._async_signal = asyncio.Event()
+            if self.signal.is_set():
+                self._async_signal.set()
+        return self._async_signal
+
+    @property
+    def held(self) -> bool:
+        """True while a run holds the device, including the waits between its frames."""
+        return self._holder is not None
+
+    def _started(self, turn: Turn):
+        turn.waitNs = time.perf_counter_ns() - turn.enqueuedNs
+        self.wait[PRIORITIES[turn.priority]].observe(turn.waitNs)
+
+    def _update_signal(self):
+        # 持锁调用
+        outranked = self._holder is not None and any(self._queues[p] for p in range(self._holder))
+        if outranked:
+            self.signal.set()
+            if self._async_signal is not None:
+                self._async_signal.set()
+        else:
+            self.signal.clear()
+            if self._async_signal is not None:
+                self._async_signal.clear()
+
+    async def acquire(self, turn: Turn) -> Any:
+        """Wait for the device. Returns None when ``turn`` should play, or the RunTiming of an inline play."""
+        with self._lock:
+            if self._holder is None:
+                self._holder = turn.priority
+                self._started(turn)
+                return None
+            self._queues[turn.priority].append(turn)
+            self._update_signal()
+        try:
+            result = await turn.future
+        except asyncio.CancelledError:
+            with self._lock:
+                queue = self._queues[turn.priority]
+                if turn in queue:
+                    queue.remove(turn)
+                    self._update_signal()
+                    raise
+            if turn.future.done() and not turn.future.cancelled() and turn.future.result() is GRANTED:
+                self.release()
+            raise
+        return None if result is GRANTED else result
+
+    def release(self):
+        """Pass the device to the longest-waiting run of the highest priority."""
+        with self._lock:
+            for queue in self._queues:
+                if queue:
+                    turn = queue.popleft()
+                    self._holder = turn.priority
+                    self._started(turn)
+                    turn.loop.call_soon_threadsafe(self._grant, turn)
+                    break
+            else:
+                self._holder = None
+            self._update_signal()
+
+    def _grant(self, turn: Turn):
+        if turn.future.done():
+            # 等待方已被取消，交给下一个
+            self.release()
+        else:
+            turn.future.set_result(GRANTED)
+
+    def take(self, priority: int) -> Optional[Turn]:
+        """Pop the first waiting run that outranks ``priority``, for the holder to play inline."""
+        with self._lock:
+            turn = None
+            for p in range(priority):
+                queue = self._queues[p]
+                while queue and queue[0].future.done():
+                    queue.popleft()  # 等待方已取消
+                if queue:
+                    turn = queue.popleft()
+                    self._started(turn)
+                    self.preemptions += 1
+                    break
+            self._update_signal()
+            return turn
+
+    @staticmethod
+    def finish(turn: Turn, timing: Any = None, error: Optional[BaseException] = None):
+        """Complete an inline-played turn; callable from the pinned timing thread."""
+        if timing is not None:
+            timing.queuedNs = turn.waitNs
+        turn.loop.call_soon_threadsafe(_resolve, turn.future, timing, error)
+
+    async def wait_async(self, timeout_ns: int) -> bool:
+        """Wait up to ``timeout_ns`` for an outranking run to arrive; True if one did."""
+        try:
+            await asyncio.wait_for(self.async_signal.wait(), timeout_ns / 1e9)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def queued(self) -> Dict[str, int]:
+        return {name: len(queue) for name, queue in zip(PRIORITIES, self._queues)}
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"queued": self.queued(), "preemptions": self.preemptions}
+        for name, hist in self.wait.items():
+            count = sum(hist.counts)
+            result[name] = {
+                "count": count,
+                "meanMs": round(hist.sum_ns / count / 1e6, 3) if count else 0.0,
+                "p99Ms": _quantile_ms(hist, 0.99),
+            }
+        return result
+
+def _quantile_ms(hist: Histogram, q: float) -> Optional[float]:
+    """Upper bound of the bucket holding quantile ``q``; None when empty or beyond the last bound."""
+    count = sum(hist.counts)
+    if not count:
+        return None
+    rank = q * count
+    total = 0
+    for bound, c in zip(hist.bounds, hist.counts):
+        total += c
+        if total >= rank:
+            return bound * 1000
+    return None
@@ -0,0 +1,517 @@
+import asyncio
+import binascii
+import contextlib
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+import serial
+
+from mcp_service.serial_service import (
+    Command,
+    Reply,
+    REPLY_IDLE_GAP,
+    VARIABLE_REPLY_MAX_BYTES,
+    check_reply,
+    expected_reply_bytes,
+    flash_packets,
+    is_report,
+    open_serial,
+    read_reply,
+)
+from mcp_service.metrics import LinkMetrics
+from mcp_service.trace import TraceChannel
+
+# 不支持 add_reader 的事件循环（如 Windows Proactor）退化为短间隔轮询
+POLL_INTERVAL = 0.001
+
+HELLO_REQUEST = bytes([Command.Ready, Command.Ready, Command.Hello])
+
+# 串口断开时 pyserial、os 和 termios 抛出的错误（SerialException 是 OSError 的子类）
+try:
+    import termios
+    PORT_ERRORS: Tuple[type, ...] = (OSError, termios.error)
+except ImportError:
+    PORT_ERRORS = (OSError,)
+
+BUSY_BACKOFF = 0.002
+BUSY_RETRIES = 8  # stop-and-wait resends of a frame answered with Busy
+
+class TxWindow:
+    """Report frames in flight, matched in order to their Ack/Busy replies.
+
+    The window closes to one frame on Busy and reopens by one per Ack. A Busy
+    frame is only handed back for resending when no newer frame has been sent
+    since, because a newer report already supersedes it.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = max(size, 1)
+        self.limit = self.size
+        self.in_flight: Deque[bytes] = deque()
+        self.sent = 0
+        self.acked = 0
+        self.busy = 0
+        self.resent = 0
+        self.lost = 0
+
+    @property
+    def open(self) -> bool:
+        return len(self.in_flight) < self.limit
+
+    def on_send(self, frame: bytes):
+        self.in_flight.append(frame)
+        self.sent += 1
+
+    def on_reply(self, code: int) -> Optional[bytes]:
+        """Account one reply byte; returns a frame to resend after a Busy."""
+        if code not in (Reply.Ack, Reply.Busy, Reply.Error) or not self.in_flight:
+            return None
+        frame = self.in_flight.popleft()
+        if code == Reply.Ack:
+            self.acked += 1
+            self.limit = min(self.limit + 1, self.size)
+            return None
+        if code == Reply.Error:
+            self.lost += 1
+            return None
+        self.busy += 1
+        self.limit = 1
+        if self.in_flight:
+            return None
+        self.resent += 1
+        return frame
+
+    def expire(self):
+        """Give up on the oldest frame when its reply never arrived."""
+        if self.in_flight:
+            self.in_flight.popleft()
+            self.lost += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sent": self.sent,
+            "acked": self.acked,
+            "busy": self.busy,
+            "resent": self.resent,
+            "lost": self.lost,
+        }
+
+class FramePipeline:
+    """Blocking pipelined sender: writes report frames without waiting for each Ack."""
+
+    def __init__(self, ser: serial.Serial, window: int = 4, timeout: float = 0.5, metrics: Any = None, trace: Any = None):
+        self._ser = ser
+        self._timeout = timeout
+        self._metrics = metrics
+        self._trace = trace
+        self.window = TxWindow(window)
+
+    def _pump(self, block: bool) -> bool:
+        if not block and not self._ser.in_waiting:
+            return False
+        self._ser.timeout = self._timeout if block else 0
+        data = self._ser.read(max(self._ser.in_waiting, 1))
+        if self._metrics is not None:
+            self._metrics.on_replies(data)
+        for code in data:
+            frame = self.window.on_reply(code)
+            if frame is not None:
+                time.sleep(BUSY_BACKOFF)
+                self._write(frame)
+        return bool(data)
+
+    def _write(self, frame: bytes) -> int:
+        start = time.perf_counter_ns()
+        self._ser.write(frame)
+        if self._metrics is not None:
+            self._metrics.on_write(len(frame), start)
+        self.window.on_send(frame)
+        return start
+
+    def submit(self, frame: bytes):
+        self._pump(block=False)
+        while not self.window.open:
+            if not self._pump(block=True):
+                self.window.expire()
+        start = self._write(frame)
+        if self._trace is not None:
+            self._trace.record(frame, start)
+
+    def drain(self):
+        while self.window.in_flight:
+            if not self._pump(block=True):
+                self.window.expire()
+
+class AsyncFramePipeline:
+    """Pipelined sender on the event loop: a reader callback matches Ack/Busy
+    replies to in-flight frames as they arrive and resends after a Busy."""
+
+    def __init__(
+        self,
+        ser: serial.Serial,
+        window: int = 4,
+        timeout: float = 0.5,
+        metrics: Optional[LinkMetrics] = None,
+        trace: Optional[TraceChannel] = None,
+    ):
+        self._ser = ser
+        self._timeout = timeout
+        self._metrics = metrics
+        self._trace = trace
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._fd: Optional[int] = None
+        self._resends = 0
+        self.window = TxWindow(window)
+        self.error: Optional[BaseException] = None  # port error seen by the reader callback
+
+    def start(self):
+        try:
+            fd = self._ser.fileno()
+            self._loop.add_reader(fd, self._on_readable)
+            self._fd = fd
+        except (AttributeError, NotImplementedError):
+            self._fd = None
+
+    def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+
+    def _on_readable(self):
+        try:
+            data = self._ser.read(max(self._ser.in_waiting, 1))
+        except PORT_ERRORS as e:
+            # 串口断开：停止监听，由 submit/drain 抛出
+            self.close()
+            self.error = e
+            self._changed.set()
+            return
+        if self._metrics is not None:
+            self._metrics.on_replies(data)
+        for code in data:
+            frame = self.window.on_reply(code)
+            if frame is not None:
+                self._resends += 1
+                self._loop.call_later(BUSY_BACKOFF, self._resend, frame)
+        if data:
+            self._changed.set()
+
+    def _resend(self, frame: bytes):
+        self._resends -= 1
+        if self._ser.is_open:
+            try:
+                self._write(frame)
+            except PORT_ERRORS as e:
+                # 与 _on_readable 相同：停止监听，由 submit/drain 抛出
+                self.close()
+                self.error = e
+        self._changed.set()
+
+    def _write(self, frame: bytes) -> int:
+        start = time.perf_counter_ns()
+        self._ser.write(frame)
+        if self._metrics is not None:
+            self._metrics.on_write(len(frame), start)
+        self.window.on_send(frame)
+        return start
+
+    async def _wait(self) -> bool:
+        """Wait for the next reply; False when none arrived within the timeout."""
+        if self.error is not None:
+            raise self.error
+        self._changed.clear()
+        if self._fd is None:
+            # 轮询时同样响应 _resend 的通知（包括重发时的串口错误）
+            deadline = self._loop.time() + self._timeout
+            while not self._changed.is_set():
+                if self._ser.in_waiting:
+                    self._on_readable()
+                    break
+                if self._loop.time() >= deadline:
+                    return False
+                await asyncio.sleep(POLL_INTERVAL)
+        else:
+            try:
+                await asyncio.wait_for(self._changed.wait(), self._timeout)
+            except asyncio.TimeoutError:
+                return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    async def submit(self, frame: bytes):
+        while not self.window.open:
+            if not await self._wait():
+                self.window.expire()
+        start = self._write(frame)
+        if self._trace is not None:
+            self._trace.record(frame, start)
+
+    async def drain(self):
+        while self.window.in_flight or self._resends:
+            if not await self._wait() and not self._resends:
+                self.window.expire()
+
+class AsyncEasyConSerial:
+    """asyncio transport for the EasyCon link.
+
+    The port is opened non-blocking and reads wait for readability on the
+    event loop, so a long sequence holds no OS thread.
+
+    An I/O error on the port closes it and marks the link lost (``lost_at``),
+    keeping the port name so ``reopen()`` can restore it; ``on_lost`` is
+    called so a LinkSupervisor can do that in the background.
+    """
+
+    def __init__(self):
+        self._ser: Optional[serial.Serial] = None
+        self._lock = asyncio.Lock()
+        self._port_name: Optional[str] = None
+        self._baud = 115200
+        self.metrics = LinkMetrics()
+        self.trace: Optional[TraceChannel] = None  # set while a trace is recording
+        self.lost_at: Optional[int] = None  # perf_counter_ns of the error that closed the port
+        self.on_lost: Optional[Callable[[BaseException], None]] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._ser is not None and self._ser.is_open
+
+    @property
+    def port(self) -> Optional[str]:
+        return self._port_name
+
+    @property
+    def baud(self) -> int:
+        return self._baud
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def connect(self, port: str, baud: int = 115200, timeout: float = 0.5):
+        if self.connected:
+            raise RuntimeError("Already connected")
+        self._ser = open_serial(port, baud, timeout=0, write_timeout=timeout)
+        self._port_name = port
+        self._baud = baud
+        self.lost_at = None
+
+    def reopen(self, timeout: float = 0.5):
+        """Open the port of a lost link again."""
+        if self._port_name is None:
+            raise RuntimeError("Serial not connected")
+        if not self.connected:
+            self._ser = open_serial(self._port_name, self._baud, timeout=0, write_timeout=timeout)
+
+    def lose(self, error: BaseException):
+        """Close the port after ``error`` but keep its name for reopen()."""
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            except PORT_ERRORS:
+                pass
+            self._ser = None
+        if self.lost_at is None:
+            self.lost_at = time.perf_counter_ns()
+        if self.on_lost is not None:
+            self.on_lost(error)
+
+    def disconnect(self):
+        self.lost_at = None
+        if self._ser:
+            try:
+                self._ser.close()
+            finally:
+                self._ser = None
+        self._port_name = None
+
+    def _check(self):
+        if not self.connected:
+            raise RuntimeError("Serial link lost, reconnecting" if self.lost_at is not None else "Serial not connected")
+
+    @contextlib.asynccontextmanager
+    async def _hold(self) -> AsyncIterator[None]:
+        """Hold the link; a port error inside marks the link lost and surfaces as RuntimeError."""
+        async with self._lock:
+            self._check()
+            try:
+                yield
+            except PORT_ERRORS as e:
+                self.lose(e)
+                raise RuntimeError(f"Serial link lost: {e}") from e
+
+    async def _wait_readable(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            fd = self._ser.fileno()
+            ready = loop.create_future()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        except (AttributeError, NotImplementedError):
+            await asyncio.sleep(min(POLL_INTERVAL, timeout))
+            return self._ser.in_waiting > 0
+        try:
+            await asyncio.wait_for(ready, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(fd)
+
+    async def _read(self, size: int, timeout: float, stop_early: bool = False) -> bytes:
+        """Read up to ``size`` bytes within ``timeout``; ``stop_early`` returns on the first chunk."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self._ser.read(size - len(buf))
+            if chunk:
+                buf += chunk
+                if stop_early:
+                    break
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not await self._wait_readable(remaining):
+                break
+        return bytes(buf)
+
+    def _write(self, data: bytes) -> int:
+        start = time.perf_counter_ns()
+        self._ser.write(data)
+        self._ser.flush()
+        self.metrics.on_write(len(data), start)
+        return start
+
+    async def _read_reply(self, length: Optional[int], timeout: float) -> bytes:
+        first = await self._read(1, timeout)
+        self.metrics.on_first_byte(first)
+        resp = await self._read_rest(first, length, timeout)
+        self.metrics.on_reply(resp)
+        return resp
+
+    async def _read_rest(self, first: bytes, length: Optional[int], timeout: float) -> bytes:
+        if not first or first[0] in (Reply.Busy, Reply.Error) or length == 1:
+            return first
+        if length is not None:
+            return first + await self._read(length - 1, timeout)
+        buf = bytearray(first)
+        while len(buf) < VARIABLE_REPLY_MAX_BYTES:
+            chunk = await self._read(VARIABLE_REPLY_MAX_BYTES - len(buf), REPLY_IDLE_GAP, stop_early=True)
+            if not chunk:
+                break
+            buf += chunk
+        return bytes(buf)
+
+    async def eat_verbose(self):
+        async with self._hold():
+            if self._ser.in_waiting:
+                _ = self._ser.read(self._ser.in_waiting)
+
+    async def send_and_recv(self, data: bytes, max_bytes: int = 255, timeout: float = 0.5) -> bytes:
+        """Raw exchange: reads until ``max_bytes`` arrive or ``timeout`` expires."""
+        async with self._hold():
+            self._write(data)
+            resp = await self._read(max_bytes, timeout)
+            self.metrics.on_raw(resp)
+            return resp
+
+    async def transact(self, data: bytes, timeout: float = 0.5, reply_bytes: int = 0) -> bytes:
+        """Send one request and return as soon as its complete reply has arrived.
+
+        A Busy reply is retried after BUSY_BACKOFF, up to BUSY_RETRIES times.
+        """
+        async with self._hold():
+            self._ser.reset_input_buffer()
+            start = self._write(data)
+            if self.trace is not None and is_report(data, reply_bytes):
+                self.trace.record(data, start)
+            length = reply_bytes or expected_reply_bytes(data)
+            resp = await self._read_reply(length, timeout)
+            for _ in range(BUSY_RETRIES):
+                if not resp or resp[0] != Reply.Busy:
+                    break
+                # 设备缓冲区满：稍后重发同一帧（重发不记入追踪）
+                await asyncio.sleep(BUSY_BACKOFF)
+                self._write(data)
+                resp = await self._read_reply(length, timeout)
+            return resp
+
+    async def handshake(self) -> bytes:
+        await self.eat_verbose()
+        resp = await self.transact(HELLO_REQUEST, timeout=0.5)
+        if not resp or resp[0] != Reply.Hello:
+            raise RuntimeError(f"Handshake failed, got: {binascii.hexlify(resp or b'').decode()}")
+        return resp
+
+    async def ping(self, timeout: float = 0.5) -> bool:
+        """Cheap liveness check: True when the device answers Hello."""
+        resp = await self.transact(HELLO_REQUEST, timeout)
+        return bool(resp) and resp[0] == Reply.Hello
+
+    async def flash(self, data: bytes, timeout: float = 0.5):
+        """Upload ``data`` to the device script area."""
+        async with self._hold():
+            for header, chunk in flash_packets(data):
+                self._ser.reset_input_buffer()
+                self._write(header)
+                check_reply(await self._read_reply(1, timeout), Reply.FlashStart, "Flash start")
+                self._write(chunk)
+                check_reply(await self._read_reply(1, timeout), Reply.FlashEnd, "Flash write")
+
+    async def script_start(self) -> bytes:
+        req = bytes([Command.Ready, Command.Ready, Command.ScriptStart])
+        return check_reply(await self.transact(req), Reply.ScriptAck, "Script start")
+
+    async def script_stop(self) -> bytes:
+        req = bytes([Command.Ready, Command.Ready, Command.ScriptStop])
+        return check_reply(await self.transact(req), Reply.ScriptAck, "Script stop")
+
+    def _transact_blocking(self, data: bytes, timeout: float = 0.5) -> bytes:
+        self._ser.reset_input_buffer()
+        start = self._write(data)
+        if self.trace is not None:
+            self.trace.record(data, start)
+        length = expected_reply_bytes(data)
+        try:
+            resp = read_reply(self._ser, length, timeout, self.metrics)
+            for _ in range(BUSY_RETRIES):
+                if not resp or resp[0] != Reply.Busy:
+                    break
+                time.sleep(BUSY_BACKOFF)
+                self._write(data)
+                resp = read_reply(self._ser, length, timeout, self.metrics)
+            return resp
+        finally:
+            self._ser.timeout = 0
+
+    @contextlib.asynccontextmanager
+    async def pipeline(self, window: int = 4, timeout: float = 0.5) -> AsyncIterator[AsyncFramePipeline]:
+        """Hold the link and stream report frames with up to ``window`` awaiting Ack."""
+        async with self._hold():
+            pipe = AsyncFramePipeline(self._ser, window, timeout, self.metrics, self.trace)
+            pipe.start()
+            try:
+                yield pipe
+                await pipe.drain()
+            finally:
+                pipe.close()
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, window: int = 1) -> AsyncIterator[Tuple[Callable[[bytes], Any], Optional[TxWindow]]]:
+        """Hold the link and yield ``(send, window)``: a blocking send for use off the event loop.
+
+        ``window`` > 1 yields a pipelined submit instead of a framed transact,
+        with the TxWindow counting its Acks; otherwise the window is None.
+        """
+        async with self._hold():
+            if window <= 1:
+                yield self._transact_blocking, None
+                return
+            pipe = FramePipeline(self._ser, window, metrics=self.metrics, trace=self.trace)
+            try:
+                yield pipe.submit, pipe.window
+                pipe.drain()
+            finally:
+                self._ser.timeout = 0
@@ -0,0 +1,702 @@
+"""Device broker: one process that owns the serial ports, jobs and macros.
+
+HTTP workers reach it over a Unix socket, so ``uvicorn --workers N`` can
+spread request parsing and validation across cores while serial timing
+stays in a single process.
+
+    python -m mcp_service.broker --socket /tmp/easycon-broker.sock
+    EASYCON_BROKER=/tmp/easycon-broker.sock uvicorn mcp_service.server:app --workers 4
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp_service.arbiter import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, priority_index
+from mcp_service.async_serial import AsyncEasyConSerial
+from mcp_service.devices import Device, DeviceRegistry
+from mcp_service.firmware_script import ScriptError, compile_script
+from mcp_service.jobs import Job, JobManager, JobWork
+from mcp_service.macro_store import DEFAULT_MACRO_DB, CompiledMacro, MacroStore
+from mcp_service.metrics import render_devices
+from mcp_service.profiler import compare_run, profile_timeline
+from mcp_service.program import Playable, Program, decode_program, encode_program
+from mcp_service.scheduler import NS_PER_MS, TimingConfig
+from mcp_service.serial_service import Reply
+from mcp_service.timeline import RESET_FRAME, Timeline, TimelineEntry, decode_timeline, encode_timeline
+from mcp_service.trace import (
+    DEFAULT_TRACE_DIR,
+    TRACE_HEADER,
+    TRACE_NAME,
+    TRACE_RECORD,
+    TRACE_SUFFIX,
+    TraceReader,
+    TraceRecorder,
+    TraceReplay,
+)
+
+DEFAULT_SOCKET = "/tmp/easycon-broker.sock"
+
+# 取消任务后的中立帧：Busy 已由 transact 重发，超时或仍未 Ack 时整帧重试
+RESET_ATTEMPTS = 3
+ACK_REPLY = bytes([Reply.Ack])
+
+# 消息帧：请求 ID(u32) 正文长度(u32) 操作码/状态(u8)
+# 正文：JSON 参数长度(u32) + JSON + 若干二进制块（长度 u32 + 数据），报告帧和时间线以二进制块传输
+MESSAGE_HEADER = struct.Struct("<IIB")
+BLOB_LENGTH = struct.Struct("<I")
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# 操作码即方法在此元组中的下标
+BROKER_METHODS = (
+    "connect", "disconnect", "status", "list_devices", "summary",
+    "handshake", "transact", "raw_send", "flash_macro", "script_start", "script_stop",
+    "run", "run_macro", "run_batch", "fanout",
+    "save_macro", "list_macros", "get_macro", "delete_macro",
+    "list_jobs", "get_job", "cancel_job", "job_result",
+    "timing_config", "configure", "jitter", "reset_jitter", "output",
+    "metrics", "macro_versions",
+    "trace_start", "trace_stop", "list_traces", "trace_info", "replay_trace",
+    "send_frame", "queue_stats",
+)
+
+class BrokerError(RuntimeError):
+    """An error carrying the HTTP status the API tier should answer with."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class Broker:
+    """Serial devices, background jobs and compiled macros behind one async API.
+
+    The HTTP layer uses a Broker in-process by default; ``BrokerServer`` and
+    ``BrokerClient`` expose the same methods to other processes. Macros are
+    kept in a MacroStore at ``macro_db`` (``EASYCON_MACROS`` by default),
+    traces in ``trace_dir`` (``EASYCON_TRACES``).
+    """
+
+    def __init__(self, macro_db: Optional[str] = None, trace_dir: Optional[str] = None):
+        self.devices = DeviceRegistry()
+        self.jobs = JobManager(on_cancel=self._reset)
+        self.macros = MacroStore(macro_db or os.environ.get("EASYCON_MACROS", DEFAULT_MACRO_DB))
+        self.trace_dir = trace_dir or os.environ.get("EASYCON_TRACES", DEFAULT_TRACE_DIR)
+        self.recorder: Optional[TraceRecorder] = None
+
+    def _device(self, device: str) -> Device:
+        dev = self.devices.get(device)
+        if dev is None:
+            raise BrokerError(404, f"Device not found: {device}")
+        return dev
+
+    def _link(self, device: str) -> AsyncEasyConSerial:
+        dev = self.devices.get(device)
+        if dev is None or not dev.connected:
+            if dev is not None and dev.link.lost_at is not None:
+                raise BrokerError(503, "Serial link lost, reconnecting")
+            raise BrokerError(400, "Serial not connected")
+        return dev.link
+
+    def _macro(self, name: str) -> CompiledMacro:
+        macro = self.macros.compiled(name)
+        if macro is None:
+            raise BrokerError(404, f"Macro not found: {name}")
+        return macro
+
+    def _resolve(self, timeline: Playable, chain: Tuple[str, ...] = (), background: bool = False) -> Playable:
+        """Link a program's macro calls and refuse endless ones outside background jobs."""
+        if not isinstance(timeline, Program):
+            return timeline
+        if not timeline.linked:
+            try:
+                timeline = timeline.link(lambda name: self._macro(name).timeline, chain)
+            except ValueError as e:
+                raise BrokerError(400, str(e))
+        if timeline.endless and not background:
+            raise BrokerError(400, "Macro loops until cancelled; run it with background: true")
+        return timeline
+
+    async def _profile(self, device: str, timeline: Playable, repeat: int) -> Dict[str, Any]:
+        """Dry-run profile with the device's baud and measured round trips when it is known; never touches the port."""
+        dev = self.devices.get(device)
+        args = (timeline, repeat, self.devices.config)
+        if dev is not None:
+            args += (dev.link.baud, dev.link.metrics)
+        if isinstance(timeline, Program):
+            # 长程序要走很多条目，放到线程里以免阻塞其他设备的时间线
+            return await asyncio.get_running_loop().run_in_executor(None, profile_timeline, *args)
+        return profile_timeline(*args)
+
+    def _trace_path(self, name: str) -> str:
+        if not TRACE_NAME.match(name):
+            raise BrokerError(400, f"Invalid trace name: {name}")
+        return os.path.join(self.trace_dir, name + TRACE_SUFFIX)
+
+    def _open_trace(self, name: str) -> TraceReader:
+        try:
+            return TraceReader(self._trace_path(name))
+        except FileNotFoundError:
+            raise BrokerError(404, f"Trace not found: {name}")
+        except ValueError as e:
+            raise BrokerError(400, f"{e}: {name}")
+
+    def _job(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise BrokerError(404, f"Job not found: {job_id}")
+        return job
+
+    @staticmethod
+    def _priority(priority: Optional[str], background: bool) -> int:
+        """Named priority; background jobs default to "background", other runs to "normal"."""
+        if priority is None:
+            return PRIORITY_BACKGROUND if background else PRIORITY_NORMAL
+        try:
+            return priority_index(priority)
+        except ValueError as e:
+            raise BrokerError(400, str(e))
+
+    def _submit(self, device: str, kind: str, work: JobWork, steps: int, repeats: int = 1) -> Dict[str, Any]:
+        try:
+            job = self.jobs.submit(kind, device, work, steps, repeats)
+        except RuntimeError as e:
+            raise BrokerError(429, str(e))
+        return {"ok": True, "jobId": job.id, "state": job.state}
+
+    async def _reset(self, device: str):
+        """Release every input after a cancelled job, ahead of queued runs, until the device acks."""
+        dev = self.devices.get(device)
+        if dev is None or not dev.connected:
+            return
+        for _ in range(RESET_ATTEMPTS):
+            _, reply = await dev.send(RESET_FRAME, PRIORITY_INTERACTIVE)
+            # None：由另一个运行插入播放，已按其发送路径送达
+            if reply is None or reply[:1] == ACK_REPLY:
+                return
+        raise RuntimeError(f"device did not acknowledge the neutral report: {reply.hex() or 'timeout'}")
+
+    async def connect(self, device: str, port: str, baud: int = 115200) -> Dict[str, Any]:
+        dev = self.devices.connect(device, port, baud)
+        if self.recorder is not None:
+            dev.link.trace = self.recorder.channel(device)
+        return {"ok": True, "device": device, "port": port}
+
+    async def disconnect(self, device: str):
+        self.devices.disconnect(device)
+
+    async def status(self, device: str) -> Dict[str, Any]:
+        dev = self.devices.get(device)
+        return {
+            "device": device,
+            "connected": dev is not None and dev.connected,
+            "port": dev.link.port if dev else None,
+            "link": dev.supervisor.to_dict() if dev else None,
+        }
+
+    async def list_devices(self) -> List[Dict[str, Any]]:
+        return [dev.to_dict() for dev in self.devices.list()]
+
+    async def summary(self) -> Dict[str, int]:
+        return {"devices": len(self.devices.list()), "macros": len(self.macros)}
+
+    async def handshake(self, device: str) -> bytes:
+        return await self._link(device).handshake()
+
+    async def transact(self, device: str, data: bytes) -> bytes:
+        return await self._link(device).transact(data)
+
+    async def send_frame(self, device: str, frame: bytes) -> Dict[str, Any]:
+        """Send one report at interactive priority, cutting into a running timeline at its next step boundary."""
+        self._link(device)
+        wait_ns, _ = await self.devices.get(device).send(frame, PRIORITY_INTERACTIVE)
+        return {"ok": True, "queueMs": round(wait_ns / NS_PER_MS, 3)}
+
+    async def raw_send(self, device: str, data: bytes, max_bytes: int = 255, timeout: float = 0.5) -> bytes:
+        return await self._link(device).send_and_recv(data, max_bytes=max_bytes, timeout=timeout)
+
+    async def flash_macro(self, device: str, name: str, repeat: int = 1) -> int:
+        link = self._link(device)
+        timeline = self._resolve(self._macro(name).timeline, (name,))
+        try:
+            if isinstance(timeline, Program):
+                # 固件脚本没有循环指令，只能展开；大小由 compile_script 检查
+                if timeline.endless:
+                    raise ScriptError("Macro loops until cancelled; a firmware script cannot hold it")
+                timeline = tuple(timeline)
+            data = compile_script(timeline, repeat)
+        except ScriptError as e:
+            raise BrokerError(400, str(e))
+        await link.flash(data)
+        return len(data)
+
+    async def script_start(self, device: str) -> bytes:
+        return await self._link(device).script_start()
+
+    async def script_stop(self, device: str) -> bytes:
+        return await self._link(device).script_stop()
+
+    async def run(
+        self,
+        device: str,
+        timeline: Playable,
+        repeat: int = 1,
+        info: Optional[Dict[str, Any]] = None,
+        background: bool = False,
+        kind: str = "sequence",
+        steps: int = 0,
+        priority: Optional[str] = None,
+        dry_run: bool = False,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        """Play a timeline or program; with ``background`` queue it as a job and return its ID.
+
+        ``dry_run`` returns the profile of the run instead of playing it, and
+        ``profile`` adds it to the result with a planned-vs-actual comparison.
+        """
+        if dry_run:
+            timeline = self._resolve(timeline, background=True)
+            return {"ok": True, "dryRun": True, **(info or {}), "profile": await self._profile(device, timeline, repeat)}
+        self._link(device)
+        dev = self.devices.get(device)
+        timeline = self._resolve(timeline, background=background)
+        level = self._priority(priority, background)
+        plan = await self._profile(device, timeline, repeat) if profile else None
+
+        async def work(job: Optional[Job] = None) -> Dict[str, Any]:
+            progress = job.progress if job else None
+            timing = await dev.play(timeline, repeat, progress, level, trace_steps=plan is not None)
+            result = {"ok": True, **(info or {}), "timing": timing.to_dict()}
+            if plan is not None:
+                result["profile"] = {**plan, "comparison": compare_run(plan, timing)}
+            return result
+
+        if background:
+            return self._submit(device, kind, work, steps, repeat)
+        return await work()
+
+    async def run_macro(
+        self,
+        device: str,
+        name: str,
+        repeat: int = 1,
+        background: bool = False,
+        priority: Optional[str] = None,
+        dry_run: bool = False,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        if not dry_run:
+            self._link(device)
+        macro = self._macro(name)
+        timeline = self._resolve(macro.timeline, (name,), background or dry_run)
+        info = {"name": name, "version": macro.version, "repeats": repeat}
+        return await self.run(device, timeline, repeat, info, background, "macro", macro.steps, priority, dry_run, profile)
+
+    async def run_batch(
+        self,
+        device: str,
+        timeline: Timeline,
+        count: int,
+        background: bool = False,
+        priority: Optional[str] = None,
+        dry_run: bool = False,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        """Play a compiled batch as one timeline whose entry steps are command indexes.
+
+        Results carry each command's planned start and, for commands that send a
+        frame, when its first frame actually went out. ``dry_run`` and
+        ``profile`` work as for ``run()``.
+        """
+        if dry_run:
+            plan = await self._profile(device, timeline, 1)
+            return {"ok": True, "dryRun": True, "results": _batch_results(timeline, count, None), "profile": plan}
+        self._link(device)
+        dev = self.devices.get(device)
+        level = self._priority(priority, background)
+        plan = await self._profile(device, timeline, 1) if profile else None
+
+        async def work(job: Optional[Job] = None) -> Dict[str, Any]:
+            timing = await dev.play(timeline, 1, job.progress if job else None, level, trace_steps=True)
+            result = {"ok": True, "results": _batch_results(timeline, count, timing.steps), "timing": timing.to_dict()}
+            if plan is not None:
+                result["profile"] = {**plan, "comparison": compare_run(plan, timing)}
+            return result
+
+        if background:
+            return self._submit(device, "batch", work, count)
+        return await work()
+
+    async def fanout(self, name: str, devices: List[str], repeat: int = 1, start_delay_ms: int = 50) -> Dict[str, Any]:
+        timeline = self._resolve(self._macro(name).timeline, (name,))
+        for device in devices:
+            self._link(device)
+        targets = [self.devices.get(device) for device in dict.fromkeys(devices)]
+        results = await self.devices.fanout(targets, timeline, repeat, start_delay_ms)
+        return {
+            "ok": not any(isinstance(r, BaseException) for r in results),
+            "name": name,
+            "repeats": repeat,
+            "devices": [
+                {"device": dev.id, "ok": False, "error": str(r)} if isinstance(r, BaseException)
+                else {"device": dev.id, "ok": True, "timing": r.to_dict()}
+                for dev, r in zip(targets, results)
+            ],
+        }
+
+    async def save_macro(self, name: str, steps: List[Dict[str, Any]], timeline: Playable) -> Dict[str, Any]:
+        version = self.macros.save(name, steps, timeline)
+        return {"ok": True, "name": name, "steps": len(steps), "version": version}
+
+    async def list_macros(self, prefix: str = "", offset: int = 0, limit: int = 100) -> Dict[str, Any]:
+        items, total = self.macros.list(prefix, offset, limit)
+        end = offset + len(items)
+        return {"macros": items, "total": total, "nextOffset": end if end < total else None}
+
+    async def get_macro(self, name: str, version: Optional[int] = None) -> Dict[str, Any]:
+        macro = self.macros.get(name, version)
+        if macro is None:
+            detail = name if version is None else f"{name} version {version}"
+            raise BrokerError(404, f"Macro not found: {detail}")
+        return macro
+
+    async def macro_versions(self, name: str) -> Dict[str, Any]:
+        versions = self.macros.versions(name)
+        if not versions:
+            raise BrokerError(404, f"Macro not found: {name}")
+        return {"name": name, "versions": versions}
+
+    async def delete_macro(self, name: str) -> Dict[str, Any]:
+        if not self.macros.delete(name):
+            raise BrokerError(404, f"Macro not found: {name}")
+        return {"ok": True, "name": name}
+
+    async def trace_start(self, name: Optional[str] = None) -> Dict[str, Any]:
+        """Start recording every report sent to any device into ``trace_dir/name.trace``."""
+        if self.recorder is not None:
+            raise BrokerError(409, f"Already recording trace: {self.recorder.to_dict()['name']}")
+        name = name or time.strftime("trace-%Y%m%d-%H%M%S")
+        path = self._trace_path(name)
+        os.makedirs(self.trace_dir, exist_ok=True)
+        try:
+            self.recorder = TraceRecorder(path)
+        except FileExistsError:
+            raise BrokerError(409, f"Trace already exists: {name}")
+        for dev in self.devices.list():
+            dev.link.trace = self.recorder.channel(dev.id)
+        return {"ok": True, **self.recorder.to_dict()}
+
+    async def trace_stop(self) -> Dict[str, Any]:
+        if self.recorder is None:
+            raise BrokerError(409, "No trace is recording")
+        recorder, self.recorder = self.recorder, None
+        for dev in self.devices.list():
+            dev.link.trace = None
+        recorder.close()
+        return {"ok": True, **recorder.to_dict()}
+
+    async def list_traces(self) -> Dict[str, Any]:
+        traces = []
+        if os.path.isdir(self.trace_dir):
+            for entry in sorted(os.scandir(self.trace_dir), key=lambda e: e.name):
+                if entry.name.endswith(TRACE_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    traces.append({
+                        "name": entry.name[:-len(TRACE_SUFFIX)],
+                        "records": max(stat.st_size - TRACE_HEADER.size, 0) // TRACE_RECORD.size,
+                        "bytes": stat.st_size,
+                        "modifiedAt": stat.st_mtime,
+                    })
+        return {"traces": traces, "recording": self.recorder.to_dict() if self.recorder is not None else None}
+
+    async def trace_info(self, name: str) -> Dict[str, Any]:
+        reader = self._open_trace(name)
+        try:
+            # 需要读完整个文件，放到线程里以免阻塞其他设备的时间线
+            info = await asyncio.get_running_loop().run_in_executor(None, reader.info)
+        finally:
+            reader.close()
+        return {"name": name, **info}
+
+    async def replay_trace(
+        self, device: str, name: str, source: Optional[str] = None, repeat: int = 1, background: bool = False
+    ) -> Dict[str, Any]:
+        """Replay the frames ``source`` received in a trace on ``device``, at their recorded times."""
+        self._link(device)
+        dev = self.devices.get(device)
+        with self._open_trace(name) as trace:
+            try:
+                slot = await asyncio.get_running_loop().run_in_executor(None, trace.slot, source)
+            except ValueError as e:
+                raise BrokerError(400, str(e))
+
+        async def work(job: Optional[Job] = None) -> Dict[str, Any]:
+            # 任务开始时才映射文件，排队中被取消的任务不占用文件
+            with self._open_trace(name) as trace:
+                replay = TraceReplay(trace, slot)
+                timing = await dev.play(replay, repeat, job.progress if job else None, self._priority(None, background))
+            return {"ok": True, "name": name, "source": source, "repeats": repeat, "timing": timing.to_dict()}
+
+        if background:
+            return self._submit(device, "replay", work, 0, repeat)
+        return await work()
+
+    async def list_jobs(self) -> List[Dict[str, Any]]:
+        return [job.to_dict() for job in self.jobs.list()]
+
+    async def get_job(self, job_id: str) -> Dict[str, Any]:
+        return self._job(job_id).to_dict()
+
+    async def cancel_job(self, job_id: str) -> Dict[str, Any]:
+        self._job(job_id)
+        job = await self.jobs.cancel(job_id)
+        return {"ok": True, **job.to_dict()}
+
+    async def job_result(self, job_id: str) -> Dict[str, Any]:
+        job = self._job(job_id)
+        if not job.finished:
+            raise BrokerError(409, f"Job not finished: {job.state}")
+        return {"id": job.id, "state": job.state, "result": job.result, "error": job.error}
+
+    async def timing_config(self) -> Dict[str, Any]:
+        return vars(self.devices.config)
+
+    async def configure(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        self.devices.configure(TimingConfig(**config))
+        return vars(self.devices.config)
+
+    async def jitter(self, device: str) -> Dict[str, Any]:
+        executor = self._device(device).executor
+        return {**executor.jitter.to_dict(), "precision": executor.config.precision}
+
+    async def reset_jitter(self, device: str):
+        self._device(device).executor.jitter.reset()
+
+    async def output(self, device: str) -> Dict[str, Any]:
+        executor = self._device(device).executor
+        return {**executor.output, "diffFrames": executor.config.diffFrames}
+
+    async def queue_stats(self, device: str) -> Dict[str, Any]:
+        return self._device(device).arbiter.to_dict()
+
+    async def metrics(self) -> str:
+        """Per-device link and timing metrics in Prometheus text format."""
+        return render_devices(self.devices.list())
+
+def _batch_results(
+    timeline: Timeline, count: int, steps: Optional[List[Tuple[int, int, int]]]
+) -> List[Dict[str, Any]]:
+    """Per-command planned start/duration from the timeline, actual start from the traced steps."""
+    planned = [0] * count
+    duration = [0] * count
+    offset = 0
+    seen = set()
+    for entry in timeline:
+        if entry.step not in seen:
+            seen.add(entry.step)
+            planned[entry.step] = offset
+        duration[entry.step] += entry.holdMs
+        offset += entry.holdMs * NS_PER_MS
+    late = {step: late_ns for step, _, late_ns in steps or ()}
+    results = []
+    for i in range(count):
+        result = {"index": i, "ok": True, "plannedMs": round(planned[i] / NS_PER_MS, 3), "durationMs": duration[i]}
+        if i in late:
+            result["actualMs"] = round((planned[i] + late[i]) / NS_PER_MS, 3)
+            result["lateMs"] = round(late[i] / NS_PER_MS, 3)
+        results.append(result)
+    return results
+
+def _pack(value: Any, blobs: List[bytes]) -> Any:
+    """Replace bytes, timelines and programs with references to binary blobs."""
+    if isinstance(value, (bytes, bytearray)):
+        blobs.append(bytes(value))
+        return {"$b": len(blobs) - 1}
+    if isinstance(value, Program):
+        blobs.append(encode_program(value))
+        return {"$p": len(blobs) - 1}
+    if isinstance(value, tuple) and value and isinstance(value[0], TimelineEntry):
+        blobs.append(encode_timeline(value))
+        return {"$t": len(blobs) - 1}
+    if isinstance(value, (list, tuple)):
+        return [_pack(v, blobs) for v in value]
+    if isinstance(value, dict):
+        return {k: _pack(v, blobs) for k, v in value.items()}
+    return value
+
+def _unpack(value: Any, blobs: List[bytes]) -> Any:
+    if isinstance(value, dict):
+        if "$b" in value:
+            return blobs[value["$b"]]
+        if "$t" in value:
+            return decode_timeline(blobs[value["$t"]])
+        if "$p" in value:
+            return decode_program(blobs[value["$p"]])
+        return {k: _unpack(v, blobs) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unpack(v, blobs) for v in value]
+    return value
+
+def encode_message(msg_id: int, code: int, payload: Any) -> bytes:
+    blobs: List[bytes] = []
+    doc = json.dumps(_pack(payload, blobs), separators=(",", ":")).encode()
+    body = bytearray(BLOB_LENGTH.pack(len(doc)))
+    body += doc
+    for blob in blobs:
+        body += BLOB_LENGTH.pack(len(blob))
+        body += blob
+    return MESSAGE_HEADER.pack(msg_id, len(body), code) + bytes(body)
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[int, int, Any]:
+    msg_id, length, code = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    body = await reader.readexactly(length)
+    (size,) = BLOB_LENGTH.unpack_from(body)
+    offset = BLOB_LENGTH.size + size
+    doc = json.loads(body[BLOB_LENGTH.size:offset])
+    blobs = []
+    while offset < len(body):
+        (size,) = BLOB_LENGTH.unpack_from(body, offset)
+        offset += BLOB_LENGTH.size
+        blobs.append(body[offset:offset + size])
+        offset += size
+    return msg_id, code, _unpack(doc, blobs)
+
+class BrokerServer:
+    """Serves a Broker on a Unix socket; each request runs as its own task."""
+
+    def __init__(self, broker: Broker, path: str = DEFAULT_SOCKET):
+        self.broker = broker
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"EasyCon broker listening on {self.path}", flush=True)
+        await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = set()
+        try:
+            while True:
+                msg_id, op, payload = await read_message(reader)
+                task = asyncio.get_running_loop().create_task(self._dispatch(writer, msg_id, op, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, writer: asyncio.StreamWriter, msg_id: int, op: int, payload: Dict[str, Any]):
+        try:
+            method = getattr(self.broker, BROKER_METHODS[op])
+            message = encode_message(msg_id, STATUS_OK, await method(*payload["a"], **payload["k"]))
+        except BrokerError as e:
+            message = encode_message(msg_id, STATUS_ERROR, {"status": e.status, "error": str(e)})
+        except Exception as e:
+            message = encode_message(msg_id, STATUS_ERROR, {"status": None, "error": str(e)})
+        try:
+            writer.write(message)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+class BrokerClient:
+    """Calls a Broker in another process; has the same async methods as Broker.
+
+    Requests are multiplexed over one connection per event loop, so a long
+    macro run does not hold up status or job polling from the same worker.
+    """
+
+    def __init__(self, path: str = DEFAULT_SOCKET):
+        self.path = path
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._opening: Optional[asyncio.Task] = None
+
+    async def _writer(self) -> asyncio.StreamWriter:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._opening is None:
+            self._loop = loop
+            self._opening = loop.create_task(self._open())
+        try:
+            return await asyncio.shield(self._opening)
+        except OSError as e:
+            self._opening = None
+            raise RuntimeError(f"Broker not reachable at {self.path}: {e}")
+
+    async def _open(self) -> asyncio.StreamWriter:
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        asyncio.get_running_loop().create_task(self._read(reader, asyncio.current_task()))
+        return writer
+
+    async def _read(self, reader: asyncio.StreamReader, opening: asyncio.Task):
+        try:
+            while True:
+                msg_id, status, payload = await read_message(reader)
+                future = self._pending.pop(msg_id, None)
+                if future is None or future.done():
+                    continue
+                if status == STATUS_OK:
+                    future.set_result(payload)
+                elif payload["status"] is None:
+                    future.set_exception(RuntimeError(payload["error"]))
+                else:
+                    future.set_exception(BrokerError(payload["status"], payload["error"]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self._opening is opening:
+                self._opening = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(RuntimeError("Broker connection lost"))
+
+    async def call(self, method: str, *args, **kwargs) -> Any:
+        writer = await self._writer()
+        msg_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = future
+        try:
+            writer.write(encode_message(msg_id, BROKER_METHODS.index(method), {"a": list(args), "k": kwargs}))
+            await writer.drain()
+            return await future
+        finally:
+            self._pending.pop(msg_id, None)
+
+    def __getattr__(self, name: str):
+        if name not in BROKER_METHODS:
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+def main():
+    parser = argparse.ArgumentParser(description="EasyCon device broker")
+    parser.add_argument("--socket", default=os.environ.get("EASYCON_BROKER", DEFAULT_SOCKET))
+    parser.add_argument("--macros", default=os.environ.get("EASYCON_MACROS", DEFAULT_MACRO_DB), help="macro database file")
+    parser.add_argument("--traces", default=os.environ.get("EASYCON_TRACES", DEFAULT_TRACE_DIR), help="trace directory")
+    args = parser.parse_args()
+    try:
+        asyncio.run(BrokerServer(Broker(args.macros, args.traces), args.socket).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
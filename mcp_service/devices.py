@@ -0,0 +1,129 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from mcp_service.arbiter import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, LinkArbiter, Turn
+from mcp_service.async_serial import AsyncEasyConSerial
+from mcp_service.program import Playable
+from mcp_service.scheduler import NS_PER_MS, RunProgress, RunTiming, TimingConfig, TimingExecutor
+from mcp_service.supervisor import LinkSupervisor
+from mcp_service.timeline import Timeline, TimelineEntry
+
+DEFAULT_DEVICE = "default"
+
+@dataclass
+class Device:
+    id: str
+    link: AsyncEasyConSerial = field(default_factory=AsyncEasyConSerial)
+    executor: TimingExecutor = field(default_factory=TimingExecutor)
+    arbiter: LinkArbiter = field(default_factory=LinkArbiter)
+    supervisor: LinkSupervisor = field(init=False)
+
+    def __post_init__(self):
+        self.supervisor = LinkSupervisor(self.link, self.arbiter)
+
+    @property
+    def connected(self) -> bool:
+        return self.link.connected
+
+    async def play(
+        self,
+        timeline: Playable,
+        repeat: int = 1,
+        progress: Optional[RunProgress] = None,
+        priority: int = PRIORITY_NORMAL,
+        start_ns: Optional[int] = None,
+        trace_steps: bool = False,
+    ) -> RunTiming:
+        """Play ``timeline`` once the device is free, or inside a lower-priority run at its next step boundary."""
+        turn = Turn(priority, timeline, repeat, progress, trace_steps)
+        timing = await self.arbiter.acquire(turn)
+        if timing is not None:
+            return timing
+        try:
+            timing = await self.executor.run_async(
+                self.link, timeline, repeat, progress, start_ns, trace_steps, self.arbiter, priority
+            )
+        finally:
+            self.arbiter.release()
+        timing.queuedNs = turn.waitNs
+        return timing
+
+    async def send(self, frame: bytes, priority: int = PRIORITY_INTERACTIVE) -> Tuple[int, Optional[bytes]]:
+        """Send one report as soon as the device is free or at a running timeline's next step boundary.
+
+        Returns the queue wait in ns and the device's reply, None when the
+        report was played inside another run.
+        """
+        turn = Turn(priority, (TimelineEntry(0, frame, 0),))
+        reply = None
+        if await self.arbiter.acquire(turn) is None:
+            try:
+                reply = await self.link.transact(frame)
+            finally:
+                self.arbiter.release()
+        return turn.waitNs, reply
+
+    def to_dict(self):
+        return {"id": self.id, "connected": self.link.connected, "port": self.link.port, "state": self.supervisor.state}
+
+class DeviceRegistry:
+    """EasyCon adapters by device ID, each with its own link and timeline executor.
+
+    Links are independent asyncio transports, so timelines on different
+    devices run concurrently on the event loop (or on one pinned thread per
+    device when the timing config sets ``cpu``). Each connected link is
+    watched by its device's LinkSupervisor, so ``connect`` must run on the
+    event loop.
+    """
+
+    def __init__(self):
+        self._devices: Dict[str, Device] = {}
+        self.config = TimingConfig()
+
+    def get(self, device_id: str) -> Optional[Device]:
+        return self._devices.get(device_id)
+
+    def list(self) -> List[Device]:
+        return list(self._devices.values())
+
+    def connect(self, device_id: str, port: str, baud: int = 115200) -> Device:
+        for other in self._devices.values():
+            if other.id != device_id and other.link.port == port:
+                raise RuntimeError(f"Port {port} already used by device {other.id}")
+        device = self._devices.get(device_id)
+        if device is None:
+            device = Device(device_id)
+            device.executor.configure(self.config)
+        if device.link.connected:
+            raise RuntimeError("Already connected")
+        device.supervisor.stop()
+        try:
+            device.link.connect(port, baud)
+        finally:
+            if device.link.port is not None:
+                # 打开失败时继续监督原来的链路（断开后保留了端口名）
+                device.supervisor.start()
+        self._devices[device_id] = device
+        return device
+
+    def disconnect(self, device_id: str):
+        device = self._devices.pop(device_id, None)
+        if device is not None:
+            device.supervisor.stop()
+            device.link.disconnect()
+
+    def configure(self, config: TimingConfig):
+        for device in self._devices.values():
+            device.executor.configure(config)
+        self.config = config
+
+    async def fanout(
+        self, devices: Sequence[Device], timeline: Timeline, repeat: int = 1, start_delay_ms: int = 50
+    ) -> List[RunTiming]:
+        """Start ``timeline`` on every device at the same monotonic instant."""
+        start_ns = time.perf_counter_ns() + start_delay_ms * NS_PER_MS
+        return await asyncio.gather(*[
+            d.play(timeline, repeat, start_ns=start_ns) for d in devices
+        ], return_exceptions=True)
@@ -0,0 +1,289 @@
+"""Software EasyCon device for running the service without hardware.
+
+``EasyConEmulator`` models the firmware's serial protocol (handshake, device
+commands, report frames, flash upload and script playback); ``PtyEmulator``
+exposes it on a Linux pseudo-terminal so AsyncEasyConSerial can connect to it,
+optionally delaying replies to model link and firmware latency.
+
+    python -m mcp_service.emulator --latency-ms 1 --jitter-ms 0.5 --busy-rate 0.05
+"""
+import argparse
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from mcp_service.firmware_script import SCRIPT_MAX_BYTES, ScriptError, decode_script
+from mcp_service.serial_service import Command, Reply
+from mcp_service.switch_protocol import SwitchReport
+
+# 命令参数字节数（不含 A5 A5 cmd）
+COMMAND_ARGS: Dict[int, int] = {
+    Command.Flash: 4,
+    Command.LED: 1,
+    Command.ChangeControllerMode: 1,
+    Command.ChangeControllerColor: 6,
+    Command.ChangeAmiiboIndex: 1,
+}
+REPORT_HISTORY = 100000
+
+class EasyConEmulator:
+    """``busy_rate`` is the chance that a report frame is refused with Busy
+    instead of applied and Acked; ``seed`` makes the sequence repeatable."""
+
+    def __init__(self, version: bytes = b"EMU-1.0", busy_rate: float = 0.0, seed: Optional[int] = None):
+        self.version = version
+        self.busy_rate = busy_rate
+        self.busy = 0
+        self._rng = random.Random(seed)
+        self.report = SwitchReport()
+        self.reports: Deque[Tuple[int, SwitchReport]] = deque(maxlen=REPORT_HISTORY)
+        self.led = False
+        self.controller_mode = 0
+        self.flash_memory = bytearray(SCRIPT_MAX_BYTES)
+        self._buf = bytearray()
+        self._flash_target: Optional[Tuple[int, int]] = None  # (address, length) while receiving data
+        self._lock = threading.Lock()
+        self._script_stop = threading.Event()
+        self._script_thread: Optional[threading.Thread] = None
+
+    @property
+    def script_running(self) -> bool:
+        return self._script_thread is not None and self._script_thread.is_alive()
+
+    def feed(self, data: bytes) -> bytes:
+        """Consume bytes from the host and return the device's replies."""
+        with self._lock:
+            self._buf += data
+            out = bytearray()
+            while self._buf:
+                reply = self._step()
+                if reply is None:
+                    break
+                out += reply
+            return bytes(out)
+
+    def _step(self) -> Optional[bytes]:
+        """Handle one complete packet at the head of the buffer; None if incomplete."""
+        buf = self._buf
+        if self._flash_target is not None:
+            address, length = self._flash_target
+            if len(buf) < length:
+                return None
+            self.flash_memory[address:address + length] = buf[:length]
+            del buf[:length]
+            self._flash_target = None
+            return bytes([Reply.FlashEnd])
+        if buf[0] == Command.Ready:
+            if len(buf) < 3:
+                return None
+            if buf[1] != Command.Ready:
+                del buf[:1]
+                return b""
+            cmd = buf[2]
+            nargs = COMMAND_ARGS.get(cmd, 0)
+            if len(buf) < 3 + nargs:
+                return None
+            args = bytes(buf[3:3 + nargs])
+            del buf[:3 + nargs]
+            return self._command(cmd, args)
+        end = next((i for i, b in enumerate(buf) if b & 0x80), None)
+        if end is None:
+            return None
+        packet = bytes(buf[:end + 1])
+        del buf[:end + 1]
+        if len(packet) != 8:
+            return b""  # 不完整的报告帧：丢弃并重新同步
+        return self._on_report(SwitchReport.from_bytes(packet))
+
+    def _on_report(self, report: SwitchReport) -> bytes:
+        if self.busy_rate and self._rng.random() < self.busy_rate:
+            self.busy += 1
+            return bytes([Reply.Busy])
+        self.report = report
+        self.reports.append((time.perf_counter_ns(), report))
+        return bytes([Reply.Ack])
+
+    def _command(self, cmd: int, args: bytes) -> bytes:
+        if cmd == Command.Hello:
+            return bytes([Reply.Hello])
+        if cmd == Command.Version:
+            return self.version
+        if cmd == Command.LED:
+            self.led = bool(args[0])
+        elif cmd == Command.ChangeControllerMode:
+            self.controller_mode = args[0]
+        elif cmd == Command.Flash:
+            address = args[0] | (args[1] << 7)
+            length = args[2] | (args[3] << 7)
+            if address + length > len(self.flash_memory):
+                return bytes([Reply.Error])
+            self._flash_target = (address, length)
+            return bytes([Reply.FlashStart])
+        elif cmd == Command.ScriptStart:
+            self._start_script()
+            return bytes([Reply.ScriptAck])
+        elif cmd == Command.ScriptStop:
+            self._stop_script()
+            return bytes([Reply.ScriptAck])
+        return bytes([Reply.Ack])
+
+    def _start_script(self):
+        self._stop_script()
+        try:
+            repeat, entries = decode_script(bytes(self.flash_memory))
+        except ScriptError:
+            return
+        self._script_stop.clear()
+        self._script_thread = threading.Thread(
+            target=self._play_script, args=(repeat, entries), name="easycon-emulator-script", daemon=True
+        )
+        self._script_thread.start()
+
+    def _stop_script(self):
+        if self._script_thread is not None:
+            self._script_stop.set()
+            self._script_thread.join()
+            self._script_thread = None
+
+    def _play_script(self, repeat: int, entries):
+        done = 0
+        while repeat == 0 or done < repeat:
+            start = time.perf_counter_ns()
+            offset = 0
+            for command, hold in entries:
+                report = SwitchReport(
+                    button=(command[0] << 8) | command[1],
+                    HAT=command[2], LX=command[3], LY=command[4], RX=command[5], RY=command[6],
+                )
+                self.report = report
+                self.reports.append((time.perf_counter_ns(), report))
+                offset += hold * 1_000_000
+                if self._script_stop.wait(max(start + offset - time.perf_counter_ns(), 0) / 1e9):
+                    return
+            done += 1
+        self.report = SwitchReport()
+
+class PtyEmulator:
+    """Serves an EasyConEmulator on a pseudo-terminal (Linux/macOS).
+
+    Replies are written ``latency_ms`` plus a uniform ``jitter_ms`` after the
+    request arrived, in order, by a separate writer thread.
+    """
+
+    def __init__(
+        self,
+        device: Optional[EasyConEmulator] = None,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.device = device or EasyConEmulator()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._rng = random.Random(seed)
+        self._replies: "queue.Queue[Optional[Tuple[int, bytes]]]" = queue.Queue()
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._writer: Optional[threading.Thread] = None
+        self.port: Optional[str] = None
+
+    @property
+    def delayed(self) -> bool:
+        return self.latency_ms > 0 or self.jitter_ms > 0
+
+    def start(self) -> str:
+        import pty
+        import tty
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._serve, name="easycon-emulator", daemon=True)
+        self._thread.start()
+        if self.delayed:
+            self._writer = threading.Thread(target=self._write_delayed, name="easycon-emulator-tx", daemon=True)
+            self._writer.start()
+        return self.port
+
+    def _serve(self):
+        due = 0
+        while True:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            arrived = time.perf_counter_ns()
+            reply = self.device.feed(data)
+            if not reply:
+                continue
+            if not self.delayed:
+                os.write(self._master, reply)
+                continue
+            delay_ms = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+            # 回复不能乱序：晚到的请求不会早于前一个回复发出
+            due = max(due, arrived + int(delay_ms * 1_000_000))
+            self._replies.put((due, reply))
+
+    def _write_delayed(self):
+        while True:
+            item = self._replies.get()
+            if item is None:
+                return
+            due, reply = item
+            remaining = due - time.perf_counter_ns()
+            if remaining > 0:
+                time.sleep(remaining / 1e9)
+            try:
+                os.write(self._master, reply)
+            except (OSError, TypeError):
+                return
+
+    def stop(self):
+        if self._writer is not None:
+            self._replies.put(None)
+            self._writer.join(timeout=1)
+            self._writer = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def __enter__(self) -> "PtyEmulator":
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="EasyCon device emulator on a pseudo-terminal")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before each reply")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniform random delay, 0..jitter")
+    parser.add_argument("--busy-rate", type=float, default=0.0, help="fraction of report frames answered Busy")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    emu = PtyEmulator(
+        EasyConEmulator(busy_rate=args.busy_rate, seed=args.seed),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        seed=args.seed,
+    )
+    print(f"EasyCon emulator listening on {emu.start()}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        emu.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import struct
+from typing import List, Tuple
+
+from mcp_service.switch_protocol import SwitchReport
+from mcp_service.timeline import RESET_FRAME, Timeline
+
+# 固件脚本格式：
+#   头部  magic(1) version(1) repeat(u16, 0 = 循环直到 ScriptStop) count(u16)
+#   条目  7 字节报告指令 + 保持时间(u16, ms)，全部小端
+SCRIPT_MAGIC = 0xEC
+SCRIPT_VERSION = 1
+SCRIPT_HEADER = struct.Struct("<BBHH")
+SCRIPT_ENTRY = struct.Struct("<7sH")
+SCRIPT_HOLD_MAX_MS = 0xFFFF
+SCRIPT_MAX_BYTES = 1024
+
+ScriptEntry = Tuple[bytes, int]
+
+class ScriptError(ValueError):
+    pass
+
+def report_command(report: SwitchReport) -> bytes:
+    """The 7-byte report command before 7-bit packing."""
+    return bytes([
+        (report.button >> 8) & 0xFF,
+        report.button & 0xFF,
+        report.HAT & 0xFF,
+        report.LX & 0xFF,
+        report.LY & 0xFF,
+        report.RX & 0xFF,
+        report.RY & 0xFF,
+    ])
+
+def script_entries(timeline: Timeline) -> List[ScriptEntry]:
+    """Flatten a timeline to (command, holdMs); waits extend the state before them."""
+    entries: List[List] = []
+    for entry in timeline:
+        if entry.frame is None:
+            if not entries:
+                entries.append([report_command(SwitchReport.from_bytes(RESET_FRAME)), 0])
+            entries[-1][1] += entry.holdMs
+            continue
+        entries.append([report_command(SwitchReport.from_bytes(entry.frame)), entry.holdMs])
+    result: List[ScriptEntry] = []
+    for command, hold in entries:
+        while hold > SCRIPT_HOLD_MAX_MS:
+            result.append((command, SCRIPT_HOLD_MAX_MS))
+            hold -= SCRIPT_HOLD_MAX_MS
+        result.append((command, hold))
+    return result
+
+def compile_script(timeline: Timeline, repeat: int = 1) -> bytes:
+    """Encode a timeline as a firmware script; ``repeat`` 0 loops until stopped."""
+    if not 0 <= repeat <= 0xFFFF:
+        raise ScriptError(f"repeat out of range: {repeat}")
+    entries = script_entries(timeline)
+    data = bytearray(SCRIPT_HEADER.pack(SCRIPT_MAGIC, SCRIPT_VERSION, repeat, len(entries)))
+    for command, hold in entries:
+        data += SCRIPT_ENTRY.pack(command, hold)
+    if len(data) > SCRIPT_MAX_BYTES:
+        raise ScriptError(f"script is {len(data)} bytes, device holds at most {SCRIPT_MAX_BYTES}")
+    return bytes(data)
+
+def decode_script(data: bytes) -> Tuple[int, List[ScriptEntry]]:
+    """Parse a script back into (repeat, entries)."""
+    if len(data) < SCRIPT_HEADER.size:
+        raise ScriptError("script too short")
+    magic, version, repeat, count = SCRIPT_HEADER.unpack_from(data)
+    if magic != SCRIPT_MAGIC or version != SCRIPT_VERSION:
+        raise ScriptError(f"unsupported script header: {magic:#x} v{version}")
+    if len(data) < SCRIPT_HEADER.size + count * SCRIPT_ENTRY.size:
+        raise ScriptError("script truncated")
+    entries = [
+        SCRIPT_ENTRY.unpack_from(data, SCRIPT_HEADER.size + i * SCRIPT_ENTRY.size)
+        for i in range(count)
+    ]
+    return repeat, entries
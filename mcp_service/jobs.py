@@ -0,0 +1,128 @@
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from mcp_service.scheduler import RunProgress
+
+JOB_QUEUE_SIZE = 32       # pending jobs per device
+JOB_HISTORY_SIZE = 256    # finished jobs kept for polling
+
+class JobState:
+    Queued = "queued"
+    Running = "running"
+    Done = "done"
+    Failed = "failed"
+    Cancelled = "cancelled"
+
+FINISHED_STATES = (JobState.Done, JobState.Failed, JobState.Cancelled)
+
+JobWork = Callable[["Job"], Awaitable[Dict[str, Any]]]
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    device: str
+    work: JobWork
+    steps: int = 0
+    repeats: int = 1
+    state: str = JobState.Queued
+    progress: RunProgress = field(default_factory=RunProgress)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    createdAt: float = field(default_factory=time.time)
+    finishedAt: Optional[float] = None
+    task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        progress = self.progress.to_dict()
+        progress.update(steps=self.steps, repeats=self.repeats)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "device": self.device,
+            "state": self.state,
+            "progress": progress,
+            "error": self.error,
+            "createdAt": self.createdAt,
+            "finishedAt": self.finishedAt,
+        }
+
+class JobManager:
+    """Runs submitted jobs one at a time per device from a bounded FIFO queue."""
+
+    def __init__(self, on_cancel: Callable[[str], Awaitable[Any]]):
+        # on_cancel(device) 在任务被取消后立即调用，用于发送 RESET_REPORT
+        self._on_cancel = on_cancel
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._ids = itertools.count(1)
+
+    def submit(self, kind: str, device: str, work: JobWork, steps: int = 0, repeats: int = 1) -> Job:
+        queue = self._queues.get(device)
+        if queue is None:
+            queue = self._queues[device] = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+            self._workers[device] = asyncio.get_running_loop().create_task(self._worker(queue))
+        job = Job(id=f"job-{next(self._ids)}", kind=kind, device=device, work=work, steps=steps, repeats=repeats)
+        try:
+            queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise RuntimeError(f"Job queue full for device {device}")
+        self._jobs[job.id] = job
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        return list(self._jobs.values())
+
+    async def cancel(self, job_id: str) -> Job:
+        job = self._jobs[job_id]
+        if job.state == JobState.Queued:
+            job.state = JobState.Cancelled
+            job.finishedAt = time.time()
+        elif job.state == JobState.Running and job.task is not None:
+            job.task.cancel()
+            await asyncio.wait([job.task])
+        return job
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job: Job = await queue.get()
+            if job.state == JobState.Queued:
+                job.task = asyncio.get_running_loop().create_task(self._run(job))
+                await asyncio.wait([job.task])
+            queue.task_done()
+
+    async def _run(self, job: Job):
+        job.state = JobState.Running
+        try:
+            job.result = await job.work(job)
+            job.state = JobState.Done
+        except asyncio.CancelledError:
+            job.state = JobState.Cancelled
+            try:
+                await self._on_cancel(job.device)
+            except Exception as e:
+                job.error = f"reset after cancel failed: {e}"
+        except Exception as e:
+            job.state = JobState.Failed
+            job.error = str(e)
+        finally:
+            job.progress.finish()
+            job.finishedAt = time.time()
+
+    def _prune(self):
+        finished = [j.id for j in self._jobs.values() if j.finished]
+        for job_id in finished[:max(len(finished) - JOB_HISTORY_SIZE, 0)]:
+            del self._jobs[job_id]
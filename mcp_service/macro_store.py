@@ -0,0 +1,160 @@
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from mcp_service.program import Playable, Program, decode_program, encode_program
+from mcp_service.timeline import decode_timeline, encode_timeline
+
+DEFAULT_MACRO_DB = "easycon-macros.db"  # ":memory:" keeps macros in memory only
+MACRO_CACHE_SIZE = 256                  # decoded timelines kept in memory
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS macro_versions (
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    steps TEXT NOT NULL,
+    step_count INTEGER NOT NULL,
+    compiled BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    program INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, version)
+);
+CREATE TABLE IF NOT EXISTS macros (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    step_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+class CompiledMacro(NamedTuple):
+    name: str
+    version: int
+    steps: int
+    timeline: Playable  # a Program when the macro has loops, sections or calls
+
+class MacroStore:
+    """Versioned macros in SQLite, each stored as its source steps plus the compiled timeline.
+
+    Every save adds a version; ``macros`` points each name at its current
+    one. Nothing is read at startup: the database is opened on first use,
+    timelines are decoded when first run and cached by (name, version), so
+    another process saving a macro is picked up on the next lookup.
+    """
+
+    def __init__(self, path: str = DEFAULT_MACRO_DB):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cache: Dict[str, CompiledMacro] = {}
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # 只在事件循环线程里使用，但可能在导入时的线程中创建
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            # 早期版本的库没有 program 列
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(macro_versions)")}
+            if "program" not in columns:
+                conn.execute("ALTER TABLE macro_versions ADD COLUMN program INTEGER NOT NULL DEFAULT 0")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM macros").fetchone()[0]
+
+    def __contains__(self, name: str) -> bool:
+        return self._current(name) is not None
+
+    def _current(self, name: str) -> Optional[Tuple[int, int]]:
+        return self._db.execute("SELECT version, step_count FROM macros WHERE name = ?", (name,)).fetchone()
+
+    def save(self, name: str, steps: List[Dict[str, Any]], timeline: Playable) -> int:
+        now = time.time()
+        program = isinstance(timeline, Program)
+        compiled = encode_program(timeline) if program else encode_timeline(timeline)
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            # 删除后重新保存时版本号继续递增
+            row = self._db.execute("SELECT MAX(version) FROM macro_versions WHERE name = ?", (name,)).fetchone()
+            version = (row[0] or 0) + 1
+            self._db.execute(
+                "INSERT INTO macro_versions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, version, json.dumps(steps), len(steps), compiled, now, int(program)),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO macros VALUES (?, ?, ?, ?)", (name, version, len(steps), now)
+            )
+        self._remember(CompiledMacro(name, version, len(steps), timeline))
+        return version
+
+    def compiled(self, name: str) -> Optional[CompiledMacro]:
+        """Current version's timeline, decoded from the stored blob on first use."""
+        current = self._current(name)
+        if current is None:
+            return None
+        cached = self._cache.get(name)
+        if cached is not None and cached.version == current[0]:
+            return cached
+        data, program = self._db.execute(
+            "SELECT compiled, program FROM macro_versions WHERE name = ? AND version = ?", (name, current[0])
+        ).fetchone()
+        timeline = decode_program(data) if program else decode_timeline(data)
+        macro = CompiledMacro(name, current[0], current[1], timeline)
+        self._remember(macro)
+        return macro
+
+    def _remember(self, macro: CompiledMacro):
+        self._cache.pop(macro.name, None)
+        if len(self._cache) >= MACRO_CACHE_SIZE:
+            del self._cache[next(iter(self._cache))]
+        self._cache[macro.name] = macro
+
+    def get(self, name: str, version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Source steps of the current version, or of ``version`` (kept after later saves)."""
+        if version is None:
+            current = self._current(name)
+            if current is None:
+                return None
+            version = current[0]
+        row = self._db.execute(
+            "SELECT steps, created_at FROM macro_versions WHERE name = ? AND version = ?", (name, version)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"name": name, "version": version, "steps": json.loads(row[0]), "createdAt": row[1]}
+
+    def versions(self, name: str) -> List[Dict[str, Any]]:
+        rows = self._db.execute(
+            "SELECT version, step_count, created_at FROM macro_versions WHERE name = ? ORDER BY version", (name,)
+        )
+        return [{"version": v, "steps": n, "createdAt": t} for v, n, t in rows]
+
+    def list(self, prefix: str = "", offset: int = 0, limit: int = 100) -> Tuple[List[Dict[str, Any]], int]:
+        """One page of current macros by name, and the total matching ``prefix``."""
+        # 前缀查询用主键上的范围扫描，不用 LIKE
+        where, args = "", ()
+        if prefix:
+            where, args = "WHERE name >= ? AND name < ?", (prefix, prefix + "\U0010ffff")
+        total = self._db.execute(f"SELECT COUNT(*) FROM macros {where}", args).fetchone()[0]
+        rows = self._db.execute(
+            f"SELECT name, version, step_count, updated_at FROM macros {where} ORDER BY name LIMIT ? OFFSET ?",
+            (*args, limit, offset),
+        )
+        items = [{"name": n, "steps": s, "version": v, "updatedAt": t} for n, v, s, t in rows]
+        return items, total
+
+    def delete(self, name: str) -> bool:
+        """Remove the name from the index; its versions stay in the history."""
+        self._cache.pop(name, None)
+        with self._db:
+            return self._db.execute("DELETE FROM macros WHERE name = ?", (name,)).rowcount > 0
@@ -0,0 +1,274 @@
+"""Model Context Protocol server: the REST operations as MCP tools over JSON-RPC.
+
+The API module registers its own request models and handlers as tools, on
+the same broker as its routes, so both front ends share one device core.
+Tools that only produce frames (presses, sticks, waits, reset) are compiled
+first: consecutive calls for one device in a JSON-RPC batch are joined into
+a single timeline and played as one batch run.
+
+    python -m mcp_service.mcp_server              # stdio, newline-delimited JSON-RPC
+    uvicorn mcp_service.server:app                # streamable HTTP at POST /mcp
+"""
+import asyncio
+import json
+import sys
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+from mcp_service.timeline import RESET_FRAME, CompileError, TimelineEntry, held_after
+
+# 新版本在前；客户端请求的版本不支持时答复第一个
+PROTOCOL_VERSIONS = ("2025-06-18", "2025-03-26", "2024-11-05")
+
+# JSON-RPC 错误码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+
+TIMELINE_PRIORITY = "interactive"  # batched frame tools play like REST presses
+STDIO_LINE_LIMIT = 16 * 1024 * 1024
+
+class Tool(NamedTuple):
+    name: str
+    description: str
+    model: Type[BaseModel]
+    run: Callable[[Any], Any]  # handler returning a dict, or for frame tools the entries to play
+    frames: bool               # True when ``run`` compiles entries for the server to play
+
+class McpError(Exception):
+    """A JSON-RPC error answered instead of a result."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+class _Call(NamedTuple):
+    id: Any
+    device: str
+    entries: List[TimelineEntry]
+    held: bytes  # inputs still held once the entries have played
+
+def _response(msg_id: Any, result: Any) -> Dict[str, Any]:
+    return {"jsonrpc": "2.0", "id": msg_id, "result": result}
+
+def _error(msg_id: Any, code: int, message: str) -> Dict[str, Any]:
+    return {"jsonrpc": "2.0", "id": msg_id, "error": {"code": code, "message": message}}
+
+def _tool_result(msg_id: Any, result: Dict[str, Any], is_error: bool = False) -> Dict[str, Any]:
+    return _response(msg_id, {
+        "content": [{"type": "text", "text": json.dumps(result)}],
+        "structuredContent": result,
+        "isError": is_error,
+    })
+
+def _params(msg: Dict[str, Any]) -> Dict[str, Any]:
+    params = msg.get("params") or {}
+    if not isinstance(params, dict):
+        raise McpError(INVALID_PARAMS, "params must be an object")
+    return params
+
+def _arguments(params: Dict[str, Any]) -> Dict[str, Any]:
+    arguments = params.get("arguments") or {}
+    if not isinstance(arguments, dict):
+        raise McpError(INVALID_PARAMS, "arguments must be an object")
+    return arguments
+
+def _error_text(e: Exception) -> Any:
+    # HTTPException 的 detail 可能是列表（批量校验错误）
+    detail = getattr(e, "detail", None)
+    return detail if detail is not None else str(e)
+
+class McpServer:
+    """JSON-RPC dispatcher for MCP ``initialize``, ``ping``, ``tools/list`` and ``tools/call``.
+
+    ``core`` is the Broker (or BrokerClient) that frame tools are played on.
+    ``handle()`` takes one decoded message or batch and is shared by the
+    stdio and streamable HTTP transports.
+    """
+
+    def __init__(self, name: str, version: str, core: Any):
+        self.name = name
+        self.version = version
+        self.core = core
+        self.tools: Dict[str, Tool] = {}
+        self._listing: Optional[List[Dict[str, Any]]] = None
+
+    def tool(self, name: str, model: Type[BaseModel], description: str, handler: Callable[[Any], Awaitable[Any]]):
+        """Expose ``handler(req)`` as a tool taking ``model`` as its arguments."""
+        self.tools[name] = Tool(name, description, model, handler, False)
+        self._listing = None
+
+    def frame_tool(self, name: str, model: Type[BaseModel], description: str, compile: Callable[[Any, bytes], List[TimelineEntry]]):
+        """Expose a tool whose call compiles to timeline entries; ``model`` must have a ``device`` field.
+
+        ``compile(req, held)`` gets the frame held by the earlier calls it is batched with.
+        """
+        self.tools[name] = Tool(name, description, model, compile, True)
+        self._listing = None
+
+    def tool_list(self) -> List[Dict[str, Any]]:
+        if self._listing is None:
+            self._listing = [
+                {"name": t.name, "description": t.description, "inputSchema": t.model.model_json_schema()}
+                for t in self.tools.values()
+            ]
+        return self._listing
+
+    async def handle_text(self, data: bytes) -> Optional[bytes]:
+        """Answer one encoded message or batch; None when there is nothing to send back."""
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return json.dumps(_error(None, PARSE_ERROR, "Parse error")).encode()
+        response = await self.handle(message)
+        return None if response is None else json.dumps(response).encode()
+
+    async def handle(self, message: Any) -> Any:
+        if isinstance(message, list):
+            if not message:
+                return _error(None, INVALID_REQUEST, "Empty batch")
+            return await self._batch(message) or None
+        responses = await self._batch([message])
+        return responses[0] if responses else None
+
+    async def _batch(self, messages: List[Any]) -> List[Dict[str, Any]]:
+        """Handle messages in order, playing runs of consecutive frame tool calls for one device as one timeline."""
+        responses: List[Dict[str, Any]] = []
+        group: List[_Call] = []
+        for msg in messages:
+            if not isinstance(msg, dict) or msg.get("jsonrpc") != "2.0" or not isinstance(msg.get("method", ""), str):
+                responses.append(_error(msg.get("id") if isinstance(msg, dict) else None, INVALID_REQUEST, "Invalid request"))
+                continue
+            if "method" not in msg:
+                continue  # 客户端发来的响应，本服务不发请求
+            msg_id = msg.get("id")
+            if msg["method"] == "tools/call":
+                try:
+                    call = self._compile(msg, group)
+                except McpError as e:
+                    responses.append(_error(msg_id, e.code, str(e)))
+                    continue
+                except (ValidationError, CompileError, ValueError) as e:
+                    if msg_id is not None:
+                        responses.append(_tool_result(msg_id, {"ok": False, "error": str(e)}, True))
+                    continue
+                if call is not None:
+                    if group and group[0].device != call.device:
+                        responses.extend(await self._play(group))
+                        group = []
+                    group.append(call)
+                    continue
+            responses.extend(await self._play(group))
+            group = []
+            try:
+                result = await self._dispatch(msg)
+            except McpError as e:
+                result = _error(msg_id, e.code, str(e))
+            if msg_id is not None and result is not None:
+                responses.append(result)
+        responses.extend(await self._play(group))
+        return responses
+
+    def _tool(self, params: Dict[str, Any]) -> Tool:
+        tool = self.tools.get(params.get("name"))
+        if tool is None:
+            raise McpError(INVALID_PARAMS, f"Unknown tool: {params.get('name')}")
+        return tool
+
+    def _compile(self, msg: Dict[str, Any], group: List[_Call]) -> Optional[_Call]:
+        """Validate a frame tool call and compile its entries; None for other tools.
+
+        Like ``/batch``, entries are compiled on top of the inputs held by
+        the earlier calls of ``group`` when it is for the same device.
+        """
+        params = _params(msg)
+        tool = self._tool(params)
+        if not tool.frames:
+            return None
+        req = tool.model(**_arguments(params))
+        held = group[-1].held if group and group[0].device == req.device else RESET_FRAME
+        entries = list(tool.run(req, held))
+        return _Call(msg.get("id"), req.device, entries, held_after(entries, held))
+
+    async def _play(self, calls: List[_Call]) -> List[Dict[str, Any]]:
+        if not calls:
+            return []
+        # 每个调用的条目以其在组内的序号为 step，批量结果按调用拆分
+        timeline = tuple(
+            TimelineEntry(i, entry.frame, entry.holdMs) for i, call in enumerate(calls) for entry in call.entries
+        )
+        try:
+            run = await self.core.run_batch(calls[0].device, timeline, len(calls), priority=TIMELINE_PRIORITY)
+        except Exception as e:
+            return [_tool_result(c.id, {"ok": False, "error": _error_text(e)}, True) for c in calls if c.id is not None]
+        responses = []
+        for call, result in zip(calls, run["results"]):
+            if call.id is not None:
+                result = {k: v for k, v in result.items() if k != "index"}
+                responses.append(_tool_result(call.id, {**result, "calls": len(calls), "timing": run["timing"]}))
+        return responses
+
+    async def _dispatch(self, msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        method, msg_id, params = msg["method"], msg.get("id"), _params(msg)
+        if method == "initialize":
+            requested = params.get("protocolVersion")
+            return _response(msg_id, {
+                "protocolVersion": requested if requested in PROTOCOL_VERSIONS else PROTOCOL_VERSIONS[0],
+                "capabilities": {"tools": {"listChanged": False}},
+                "serverInfo": {"name": self.name, "version": self.version},
+            })
+        if method == "ping":
+            return _response(msg_id, {})
+        if method == "tools/list":
+            return _response(msg_id, {"tools": self.tool_list()})
+        if method == "tools/call":
+            tool = self._tool(params)
+            arguments = _arguments(params)
+            try:
+                result = await tool.run(tool.model(**arguments))
+            except Exception as e:
+                return _tool_result(msg_id, {"ok": False, "error": _error_text(e)}, True)
+            return _tool_result(msg_id, result)
+        if method.startswith("notifications/"):
+            return None
+        raise McpError(METHOD_NOT_FOUND, f"Method not found: {method}")
+
+async def serve_stdio(server: McpServer):
+    """Read newline-delimited JSON-RPC from stdin until EOF, answering on stdout.
+
+    Each line is handled in its own task, so a long sequence does not hold up
+    pings or calls for other devices; answers are written as they complete.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=STDIO_LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    out = sys.stdout.buffer
+    pending = set()
+
+    async def answer(line: bytes):
+        response = await server.handle_text(line)
+        if response is not None:
+            out.write(response + b"\n")
+            out.flush()
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.strip():
+            task = loop.create_task(answer(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+
+def main():
+    # 导入 API 模块即得到与 REST 路由相同的 broker 和工具表；EASYCON_BROKER 等环境变量照常生效
+    from mcp_service.server import MCP
+
+    asyncio.run(serve_stdio(MCP))
+
+if __name__ == "__main__":
+    main()
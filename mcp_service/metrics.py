@@ -0,0 +1,223 @@
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from mcp_service.serial_service import Reply
+
+# 延迟直方图桶上界（秒）
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Fixed-bucket histogram over nanosecond samples.
+
+    Buckets are allocated once and updated with plain integer increments, no
+    lock: each link and executor is only written by whichever task or pinned
+    thread currently holds that device.
+    """
+
+    __slots__ = ("bounds", "bounds_ns", "counts", "sum_ns")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.bounds_ns = [int(b * 1e9) for b in self.bounds]
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum_ns = 0
+
+    def observe(self, ns: int):
+        self.counts[bisect_left(self.bounds_ns, ns)] += 1
+        self.sum_ns += ns
+
+class LinkMetrics:
+    """Serial link counters for one device: request latency split into write,
+    wait for the first reply byte, and reading the rest of the reply."""
+
+    __slots__ = (
+        "write", "first_byte", "read",
+        "requests", "bytes_sent", "bytes_received", "timeouts", "busy", "errors",
+        "_sent_ns", "_first_ns",
+    )
+
+    def __init__(self):
+        self.write = Histogram()
+        self.first_byte = Histogram()
+        self.read = Histogram()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timeouts = 0
+        self.busy = 0
+        self.errors = 0
+        self._sent_ns = 0
+        self._first_ns = 0
+
+    def on_write(self, nbytes: int, start_ns: int):
+        now = time.perf_counter_ns()
+        self.write.observe(now - start_ns)
+        self.requests += 1
+        self.bytes_sent += nbytes
+        self._sent_ns = now
+
+    @property
+    def last_write_ns(self) -> int:
+        return self._sent_ns
+
+    def on_first_byte(self, first: bytes):
+        now = time.perf_counter_ns()
+        if not first:
+            self.timeouts += 1
+            return
+        self.first_byte.observe(now - self._sent_ns)
+        self._first_ns = now
+
+    def on_reply(self, reply: bytes):
+        """Account a complete framed reply read after on_first_byte()."""
+        if not reply:
+            return
+        self.read.observe(time.perf_counter_ns() - self._first_ns)
+        self.bytes_received += len(reply)
+        if reply[0] == Reply.Busy:
+            self.busy += 1
+        elif reply[0] == Reply.Error:
+            self.errors += 1
+
+    def on_replies(self, data: bytes):
+        """Account a run of pipelined Ack/Busy bytes, which are not timed per frame."""
+        self.bytes_received += len(data)
+        self.busy += data.count(Reply.Busy)
+        self.errors += data.count(Reply.Error)
+
+    def on_raw(self, data: bytes):
+        """Account an unframed read (/raw/send)."""
+        self.bytes_received += len(data)
+        if not data:
+            self.timeouts += 1
+
+class HttpMetrics:
+    """Request counts by (method, route, status) and latency by (method, route)."""
+
+    def __init__(self, worker: Optional[str] = None):
+        self.worker = worker
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, method: str, route: str, status: int, ns: int):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        hist = self.latency.get((method, route))
+        if hist is None:
+            hist = self.latency[(method, route)] = Histogram(HTTP_BUCKETS)
+        hist.observe(ns)
+
+    def render(self) -> str:
+        out = Exposition()
+        base = {"worker": self.worker} if self.worker else {}
+        out.family("easycon_http_requests_total", "counter", "HTTP requests handled")
+        for (method, route, status), count in self.requests.items():
+            out.sample("easycon_http_requests_total", {**base, "method": method, "route": route, "status": str(status)}, count)
+        out.family("easycon_http_request_seconds", "histogram", "HTTP request latency")
+        for (method, route), hist in self.latency.items():
+            out.histogram("easycon_http_request_seconds", {**base, "method": method, "route": route}, hist)
+        return out.text()
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Exposition:
+    """Prometheus text exposition format (version 0.0.4) writer."""
+
+    def __init__(self):
+        self._lines: List[str] = []
+
+    def family(self, name: str, kind: str, help: str):
+        self._lines.append(f"# HELP {name} {help}")
+        self._lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, labels: Dict[str, str], value: Any):
+        if labels:
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            self._lines.append(f"{name}{{{label_text}}} {value}")
+        else:
+            self._lines.append(f"{name} {value}")
+
+    def buckets(self, name: str, labels: Dict[str, str], bounds: Sequence[float], counts: Sequence[int], sum_ns: int):
+        total = 0
+        for bound, count in zip(bounds, counts):
+            total += count
+            self.sample(f"{name}_bucket", {**labels, "le": repr(bound)}, total)
+        total += counts[-1]
+        self.sample(f"{name}_bucket", {**labels, "le": "+Inf"}, total)
+        self.sample(f"{name}_sum", labels, sum_ns / 1e9)
+        self.sample(f"{name}_count", labels, total)
+
+    def histogram(self, name: str, labels: Dict[str, str], hist: Histogram):
+        self.buckets(name, labels, hist.bounds, hist.counts, hist.sum_ns)
+
+    def text(self) -> str:
+        return "\n".join(self._lines) + "\n" if self._lines else ""
+
+LINK_HISTOGRAMS = (
+    ("easycon_serial_write_seconds", "write", "Time to write and flush a request to the serial port"),
+    ("easycon_serial_first_byte_seconds", "first_byte", "Time from end of write to the first reply byte"),
+    ("easycon_serial_read_seconds", "read", "Time from the first reply byte to the complete reply"),
+)
+LINK_COUNTERS = (
+    ("easycon_serial_requests_total", "requests", "Requests and report frames written"),
+    ("easycon_serial_sent_bytes_total", "bytes_sent", "Bytes written to the serial port"),
+    ("easycon_serial_received_bytes_total", "bytes_received", "Bytes read from the serial port"),
+    ("easycon_serial_timeouts_total", "timeouts", "Requests that got no reply before the timeout"),
+    ("easycon_serial_busy_total", "busy", "Busy replies from the firmware"),
+    ("easycon_serial_error_replies_total", "errors", "Error replies from the firmware"),
+)
+
+def render_devices(devices: Iterable[Any]) -> str:
+    """Link and timeline executor metrics for each Device, labelled by device ID."""
+    devices = list(devices)
+    out = Exposition()
+    for name, attr, help in LINK_HISTOGRAMS:
+        out.family(name, "histogram", help)
+        for dev in devices:
+            out.histogram(name, {"device": dev.id}, getattr(dev.link.metrics, attr))
+    for name, attr, help in LINK_COUNTERS:
+        out.family(name, "counter", help)
+        for dev in devices:
+            out.sample(name, {"device": dev.id}, getattr(dev.link.metrics, attr))
+    out.family("easycon_frame_lateness_seconds", "histogram", "Report frame send time minus its scheduled deadline")
+    for dev in devices:
+        bounds_ns, counts, total_ns = dev.executor.jitter.snapshot()
+        out.buckets("easycon_frame_lateness_seconds", {"device": dev.id}, [b / 1e9 for b in bounds_ns], counts, total_ns)
+    out.family("easycon_run_drift_seconds", "histogram", "Timeline run duration beyond its planned duration")
+    for dev in devices:
+        out.histogram("easycon_run_drift_seconds", {"device": dev.id}, dev.executor.drift)
+    out.family("easycon_runs_total", "counter", "Timelines played")
+    for dev in devices:
+        out.sample("easycon_runs_total", {"device": dev.id}, dev.executor.runs)
+    out.family("easycon_run_planned_seconds_total", "counter", "Planned duration of played timelines")
+    for dev in devices:
+        out.sample("easycon_run_planned_seconds_total", {"device": dev.id}, dev.executor.planned_ns / 1e9)
+    out.family("easycon_run_actual_seconds_total", "counter", "Actual duration of played timelines")
+    for dev in devices:
+        out.sample("easycon_run_actual_seconds_total", {"device": dev.id}, dev.executor.actual_ns / 1e9)
+    out.family("easycon_frames_suppressed_total", "counter", "Frames dropped by the report-diffing output stage")
+    for dev in devices:
+        out.sample("easycon_frames_suppressed_total", {"device": dev.id}, dev.executor.output["suppressed"])
+    out.family("easycon_queue_wait_seconds", "histogram", "Time a run waited for its device, by priority")
+    for dev in devices:
+        for priority, hist in dev.arbiter.wait.items():
+            out.histogram("easycon_queue_wait_seconds", {"device": dev.id, "priority": priority}, hist)
+    out.family("easycon_preemptions_total", "counter", "Runs played inside a lower-priority run at a step boundary")
+    for dev in devices:
+        out.sample("easycon_preemptions_total", {"device": dev.id}, dev.arbiter.preemptions)
+    out.family("easycon_link_recovery_seconds", "histogram", "Time from a serial port error to the completed re-handshake")
+    for dev in devices:
+        out.histogram("easycon_link_recovery_seconds", {"device": dev.id}, dev.supervisor.recovery)
+    out.family("easycon_link_reconnects_total", "counter", "Links restored by the supervisor after a port error")
+    for dev in devices:
+        out.sample("easycon_link_reconnects_total", {"device": dev.id}, dev.supervisor.reconnects)
+    out.family("easycon_link_keepalives_total", "counter", "Keepalive Hellos sent on idle links")
+    for dev in devices:
+        out.sample("easycon_link_keepalives_total", {"device": dev.id}, dev.supervisor.keepalives)
+    out.family("easycon_device_connected", "gauge", "1 when the device serial port is open")
+    for dev in devices:
+        out.sample("easycon_device_connected", {"device": dev.id}, int(dev.connected))
+    return out.text()
@@ -0,0 +1,82 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from mcp_service.switch_protocol import SwitchHAT, SwitchReport
+from mcp_service.timeline import RESET_FRAME, Timeline, TimelineEntry
+
+# 低于该保持时间的释放帧可与下一次按下合并（约一个 USB 轮询周期，主机看不到更短的释放）
+MIN_RELEASE_MS = 8
+
+# 计划阶段被去掉的帧仍保留在时间线上，发送时只计数不上线
+SUPPRESSED_FRAME = b""
+
+def _overlaps(a: bytes, b: bytes) -> bool:
+    """True when ``b`` presses something ``a`` already holds, so a release between them is an edge."""
+    ra, rb = SwitchReport.from_bytes(a), SwitchReport.from_bytes(b)
+    if ra.button & rb.button:
+        return True
+    return ra.HAT == rb.HAT != SwitchHAT.CENTER.value
+
+class OutputStage:
+    """Report-diffing stage between the timeline scheduler and the link.
+
+    ``plan()`` drops frames identical to the previous state and short releases
+    that sit between two presses with no input in common; ``wrap()`` skips
+    frames equal to the last one sent. When ``needs_reset()`` the caller sends
+    a final neutral frame, so suppression can never leave an input held
+    that the timeline does not end on.
+    """
+
+    def __init__(self, min_release_ms: int = MIN_RELEASE_MS):
+        self.min_release_ms = min_release_ms
+        self.sent = 0
+        self.suppressed = 0
+        self._last: Optional[bytes] = None
+
+    def plan(self, timeline: Timeline) -> Timeline:
+        entries: List[TimelineEntry] = list(timeline)
+        frames = [i for i, e in enumerate(entries) if e.frame is not None]
+        state: Optional[bytes] = None
+        for n, i in enumerate(frames):
+            entry = entries[i]
+            if entry.frame == state:
+                entries[i] = entry._replace(frame=SUPPRESSED_FRAME)
+                continue
+            nxt = entries[frames[n + 1]].frame if n + 1 < len(frames) else None
+            hold = sum(e.holdMs for e in entries[i:frames[n + 1]]) if nxt is not None else None
+            if (
+                entry.frame == RESET_FRAME
+                and state is not None and nxt is not None and nxt != RESET_FRAME
+                and hold < self.min_release_ms
+                and not _overlaps(state, nxt)
+            ):
+                entries[i] = entry._replace(frame=SUPPRESSED_FRAME)
+                continue
+            state = entry.frame
+        return tuple(entries)
+
+    def _should_send(self, frame: bytes) -> bool:
+        if frame == SUPPRESSED_FRAME or frame == self._last:
+            self.suppressed += 1
+            return False
+        self._last = frame
+        self.sent += 1
+        return True
+
+    def wrap(self, send: Callable[[bytes], Any]) -> Callable[[bytes], Any]:
+        def staged(frame: bytes):
+            if self._should_send(frame):
+                return send(frame)
+        return staged
+
+    def wrap_async(self, send: Callable[[bytes], Awaitable[Any]]) -> Callable[[bytes], Awaitable[Any]]:
+        async def staged(frame: bytes):
+            if self._should_send(frame):
+                return await send(frame)
+        return staged
+
+    def needs_reset(self, final: bytes = RESET_FRAME) -> bool:
+        """True when the last frame sent is not ``final``, the state the timeline means to end on."""
+        return self._last is not None and self._last != final
+
+    def stats(self) -> Dict[str, int]:
+        return {"sent": self.sent, "suppressed": self.suppressed}
@@ -0,0 +1,239 @@
+"""Dry-run profiles: what a timeline will send and how long it will take, without the link.
+
+``profile_timeline()`` walks a compiled timeline, program or replay once, the way
+the deadline scheduler plays it, and models each report's time on the link:
+a stop-and-wait round trip (the device's measured mean once it has enough
+history, else the UART time of the frame and its Ack) or, when pipelined,
+only the frame's own wire time. A frame due while the link is still busy
+goes out late, and the last ones can push the run past its planned end.
+Repeats are extrapolated from two simulated passes.
+"""
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from mcp_service.metrics import LinkMetrics
+from mcp_service.output_stage import SUPPRESSED_FRAME, OutputStage
+from mcp_service.program import Playable, Program, Streamed, planned_duration_ms
+from mcp_service.scheduler import NS_PER_MS, RunTiming, TimingConfig
+from mcp_service.serial_service import REPORT_REPLY_BYTES
+from mcp_service.timeline import RESET_FRAME, TimelineEntry
+
+DEFAULT_BAUD = 115200
+BITS_PER_BYTE = 10               # 8N1: start + 8 data + stop
+MEASURED_MIN_SAMPLES = 20        # round trips on a link before its measured mean replaces the wire model
+PROFILE_MAX_ENTRIES = 200_000    # entries walked per profile; longer programs only get totals
+
+# 冗余帧类型：与上一帧相同；两次无共同输入的按下之间的短释放（diffFrames 会并入下一次按下）
+DUPLICATE = "duplicate"
+SHORT_RELEASE = "shortRelease"
+
+class _Step:
+    __slots__ = ("startNs", "frameNs", "lateNs", "runs", "frames", "redundant", "holdMs")
+
+    def __init__(self, start_ns: float):
+        self.startNs = start_ns
+        self.frameNs: Optional[float] = None  # planned offset of the step's first frame
+        self.lateNs = 0                       # estimated lateness of that frame
+        self.runs = 0
+        self.frames = 0
+        self.redundant = 0
+        self.holdMs = 0
+
+def link_cost(config: TimingConfig, baud: int = DEFAULT_BAUD, metrics: Optional[LinkMetrics] = None) -> Tuple[int, str]:
+    """Time one report keeps the link busy, in ns, and where the figure comes from."""
+    frame_ns = len(RESET_FRAME) * BITS_PER_BYTE * 1_000_000_000 // baud
+    if config.window > 1:
+        return frame_ns, "wire"  # Ack 在途中，不等待
+    if metrics is not None:
+        replies = sum(metrics.first_byte.counts)
+        if replies >= MEASURED_MIN_SAMPLES:
+            rtt = metrics.write.sum_ns / max(sum(metrics.write.counts), 1) + metrics.first_byte.sum_ns / replies
+            reads = sum(metrics.read.counts)
+            if reads:
+                rtt += metrics.read.sum_ns / reads
+            return int(rtt), "measured"
+    return frame_ns + REPORT_REPLY_BYTES * BITS_PER_BYTE * 1_000_000_000 // baud, "wire"
+
+def _classify(timeline: Playable) -> Iterator[Tuple[TimelineEntry, Optional[str]]]:
+    """Entries in play order, each with the kind of redundancy of its frame, if any.
+
+    Flat timelines are judged by ``OutputStage.plan()``; streamed ones, which
+    the output stage only diffs frame by frame, by repeats of the last frame.
+    """
+    last = None
+    if isinstance(timeline, Streamed):
+        for entry in timeline.walk():
+            if entry.frame is None:
+                yield entry, None
+                continue
+            yield entry, DUPLICATE if entry.frame == last else None
+            last = entry.frame
+        return
+    for entry, planned in zip(timeline, OutputStage().plan(timeline)):
+        if planned.frame == SUPPRESSED_FRAME:
+            # plan() 的状态是最后一个保留的帧：与之相同即重复，否则是被合并的释放帧
+            yield entry, DUPLICATE if entry.frame == last else SHORT_RELEASE
+            continue
+        if entry.frame is not None:
+            last = entry.frame
+        yield entry, None
+
+class _Pass:
+    """One simulated pass over a timeline, starting with the link busy until ``busy`` ns."""
+
+    __slots__ = ("offset", "busy", "entries", "sent", "totalLate", "maxLate", "redundant", "truncated")
+
+    def __init__(self, busy: float = 0.0):
+        self.offset = 0.0
+        self.busy = busy
+        self.entries = self.sent = 0
+        self.totalLate = self.maxLate = 0.0
+        self.redundant = {DUPLICATE: 0, SHORT_RELEASE: 0}
+        self.truncated = False
+
+    @property
+    def overrun(self) -> float:
+        """How far the link stays busy past the pass's planned end."""
+        return max(self.busy - self.offset, 0.0)
+
+    def run(self, timeline: Playable, config: TimingConfig, cost: int, steps: Optional[Dict[int, _Step]] = None):
+        current: Optional[_Step] = None
+        step = None
+        for entry, kind in _classify(timeline):
+            if self.entries == PROFILE_MAX_ENTRIES:
+                self.truncated = True
+                break
+            self.entries += 1
+            if steps is not None:
+                if entry.step != step or current is None:
+                    step = entry.step
+                    current = steps.get(step)
+                    if current is None:
+                        current = steps[step] = _Step(self.offset)
+                    current.runs += 1
+                current.holdMs += entry.holdMs
+            if entry.frame is not None:
+                if kind is not None:
+                    self.redundant[kind] += 1
+                    if current is not None:
+                        current.redundant += 1
+                if kind is None or not config.diffFrames:
+                    due = self.offset
+                    start = due if due >= self.busy else self.busy
+                    self.busy = start + cost
+                    late = start - due
+                    self.totalLate += late
+                    if late > self.maxLate:
+                        self.maxLate = late
+                    self.sent += 1
+                    if current is not None:
+                        current.frames += 1
+                        if current.frameNs is None:
+                            current.frameNs, current.lateNs = due, late
+            self.offset += entry.holdMs * NS_PER_MS
+
+def profile_timeline(
+    timeline: Playable,
+    repeat: int = 1,
+    config: Optional[TimingConfig] = None,
+    baud: int = DEFAULT_BAUD,
+    metrics: Optional[LinkMetrics] = None,
+) -> Dict[str, Any]:
+    """Planned frames, wall time and per-step breakdown of playing ``timeline`` ``repeat`` times.
+
+    Nothing is sent. With ``config.diffFrames`` redundant frames are counted
+    as suppressed and cost no link time; otherwise they are only reported.
+    Lateness and steps are those of the first pass; steps are listed in the
+    order they first play. A program whose walk is longer than
+    PROFILE_MAX_ENTRIES is ``truncated`` and gets no frame count or estimate,
+    and one that loops until cancelled has no planned time.
+    """
+    config = config or TimingConfig()
+    cost, source = link_cost(config, baud, metrics)
+    steps: Dict[int, _Step] = {}
+    first = _Pass()
+    first.run(timeline, config, cost, steps)
+    # 截止时间不随延迟顺延：上一遍的超时只推迟下一遍开头几帧。再模拟一遍，
+    # 超时不变说明已被吸收，增长则说明链路饱和，每遍累加同样的增量
+    overrun = first.overrun
+    if repeat > 1 and overrun and not first.truncated:
+        second = _Pass(overrun)
+        second.run(timeline, config, cost)
+        overrun += (second.overrun - overrun) * (repeat - 1)
+
+    planned = planned_duration_ms(timeline)
+    sent = first.sent
+    result: Dict[str, Any] = {
+        "repeats": repeat,
+        "entries": first.entries * repeat,
+        "frames": sent * repeat,
+        "redundantFrames": {kind: count * repeat for kind, count in first.redundant.items()},
+        "suppressedFrames": sum(first.redundant.values()) * repeat if config.diffFrames else 0,
+        "bytes": sent * repeat * len(RESET_FRAME),
+        "plannedMs": round(planned * repeat, 3) if planned is not None else None,
+        "estimatedMs": round((first.offset * repeat + overrun) / NS_PER_MS, 3),
+        "meanLateMs": round(first.totalLate / sent / NS_PER_MS, 3) if sent else 0.0,
+        "maxLateMs": round(first.maxLate / NS_PER_MS, 3),
+        "link": {
+            "mode": "pipelined" if config.window > 1 else "stop-and-wait",
+            "frameMs": round(cost / NS_PER_MS, 3),
+            "source": source,
+            "baud": baud,
+        },
+        "steps": [
+            {
+                "step": index,
+                "startMs": round((s.frameNs if s.frameNs is not None else s.startNs) / NS_PER_MS, 3),
+                "runs": s.runs,
+                "frames": s.frames,
+                "redundantFrames": s.redundant,
+                "durationMs": s.holdMs,
+                "lateMs": round(s.lateNs / NS_PER_MS, 3),
+            }
+            for index, s in steps.items()
+        ],
+        "truncated": first.truncated,
+    }
+    if first.truncated:
+        # 只走了前一部分：条目数取自程序自身的统计，帧数和估计未知
+        length = timeline.length if isinstance(timeline, Program) else None
+        result["entries"] = length * repeat if length is not None else None
+        result["frames"] = result["bytes"] = result["estimatedMs"] = None
+    return result
+
+def compare_run(plan: Dict[str, Any], timing: RunTiming) -> Dict[str, Any]:
+    """Planned-vs-actual of a finished run: totals, and each step's first frame against its traced send time."""
+    sent = timing.output["sent"] if timing.output is not None else timing.frames
+    actual_ms = (timing.actualNs - timing.pausedNs) / NS_PER_MS
+    first: Dict[int, Tuple[int, int]] = {}
+    for index, planned_ns, late_ns in timing.steps or ():
+        first.setdefault(index, (planned_ns, late_ns))
+    steps = []
+    for s in plan["steps"]:
+        traced = first.get(s["step"])
+        if traced is None:
+            continue
+        planned_ns, late_ns = traced
+        steps.append({
+            "step": s["step"],
+            "plannedMs": round(planned_ns / NS_PER_MS, 3),
+            "estimatedMs": round(s["startMs"] + s["lateMs"], 3),
+            "actualMs": round((planned_ns + late_ns) / NS_PER_MS, 3),
+            "lateMs": round(late_ns / NS_PER_MS, 3),
+        })
+    estimated = plan["estimatedMs"]
+    return {
+        "frames": {"planned": plan["frames"], "actual": sent},
+        "wallMs": {
+            "planned": plan["plannedMs"],
+            "estimated": estimated,
+            "actual": round(actual_ms, 3),
+            "estimateErrorMs": round(actual_ms - estimated, 3) if estimated is not None else None,
+        },
+        "lateMs": {
+            "estimatedMean": plan["meanLateMs"],
+            "actualMean": round(timing.totalLateNs / timing.frames / NS_PER_MS, 3) if timing.frames else 0.0,
+            "estimatedMax": plan["maxLateMs"],
+            "actualMax": round(timing.maxLateNs / NS_PER_MS, 3),
+        },
+        "steps": steps,
+    }
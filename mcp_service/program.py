@@ -0,0 +1,309 @@
+"""Structured macros: loops, labelled sections and calls to other macros.
+
+Steps with control flow compile to a ``Program``: straight runs of steps
+become ordinary timeline chunks, and loops, sections and calls become a
+short list of instructions. ``walk()`` plays it with an instruction pointer
+and a stack of loop counters, so a 10k-iteration loop costs the same memory
+as one iteration. Step lists without control flow still compile to a flat
+Timeline.
+"""
+import math
+import struct
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from mcp_service.timeline import (
+    RESET_FRAME,
+    CompileError,
+    Timeline,
+    TimelineEntry,
+    compile_step,
+    compile_steps,
+    decode_timeline,
+    encode_timeline,
+    held_after,
+)
+
+# 指令：(操作码, a, b)
+OP_FRAMES = 0  # a = chunk index
+OP_LOOP = 1    # a = count (0 = until cancelled), b = label index + 1 (0 = no label)
+OP_END = 2     # a = address of the matching OP_LOOP
+OP_CALL = 3    # a = index into calls
+
+CONTROL_TYPES = ("loop", "section", "call")
+MAX_NESTING = 16     # nested loops/sections in one macro
+MAX_CALL_DEPTH = 16  # macros calling macros
+
+Instruction = Tuple[int, int, int]
+Callee = Union[Timeline, "Program"]
+
+class Streamed(ABC):
+    """A playable generated entry by entry while it plays rather than held as a tuple.
+
+    ``duration_ms`` is its play time, None when it runs until cancelled.
+    """
+
+    __slots__ = ()
+    duration_ms: Optional[float]
+
+    @abstractmethod
+    def walk(self, progress: Any = None) -> Iterator[TimelineEntry]:
+        """Yield timeline entries in play order, updating ``progress`` (a RunProgress) if given."""
+
+class Program(Streamed):
+    """Compiled structured macro. Calls stay symbolic until ``link()`` resolves them."""
+
+    __slots__ = ("code", "chunks", "labels", "calls", "callees", "duration_ms", "length")
+
+    def __init__(
+        self,
+        code: Tuple[Instruction, ...],
+        chunks: Tuple[Timeline, ...],
+        labels: Tuple[str, ...] = (),
+        calls: Tuple[str, ...] = (),
+        callees: Optional[Tuple[Callee, ...]] = None,
+    ):
+        if callees is None and not calls:
+            callees = ()
+        self.code = code
+        self.chunks = chunks
+        self.labels = labels
+        self.calls = calls
+        self.callees = callees
+        # 播放总时长与展开后的条目数；无限循环时为 None，未链接时未知
+        self.duration_ms: Optional[int] = None
+        self.length: Optional[int] = None
+        if self.linked:
+            self.duration_ms, self.length = self._measure()
+
+    @property
+    def linked(self) -> bool:
+        return self.callees is not None
+
+    @property
+    def endless(self) -> bool:
+        return self.linked and self.duration_ms is None
+
+    def __iter__(self) -> Iterator[TimelineEntry]:
+        return self.walk()
+
+    def link(self, resolve: Callable[[str], Callee], chain: Tuple[str, ...] = ()) -> "Program":
+        """Resolve calls with ``resolve(name)``, recursively; ``chain`` is the macros already being called."""
+        if not self.calls:
+            return self
+        if len(chain) >= MAX_CALL_DEPTH:
+            raise ValueError(f"Macro calls nested deeper than {MAX_CALL_DEPTH}: {' -> '.join(chain)}")
+        callees = []
+        for name in self.calls:
+            if name in chain:
+                raise ValueError(f"Macro calls itself: {' -> '.join(chain + (name,))}")
+            target = resolve(name)
+            if isinstance(target, Program):
+                target = target.link(resolve, chain + (name,))
+            callees.append(target)
+        return Program(self.code, self.chunks, self.labels, self.calls, tuple(callees))
+
+    def _measure(self) -> Tuple[Optional[int], Optional[int]]:
+        totals = [[0, 0]]  # 每层 [时长, 条目数]
+        counts: List[int] = []
+        for op, a, _ in self.code:
+            if op == OP_FRAMES:
+                chunk = self.chunks[a]
+                totals[-1][0] += sum(e.holdMs for e in chunk)
+                totals[-1][1] += len(chunk)
+            elif op == OP_LOOP:
+                counts.append(a)
+                totals.append([0, 0])
+            elif op == OP_END:
+                duration, length = totals.pop()
+                count = counts.pop()
+                if count == 0:
+                    if duration == 0:
+                        raise ValueError("A loop without count must take time")
+                    duration = length = math.inf
+                totals[-1][0] += duration * count if count else duration
+                totals[-1][1] += length * count if count else length
+            else:
+                callee = self.callees[a]
+                if isinstance(callee, Program):
+                    duration = math.inf if callee.duration_ms is None else callee.duration_ms
+                    length = math.inf if callee.length is None else callee.length
+                else:
+                    duration, length = sum(e.holdMs for e in callee), len(callee)
+                totals[-1][0] += duration
+                totals[-1][1] += length
+        duration, length = totals[0]
+        if duration == math.inf:
+            return None, None
+        return int(duration), int(length)
+
+    def walk(self, progress: Any = None) -> Iterator[TimelineEntry]:
+        """Yield timeline entries in play order.
+
+        ``progress.loops`` (a RunProgress) is kept pointing at the live loop
+        stack, one ``[label, iteration, count]`` per active loop or section.
+        """
+        if not self.linked:
+            raise ValueError("Program has unresolved macro calls")
+        frames: List[Tuple[Program, int]] = [(self, 0)]
+        loops: List[List[Any]] = []  # [label, iteration, count, remaining (-1 = forever)]
+        if progress is not None:
+            progress.loops = loops
+        while frames:
+            program, ip = frames[-1]
+            if ip == len(program.code):
+                frames.pop()
+                continue
+            op, a, b = program.code[ip]
+            ip += 1
+            if op == OP_FRAMES:
+                frames[-1] = (program, ip)
+                yield from program.chunks[a]
+                continue
+            if op == OP_LOOP:
+                loops.append([program.labels[b - 1] if b else None, 1, a or None, a or -1])
+            elif op == OP_END:
+                loop = loops[-1]
+                if loop[3] == 1:
+                    loops.pop()
+                else:
+                    if loop[3] > 1:
+                        loop[3] -= 1
+                    loop[1] += 1
+                    ip = a + 1
+            else:
+                frames[-1] = (program, ip)
+                callee = program.callees[a]
+                if isinstance(callee, Program):
+                    frames.append((callee, 0))
+                else:
+                    yield from callee
+                continue
+            frames[-1] = (program, ip)
+
+Playable = Union[Timeline, Streamed]
+
+def walk(timeline: Playable, progress: Any = None) -> Iterable[TimelineEntry]:
+    return timeline.walk(progress) if isinstance(timeline, Streamed) else timeline
+
+def planned_duration_ms(timeline: Playable) -> Optional[float]:
+    """Play time of a timeline, linked program or replay; None when it loops until cancelled."""
+    if isinstance(timeline, Streamed):
+        return timeline.duration_ms
+    return sum(entry.holdMs for entry in timeline)
+
+class _Builder:
+    def __init__(self):
+        self.code: List[Instruction] = []
+        self.chunks: List[Timeline] = []
+        self.labels: List[str] = []
+        self.calls: List[str] = []
+        self.pending: List[TimelineEntry] = []
+        self.index = 0
+        self.held = RESET_FRAME  # 之前的 state 步骤按住的输入
+
+    def flush(self):
+        if self.pending:
+            self.chunks.append(tuple(self.pending))
+            self.code.append((OP_FRAMES, len(self.chunks) - 1, 0))
+            self.pending = []
+
+    @staticmethod
+    def _intern(names: List[str], name: str) -> int:
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def add(self, steps: Sequence[Any], depth: int):
+        for step in steps:
+            # 步骤按先序编号，与错误信息和进度中的 step 一致
+            index = self.index
+            self.index += 1
+            if step.type in ("loop", "section"):
+                if depth >= MAX_NESTING:
+                    raise CompileError(index, f"loops nested deeper than {MAX_NESTING}")
+                if not step.steps:
+                    raise CompileError(index, f"steps field required for type={step.type}")
+                if step.type == "section" and not step.label:
+                    raise CompileError(index, "label field required for type=section")
+                count = 1 if step.type == "section" else step.count or 0
+                label = self._intern(self.labels, step.label) + 1 if step.label else 0
+                self.flush()
+                start = len(self.code)
+                held = self.held
+                self.code.append((OP_LOOP, count, label))
+                self.add(step.steps, depth + 1)
+                # 循环体只编译一次，每一遍开始时按住的输入必须相同
+                if count != 1 and self.held != held:
+                    raise CompileError(index, "a loop must end holding the same inputs it started with")
+                self.flush()
+                self.code.append((OP_END, start, 0))
+            elif step.type == "call":
+                if not step.macro:
+                    raise CompileError(index, "macro field required for type=call")
+                if self.held != RESET_FRAME:
+                    raise CompileError(index, "release held inputs before calling a macro")
+                self.flush()
+                self.code.append((OP_CALL, self._intern(self.calls, step.macro), 0))
+            else:
+                entries = compile_step(step, index, self.held)
+                self.held = held_after(entries, self.held)
+                self.pending.extend(entries)
+
+def compile_program(steps: Sequence[Any]) -> Playable:
+    """Compile ActionSteps, to a Program if any step is a loop, section or call, else a flat Timeline."""
+    if not any(step.type in CONTROL_TYPES for step in steps):
+        return compile_steps(steps)
+    builder = _Builder()
+    builder.add(steps, 0)
+    if builder.held != RESET_FRAME:
+        builder.pending.append(TimelineEntry(builder.index - 1, RESET_FRAME, 0))
+    builder.flush()
+    try:
+        return Program(tuple(builder.code), tuple(builder.chunks), tuple(builder.labels), tuple(builder.calls))
+    except ValueError as e:
+        raise CompileError(None, str(e))
+
+# 二进制编码（未链接形式）：头部 + 指令 + 时间线块(长度 u32 + encode_timeline) + 标签与调用名(长度 u16 + UTF-8)
+PROGRAM_HEADER = struct.Struct("<4sIIII")
+PROGRAM_MAGIC = b"ECP1"
+INSTRUCTION = struct.Struct("<BII")
+CHUNK_LENGTH = struct.Struct("<I")
+NAME_LENGTH = struct.Struct("<H")
+
+def encode_program(program: Program) -> bytes:
+    out = bytearray(PROGRAM_HEADER.pack(
+        PROGRAM_MAGIC, len(program.code), len(program.chunks), len(program.labels), len(program.calls)
+    ))
+    for instruction in program.code:
+        out += INSTRUCTION.pack(*instruction)
+    for chunk in program.chunks:
+        data = encode_timeline(chunk)
+        out += CHUNK_LENGTH.pack(len(data)) + data
+    for name in program.labels + program.calls:
+        data = name.encode()
+        out += NAME_LENGTH.pack(len(data)) + data
+    return bytes(out)
+
+def decode_program(data: bytes) -> Program:
+    magic, n_code, n_chunks, n_labels, n_calls = PROGRAM_HEADER.unpack_from(data)
+    if magic != PROGRAM_MAGIC:
+        raise ValueError("Not an encoded program")
+    offset = PROGRAM_HEADER.size
+    code = []
+    for _ in range(n_code):
+        code.append(INSTRUCTION.unpack_from(data, offset))
+        offset += INSTRUCTION.size
+    chunks = []
+    for _ in range(n_chunks):
+        (size,) = CHUNK_LENGTH.unpack_from(data, offset)
+        offset += CHUNK_LENGTH.size
+        chunks.append(decode_timeline(data[offset:offset + size]))
+        offset += size
+    names = []
+    for _ in range(n_labels + n_calls):
+        (size,) = NAME_LENGTH.unpack_from(data, offset)
+        offset += NAME_LENGTH.size
+        names.append(bytes(data[offset:offset + size]).decode())
+        offset += size
+    return Program(tuple(code), tuple(chunks), tuple(names[:n_labels]), tuple(names[n_labels:]))
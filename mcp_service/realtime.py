@@ -0,0 +1,71 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from mcp_service.scheduler import NS_PER_MS
+from mcp_service.timeline import RESET_FRAME
+
+DEFAULT_RATE_HZ = 125
+
+class LatestStateStreamer:
+    """Samples the most recent controller state at a fixed rate.
+
+    ``update()`` only replaces the pending frame, so states that arrive faster
+    than the sample rate are dropped instead of queued, and a tick whose state
+    equals the last frame sent puts nothing on the wire.
+    """
+
+    def __init__(self, send: Callable[[bytes], Awaitable[Any]], rate_hz: int = DEFAULT_RATE_HZ):
+        self._send = send
+        self._period_ns = 1_000_000_000 // rate_hz
+        self._pending: Optional[bytes] = None
+        self._last_sent = RESET_FRAME
+        self._dirty = False
+        self.updates = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def update(self, frame: bytes):
+        if self._dirty:
+            self.dropped += 1
+        self._pending = frame
+        self._dirty = True
+        self.updates += 1
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        frame = self._pending
+        self._dirty = False
+        if frame != self._last_sent:
+            await self._send(frame)
+            self._last_sent = frame
+            self.sent += 1
+
+    async def run(self):
+        """Tick until cancelled; deadlines are absolute so the rate does not drift."""
+        deadline = time.perf_counter_ns()
+        while True:
+            await self._flush()
+            deadline += self._period_ns
+            remaining = deadline - time.perf_counter_ns()
+            if remaining > 0:
+                await asyncio.sleep(remaining / 1e9)
+            else:
+                deadline = time.perf_counter_ns()
+
+    async def close(self):
+        """Send any pending state, then make sure the controller ends neutral."""
+        await self._flush()
+        if self._last_sent != RESET_FRAME:
+            await self._send(RESET_FRAME)
+            self._last_sent = RESET_FRAME
+            self.sent += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rateHz": round(1000 * NS_PER_MS / self._period_ns, 1),
+            "updates": self.updates,
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
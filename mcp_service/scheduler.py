@@ -0,0 +1,457 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from mcp_service.arbiter import PRIORITY_NORMAL, LinkArbiter, Turn
+from mcp_service.metrics import Histogram
+from mcp_service.output_stage import OutputStage
+from mcp_service.program import Playable, Streamed, planned_duration_ms, walk
+from mcp_service.timeline import RESET_FRAME, held_after
+
+NS_PER_MS = 1_000_000
+NS_PER_US = 1_000
+
+@dataclass
+class TimingConfig:
+    precision: bool = False      # coarse sleep, then spin on perf_counter_ns up to each deadline
+    spinUs: int = 2000           # how long before a deadline to stop sleeping and start spinning
+    cpu: Optional[int] = None    # run timelines on a dedicated thread pinned to this CPU
+    window: int = 1              # report frames in flight before waiting for Ack; 1 = stop-and-wait
+    diffFrames: bool = False     # drop redundant frames and merge short releases into the next press
+
+# 抖动直方图桶上界（微秒），最后一个桶收集所有更大的值
+JITTER_BUCKETS_US = (10, 25, 50, 100, 250, 500, 1000, 2000, 5000, 10000)
+
+class JitterHistogram:
+    """Fixed-bucket histogram of per-frame lateness, allocated once."""
+
+    def __init__(self, bounds_us=JITTER_BUCKETS_US):
+        self._bounds = tuple(b * NS_PER_US for b in bounds_us)
+        self._counts: List[int] = [0] * (len(self._bounds) + 1)
+        self._total = 0
+        self._max = 0
+
+    def record(self, late_ns: int):
+        late_ns = max(late_ns, 0)
+        i = 0
+        for bound in self._bounds:
+            if late_ns <= bound:
+                break
+            i += 1
+        self._counts[i] += 1
+        self._total += late_ns
+        if late_ns > self._max:
+            self._max = late_ns
+
+    def snapshot(self):
+        """(bucket bounds in ns, per-bucket counts, total lateness in ns)"""
+        return self._bounds, list(self._counts), self._total
+
+    def reset(self):
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._total = 0
+        self._max = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = sum(self._counts)
+        labels = [f"<={b // NS_PER_US}us" for b in self._bounds]
+        labels.append(f">{self._bounds[-1] // NS_PER_US}us")
+        return {
+            "count": count,
+            "meanUs": round(self._total / count / NS_PER_US, 1) if count else 0.0,
+            "maxUs": round(self._max / NS_PER_US, 1),
+            "buckets": [{"le": label, "count": c} for label, c in zip(labels, self._counts)],
+        }
+
+@dataclass
+class RunTiming:
+    frames: int = 0
+    plannedNs: int = 0
+    actualNs: int = 0
+    totalLateNs: int = 0
+    maxLateNs: int = 0
+    link: Optional[Dict[str, int]] = None    # Ack/Busy counters of a pipelined run
+    output: Optional[Dict[str, int]] = None  # frames sent vs suppressed by the output stage
+    steps: Optional[List[Tuple[int, int, int]]] = None  # (step, planned offset ns, late ns) of each step's first frame
+    queuedNs: Optional[int] = None  # wait for the device before the first frame
+    pausedNs: int = 0               # time the run was held back by higher-priority runs played inside it
+
+    def record(self, late_ns: int):
+        self.frames += 1
+        if late_ns > 0:
+            self.totalLateNs += late_ns
+            if late_ns > self.maxLateNs:
+                self.maxLateNs = late_ns
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "frames": self.frames,
+            "plannedMs": round(self.plannedNs / NS_PER_MS, 3),
+            "actualMs": round(self.actualNs / NS_PER_MS, 3),
+            "driftMs": round((self.actualNs - self.pausedNs - self.plannedNs) / NS_PER_MS, 3),
+            "meanLateMs": round(self.totalLateNs / self.frames / NS_PER_MS, 3) if self.frames else 0.0,
+            "maxLateMs": round(self.maxLateNs / NS_PER_MS, 3),
+        }
+        if self.queuedNs is not None:
+            result["queueMs"] = round(self.queuedNs / NS_PER_MS, 3)
+        if self.pausedNs:
+            result["pausedMs"] = round(self.pausedNs / NS_PER_MS, 3)
+        if self.link is not None:
+            result["link"] = self.link
+        if self.output is not None:
+            result["output"] = self.output
+        return result
+
+@dataclass
+class RunProgress:
+    repeat: int = 0
+    step: int = 0
+    startNs: int = 0
+    plannedNs: Optional[int] = 0  # None while a program loops until cancelled
+    endNs: int = 0
+    loops: Optional[List[List[Any]]] = None  # live loop stack of a Program run
+
+    def finish(self):
+        self.endNs = time.perf_counter_ns()
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = (self.endNs or time.perf_counter_ns()) - self.startNs if self.startNs else 0
+        result = {
+            "repeat": self.repeat,
+            "step": self.step,
+            "elapsedMs": round(elapsed / NS_PER_MS, 3),
+            "plannedMs": round(self.plannedNs / NS_PER_MS, 3) if self.plannedNs is not None else None,
+        }
+        if self.loops is not None:
+            result["loops"] = [
+                {"label": label, "iteration": iteration, "count": count}
+                for label, iteration, count, _ in list(self.loops)
+            ]
+        return result
+
+class DeadlineScheduler:
+    """Plays timelines against absolute deadlines on the monotonic clock.
+
+    Every entry is due at ``start + sum(previous holds)``, so a late frame only
+    shortens the wait before the next one instead of shifting the rest of the run.
+
+    With an ``arbiter``, the wait before each step's first frame, before any
+    frame following a neutral report (so loops and repeats of one step count
+    too) and after the last frame is a step boundary: a waiting run that outranks
+    ``priority`` is played there through the same ``send``, and if it ends
+    after the boundary's deadline the rest of this run is shifted by the
+    overrun.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes], Any],
+        config: Optional[TimingConfig] = None,
+        jitter: Optional[JitterHistogram] = None,
+        stop: Optional[threading.Event] = None,
+        trace_steps: bool = False,
+        arbiter: Optional[LinkArbiter] = None,
+        priority: int = PRIORITY_NORMAL,
+    ):
+        self._send = send
+        self._config = config or TimingConfig()
+        self._jitter = jitter
+        self._trace_steps = trace_steps
+        self._arbiter = arbiter
+        self._priority = priority
+        # 阻塞模式下用于从其他线程中止运行
+        self._stop = stop or threading.Event()
+
+    def wait_until(self, deadline_ns: int):
+        if not self._config.precision:
+            remaining = deadline_ns - time.perf_counter_ns()
+            if remaining > 0:
+                self._stop.wait(remaining / 1e9)
+            return
+        # 先粗略睡眠到截止时间前 spinUs，再自旋等待，避免 time.sleep 的过冲
+        coarse = deadline_ns - self._config.spinUs * NS_PER_US - time.perf_counter_ns()
+        if coarse > 0 and self._stop.wait(coarse / 1e9):
+            return
+        while time.perf_counter_ns() < deadline_ns:
+            pass
+
+    async def wait_until_async(self, deadline_ns: int):
+        # 精确模式下最后 spinUs 在事件循环上轮询而不独占：每次检查之间让出一次，
+        # 其他设备的时间线和 HTTP 请求照常运行；忙等自旋只在固定线程上进行
+        spin = self._config.spinUs * NS_PER_US if self._config.precision else 0
+        coarse = deadline_ns - spin - time.perf_counter_ns()
+        if coarse > 0:
+            await asyncio.sleep(coarse / 1e9)
+        if self._config.precision:
+            while time.perf_counter_ns() < deadline_ns:
+                await asyncio.sleep(0)
+
+    def _mark(self, timing: RunTiming, start: int, offset: int, step: int):
+        late = time.perf_counter_ns() - start - offset
+        timing.record(late)
+        if self._jitter is not None:
+            self._jitter.record(late)
+        if timing.steps is not None and (not timing.steps or timing.steps[-1][0] != step):
+            timing.steps.append((step, offset, late))
+
+    def _begin(self, timeline: Playable, repeat: int, progress: Optional[RunProgress], start: int) -> int:
+        if progress is not None:
+            progress.startNs = start
+            planned = planned_duration_ms(timeline)
+            progress.plannedNs = planned * repeat * NS_PER_MS if planned is not None else None
+        return start
+
+    def run(
+        self,
+        timeline: Playable,
+        repeat: int = 1,
+        progress: Optional[RunProgress] = None,
+        start_ns: Optional[int] = None,
+    ) -> RunTiming:
+        """Play ``timeline``, from ``start_ns`` if given; returns early once the stop event is set."""
+        timing = RunTiming(steps=[] if self._trace_steps else None)
+        if start_ns is not None:
+            self.wait_until(start_ns)
+        start = self._begin(timeline, repeat, progress, start_ns or time.perf_counter_ns())
+        began = start
+        offset = 0
+        step = sent = None
+        for r in range(repeat):
+            for entry in walk(timeline, progress):
+                if entry.frame is not None:
+                    if self._arbiter is not None and step is not None and (entry.step != step or sent == RESET_FRAME):
+                        start = self._boundary(timing, start, offset)
+                    step, sent = entry.step, entry.frame
+                    self.wait_until(start + offset)
+                    if self._stop.is_set():
+                        timing.actualNs = time.perf_counter_ns() - began
+                        return timing
+                    if progress is not None:
+                        progress.repeat, progress.step = r, entry.step
+                    self._mark(timing, start, offset, entry.step)
+                    self._send(entry.frame)
+                offset += entry.holdMs * NS_PER_MS
+        if self._arbiter is not None:
+            start = self._boundary(timing, start, offset)
+        self.wait_until(start + offset)
+        timing.plannedNs = offset
+        timing.actualNs = time.perf_counter_ns() - began
+        return timing
+
+    async def run_async(
+        self,
+        timeline: Playable,
+        repeat: int = 1,
+        progress: Optional[RunProgress] = None,
+        start_ns: Optional[int] = None,
+    ) -> RunTiming:
+        """Same as run(), with ``send`` a coroutine function and waits on the event loop."""
+        timing = RunTiming(steps=[] if self._trace_steps else None)
+        if start_ns is not None:
+            await self.wait_until_async(start_ns)
+        start = self._begin(timeline, repeat, progress, start_ns or time.perf_counter_ns())
+        began = start
+        offset = 0
+        step = sent = None
+        for r in range(repeat):
+            for entry in walk(timeline, progress):
+                if entry.frame is not None:
+                    if self._arbiter is not None and step is not None and (entry.step != step or sent == RESET_FRAME):
+                        start = await self._boundary_async(timing, start, offset)
+                    step, sent = entry.step, entry.frame
+                    await self.wait_until_async(start + offset)
+                    if progress is not None:
+                        progress.repeat, progress.step = r, entry.step
+                    self._mark(timing, start, offset, entry.step)
+                    await self._send(entry.frame)
+                offset += entry.holdMs * NS_PER_MS
+        if self._arbiter is not None:
+            start = await self._boundary_async(timing, start, offset)
+        await self.wait_until_async(start + offset)
+        timing.plannedNs = offset
+        timing.actualNs = time.perf_counter_ns() - began
+        return timing
+
+    def _spin_ns(self) -> int:
+        return self._config.spinUs * NS_PER_US if self._config.precision else 0
+
+    def _inline(self, turn: Turn) -> "DeadlineScheduler":
+        # 插入的运行有自己的停止事件：取消当前运行时它仍会完整播放
+        return DeadlineScheduler(
+            self._send, self._config, self._jitter, None, turn.trace_steps, self._arbiter, turn.priority
+        )
+
+    def _shift(self, timing: RunTiming, start: int, offset: int) -> int:
+        overrun = time.perf_counter_ns() - start - offset
+        if overrun > 0:
+            timing.pausedNs += overrun
+            return start + overrun
+        return start
+
+    def _boundary(self, timing: RunTiming, start: int, offset: int) -> int:
+        """Play outranking runs until this run's next deadline; returns the (possibly shifted) start."""
+        while not self._stop.is_set():
+            turn = self._arbiter.take(self._priority)
+            if turn is not None:
+                try:
+                    self._arbiter.finish(turn, self._inline(turn).run(turn.timeline, turn.repeat, turn.progress))
+                except BaseException as e:
+                    self._arbiter.finish(turn, error=e)
+                    raise
+                start = self._shift(timing, start, offset)
+                continue
+            remaining = start + offset - self._spin_ns() - time.perf_counter_ns()
+            if remaining <= 0 or not self._arbiter.signal.wait(remaining / 1e9):
+                break
+        return start
+
+    async def _boundary_async(self, timing: RunTiming, start: int, offset: int) -> int:
+        while True:
+            turn = self._arbiter.take(self._priority)
+            if turn is not None:
+                play = asyncio.get_running_loop().create_task(
+                    self._inline(turn).run_async(turn.timeline, turn.repeat, turn.progress)
+                )
+                try:
+                    await asyncio.shield(play)
+                except asyncio.CancelledError:
+                    # 当前运行被取消：插入的运行照常播完再退出
+                    await asyncio.wait([play])
+                    raise
+                finally:
+                    if play.cancelled():
+                        self._arbiter.finish(turn, error=asyncio.CancelledError())
+                    elif play.done():
+                        self._arbiter.finish(turn, play.result() if play.exception() is None else None, play.exception())
+                start = self._shift(timing, start, offset)
+                continue
+            remaining = start + offset - self._spin_ns() - time.perf_counter_ns()
+            if remaining <= 0 or not await self._arbiter.wait_async(remaining):
+                return start
+
+def _pin_thread(cpu: int):
+    os.sched_setaffinity(0, {cpu})
+
+class TimingExecutor:
+    """Runs timelines with the current TimingConfig, on a pinned thread when ``cpu`` is set."""
+
+    def __init__(self):
+        self.config = TimingConfig()
+        self.jitter = JitterHistogram()
+        self.output = {"sent": 0, "suppressed": 0}
+        self.drift = Histogram()
+        self.runs = 0
+        self.planned_ns = 0
+        self.actual_ns = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def configure(self, config: TimingConfig):
+        cpu = config.cpu
+        if cpu is not None:
+            if not hasattr(os, "sched_setaffinity"):
+                raise RuntimeError("CPU pinning is not supported on this platform")
+            if cpu not in os.sched_getaffinity(0):
+                raise RuntimeError(f"CPU {cpu} is not available to this process")
+        if self._pool is not None and cpu != self.config.cpu:
+            # 在事件循环上调用：不等待，正在进行的固定线程运行在旧线程上播完
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self.config = config
+
+    def _pinned_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="easycon-timing",
+                initializer=_pin_thread,
+                initargs=(self.config.cpu,),
+            )
+        return self._pool
+
+    def _account(self, timing: RunTiming, stage: Optional[OutputStage]):
+        self.runs += 1
+        self.planned_ns += timing.plannedNs
+        self.actual_ns += timing.actualNs
+        self.drift.observe(max(timing.actualNs - timing.pausedNs - timing.plannedNs, 0))
+        if stage is not None:
+            timing.output = stage.stats()
+            self.output["sent"] += stage.sent
+            self.output["suppressed"] += stage.suppressed
+
+    async def run_async(
+        self,
+        ser: Any,
+        timeline: Playable,
+        repeat: int = 1,
+        progress: Optional[RunProgress] = None,
+        start_ns: Optional[int] = None,
+        trace_steps: bool = False,
+        arbiter: Optional[LinkArbiter] = None,
+        priority: int = PRIORITY_NORMAL,
+    ) -> RunTiming:
+        """Play ``timeline`` on an AsyncEasyConSerial.
+
+        Runs on the event loop, or with ``cpu`` set holds the link and hands
+        the run to the pinned thread using its blocking send. ``start_ns``
+        delays the first frame to an absolute perf_counter_ns instant;
+        ``trace_steps`` fills ``RunTiming.steps``. With the device's
+        ``arbiter``, runs outranking ``priority`` are played at step boundaries.
+        """
+        stage = OutputStage() if self.config.diffFrames else None
+        final = RESET_FRAME
+        if stage is not None and not isinstance(timeline, Streamed):
+            # 以按住状态结束的时间线（/state 的 hold）保持按住，不补发中立帧
+            final = held_after(timeline)
+            # 程序和回放边播放边生成，只在发送时去重
+            timeline = stage.plan(timeline)
+        window = self.config.window
+        if self.config.cpu is None and window <= 1:
+            timing = await self._play_async(ser.transact, stage, timeline, repeat, progress, start_ns, trace_steps, arbiter, priority, final)
+        elif self.config.cpu is None:
+            async with ser.pipeline(window) as pipe:
+                timing = await self._play_async(pipe.submit, stage, timeline, repeat, progress, start_ns, trace_steps, arbiter, priority, final)
+            timing.link = pipe.window.stats()
+        else:
+            async with ser.exclusive(window) as (send, tx):
+                timing = await self._play_pinned(send, stage, timeline, repeat, progress, start_ns, trace_steps, arbiter, priority, final)
+            if tx is not None:
+                timing.link = tx.stats()
+        self._account(timing, stage)
+        return timing
+
+    async def _play_async(self, send, stage, timeline, repeat, progress, start_ns, trace_steps, arbiter, priority, final) -> RunTiming:
+        staged = stage.wrap_async(send) if stage is not None else send
+        scheduler = DeadlineScheduler(staged, self.config, self.jitter, None, trace_steps, arbiter, priority)
+        timing = await scheduler.run_async(timeline, repeat, progress, start_ns)
+        if stage is not None and stage.needs_reset(final):
+            await staged(RESET_FRAME)
+        return timing
+
+    async def _play_pinned(self, send, stage, timeline, repeat, progress, start_ns, trace_steps, arbiter, priority, final) -> RunTiming:
+        staged = stage.wrap(send) if stage is not None else send
+        stop = threading.Event()
+        scheduler = DeadlineScheduler(staged, self.config, self.jitter, stop, trace_steps, arbiter, priority)
+
+        def play() -> RunTiming:
+            timing = scheduler.run(timeline, repeat, progress, start_ns)
+            # 在同一线程补发中立帧：运行期间 configure() 可能已换掉线程池
+            if stage is not None and not stop.is_set() and stage.needs_reset(final):
+                staged(RESET_FRAME)
+            return timing
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pinned_pool(), play)
+        try:
+            timing = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 线程无法被取消：通知其停止并等它放开串口后再释放锁
+            stop.set()
+            if arbiter is not None:
+                arbiter.signal.set()  # 唤醒在步骤边界等待的线程
+            await asyncio.wait([future])
+            raise
+        return timing
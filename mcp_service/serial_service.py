@@ -1,6 +1,7 @@
 import binascii
-import threading
-from typing import List, Optional, Tuple
+import os
+import time
+from typing import Any, Iterator, List, Optional, Tuple
 
 import serial
 import serial.tools.list_ports
@@ -29,76 +30,140 @@ class Reply:
     FlashEnd = 0x82
     ScriptAck = 0x83
 
+# 每个请求对应的回复长度：报告帧回复 1 字节 Ack/Busy，命令按下表；None 表示变长回复（读到线路空闲为止）
+REPORT_REPLY_BYTES = 1
+COMMAND_REPLY_BYTES = {
+    Command.Debug: None,
+    Command.Hello: 1,
+    Command.Flash: 1,
+    Command.ScriptStart: 1,
+    Command.ScriptStop: 1,
+    Command.Version: None,
+    Command.LED: 1,
+    Command.UnPair: 1,
+    Command.ChangeControllerMode: 1,
+    Command.ChangeControllerColor: 1,
+    Command.SaveAmiibo: 1,
+    Command.ChangeAmiiboIndex: 1,
+}
+VARIABLE_REPLY_MAX_BYTES = 32
+REPLY_IDLE_GAP = 0.02
+
+def expected_reply_bytes(data: bytes) -> Optional[int]:
+    """Reply length the firmware sends for ``data``; None for variable-length replies."""
+    if len(data) >= 3 and data[0] == Command.Ready and data[1] == Command.Ready:
+        return COMMAND_REPLY_BYTES.get(data[2])
+    return REPORT_REPLY_BYTES
+
+def is_report(data: bytes, reply_bytes: int = 0) -> bool:
+    """True when a request is a report frame: commands start with Ready, report bytes are 7-bit."""
+    return not reply_bytes and bool(data) and data[0] != Command.Ready
+
+# Flash 协议：A5 A5 82 addr(7bit x2) len(7bit x2) -> FlashStart，随后发送数据 -> FlashEnd
+FLASH_CHUNK_BYTES = 20
+
+def flash_packets(data: bytes) -> Iterator[Tuple[bytes, bytes]]:
+    """Split ``data`` into (header, chunk) pairs for the Flash handshake."""
+    for address in range(0, len(data), FLASH_CHUNK_BYTES):
+        chunk = data[address:address + FLASH_CHUNK_BYTES]
+        header = bytes([
+            Command.Ready, Command.Ready, Command.Flash,
+            address & 0x7F, (address >> 7) & 0x7F,
+            len(chunk) & 0x7F, (len(chunk) >> 7) & 0x7F,
+        ])
+        yield header, chunk
+
+def check_reply(resp: bytes, expected: int, what: str) -> bytes:
+    if not resp or resp[0] != expected:
+        raise RuntimeError(f"{what} failed, got: {binascii.hexlify(resp or b'').decode()}")
+    return resp
+
+def read_reply(ser: serial.Serial, length: Optional[int], timeout: float, metrics: Any = None) -> bytes:
+    """Read one framed reply; Busy/Error end the frame after their single byte.
+
+    ``metrics`` (a LinkMetrics) records time to the first byte and to the full reply.
+    """
+    ser.timeout = timeout
+    first = ser.read(1)
+    if metrics is not None:
+        metrics.on_first_byte(first)
+    resp = _read_rest(ser, first, length)
+    if metrics is not None:
+        metrics.on_reply(resp)
+    return resp
+
+def _read_rest(ser: serial.Serial, first: bytes, length: Optional[int]) -> bytes:
+    if not first or first[0] in (Reply.Busy, Reply.Error) or length == 1:
+        return first
+    if length is not None:
+        return first + ser.read(length - 1)
+    buf = bytearray(first)
+    ser.timeout = REPLY_IDLE_GAP
+    while len(buf) < VARIABLE_REPLY_MAX_BYTES:
+        want = min(max(ser.in_waiting, 1), VARIABLE_REPLY_MAX_BYTES - len(buf))
+        chunk = ser.read(want)
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
 def list_serial_ports() -> List[Tuple[str, str]]:
     ports = []
     for p in serial.tools.list_ports.comports():
         ports.append((p.device, f"{p.manufacturer or ''} {p.description or ''}".strip()))
     return ports
 
-class EasyConSerial:
+# 设备节点增删会改变这些目录的 mtime
+PORT_WATCH_DIRS = ("/dev", "/dev/serial/by-id")
+PORT_CACHE_TTL = 5.0       # seconds, when none of PORT_WATCH_DIRS exists (Windows)
+PORT_CACHE_MAX_AGE = 60.0  # seconds; mtimes are coarse, a node added and removed within one tick leaves no trace
+
+class PortCache:
+    """``list_serial_ports()`` result, enumerated again only when a device node is added or removed.
+
+    Checking costs one stat per watched directory instead of a full scan of
+    the tty devices. The list also expires after ``PORT_CACHE_MAX_AGE``, or
+    ``PORT_CACHE_TTL`` where no directory can be watched.
+    """
+
     def __init__(self):
-        self._ser: Optional[serial.Serial] = None
-        self._lock = threading.Lock()
-        self._port_name: Optional[str] = None
-
-    @property
-    def connected(self) -> bool:
-        return self._ser is not None and self._ser.is_open
-
-    @property
-    def port(self) -> Optional[str]:
-        return self._port_name
-
-    def connect(self, port: str, baud: int = 115200, timeout: float = 0.5):
-        with self._lock:
-            if self.connected:
-                raise RuntimeError("Already connected")
-            s = serial.Serial()
-            s.port = port
-            s.baudrate = baud
-            s.bytesize = serial.EIGHTBITS
-            s.parity = serial.PARITY_NONE
-            s.stopbits = serial.STOPBITS_ONE
-            s.timeout = timeout
-            s.write_timeout = timeout
-            s.open()
-            self._ser = s
-            self._port_name = port
-
-    def disconnect(self):
-        with self._lock:
-            if self._ser:
-                try:
-                    self._ser.close()
-                finally:
-                    self._ser = None
-                    self._port_name = None
-
-    def eat_verbose(self):
-        with self._lock:
-            if not self.connected:
-                raise RuntimeError("Serial not connected")
-            if self._ser.in_waiting:
-                _ = self._ser.read(self._ser.in_waiting)
-
-    def send_and_recv(self, data: bytes, max_bytes: int = 255, timeout: float = 0.5) -> bytes:
-        with self._lock:
-            if not self.connected:
-                raise RuntimeError("Serial not connected")
-            old_timeout = self._ser.timeout
-            self._ser.timeout = timeout
+        self._ports: Optional[List[Tuple[str, str]]] = None
+        self._stamp: Tuple[Optional[int], ...] = ()
+        self._listed_at = 0.0
+        self.scans = 0
+
+    @staticmethod
+    def _dir_stamp() -> Tuple[Optional[int], ...]:
+        stamp = []
+        for path in PORT_WATCH_DIRS:
             try:
-                self._ser.write(data)
-                self._ser.flush()
-                buf = self._ser.read(max_bytes)
-                return buf or b""
-            finally:
-                self._ser.timeout = old_timeout
-
-    def handshake(self) -> bytes:
-        self.eat_verbose()
-        req = bytes([Command.Ready, Command.Ready, Command.Hello])
-        resp = self.send_and_recv(req, max_bytes=8, timeout=0.5)
-        if not resp or resp[0] != Reply.Hello:
-            raise RuntimeError(f"Handshake failed, got: {binascii.hexlify(resp or b'').decode()}")
-        return resp
\ No newline at end of file
+                stamp.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def list(self, refresh: bool = False) -> List[Tuple[str, str]]:
+        # 先取时间戳再枚举：枚举期间插入的设备会在下次调用时重新扫描
+        stamp = self._dir_stamp()
+        now = time.monotonic()
+        expired = now - self._listed_at > (PORT_CACHE_MAX_AGE if any(stamp) else PORT_CACHE_TTL)
+        if refresh or self._ports is None or stamp != self._stamp or expired:
+            self._ports = list_serial_ports()
+            self._stamp = stamp
+            self._listed_at = now
+            self.scans += 1
+        return self._ports
+
+def open_serial(
+    port: str, baud: int = 115200, timeout: float = 0.5, write_timeout: Optional[float] = None
+) -> serial.Serial:
+    s = serial.Serial()
+    s.port = port
+    s.baudrate = baud
+    s.bytesize = serial.EIGHTBITS
+    s.parity = serial.PARITY_NONE
+    s.stopbits = serial.STOPBITS_ONE
+    s.timeout = timeout
+    s.write_timeout = timeout if write_timeout is None else write_timeout
+    s.open()
+    return s
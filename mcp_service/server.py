@@ -1,11 +1,19 @@
 from typing import Optional, List, Dict, Any
-import time
+import asyncio
 import json
+import os
+import time
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel, Field
 
-from mcp_service.serial_service import EasyConSerial, list_serial_ports, Command
+from mcp_service.serial_service import PortCache, Command
+from mcp_service.broker import Broker, BrokerClient
+from mcp_service.devices import DEFAULT_DEVICE
+from mcp_service.mcp_server import McpServer
+from mcp_service.metrics import HttpMetrics
+from mcp_service.program import compile_program
 from mcp_service.switch_protocol import (
     SwitchReport,
     RESET_REPORT,
@@ -13,44 +21,93 @@ from mcp_service.switch_protocol import (
     SwitchHAT,
     SwitchStick,
 )
+from mcp_service.timeline import (
+    RESET_FRAME,
+    CompileError,
+    TimelineEntry,
+    compile_step,
+    held_after,
+    overlay,
+    press_timeline,
+    state_report,
+    trajectory_timeline,
+)
+from mcp_service.realtime import DEFAULT_RATE_HZ, LatestStateStreamer
 
 app = FastAPI(title="EasyCon MCP Service", version="2.0.0")
-SER = EasyConSerial()
 
-# In-memory macro storage
-MACROS: Dict[str, List[Dict[str, Any]]] = {}
+# Serial ports, jobs and macros live in the broker: in-process by default, or a
+# separate process (python -m mcp_service.broker) when EASYCON_BROKER is set,
+# which lets several uvicorn workers share the devices.
+BROKER_SOCKET = os.environ.get("EASYCON_BROKER")
+CORE = BrokerClient(BROKER_SOCKET) if BROKER_SOCKET else Broker()
+# 多 worker 时每个进程各自统计请求指标，用 worker 标签区分
+HTTP_METRICS = HttpMetrics(worker=str(os.getpid()) if BROKER_SOCKET else None)
+PORTS = PortCache()
 
-class ConnectReq(BaseModel):
+class DeviceTarget(BaseModel):
+    device: str = DEFAULT_DEVICE  # device ID from /connect
+
+class ConnectReq(DeviceTarget):
     port: str
     baud: int = 115200
 
-class PressButtonReq(BaseModel):
+class PressButtonReq(DeviceTarget):
     button: str
     durationMs: int = Field(default=50, ge=0, le=2000)
 
-class PressHatReq(BaseModel):
+    def report(self) -> SwitchReport:
+        return state_report([self.button])
+
+class PressHatReq(DeviceTarget):
     direction: str
     durationMs: int = Field(default=50, ge=0, le=2000)
 
-class StickReq(BaseModel):
+    def report(self) -> SwitchReport:
+        return state_report(hat=self.direction)
+
+class StickReq(DeviceTarget):
     lx: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
     ly: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
     rx: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
     ry: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
     durationMs: int = Field(default=50, ge=0, le=5000)
 
-class RawSendReq(BaseModel):
+    def report(self) -> SwitchReport:
+        return SwitchReport(LX=self.lx, LY=self.ly, RX=self.rx, RY=self.ry)
+
+class TrajectoryFields(BaseModel):
+    # type=trajectory 的参数，默认值见 mcp_service.trajectory
+    shape: Optional[str] = None  # "ramp", "arc", "circle", "spline"
+    stick: Optional[str] = None  # "left" (default) or "right"
+    points: Optional[List[List[int]]] = None  # ramp/spline waypoints [[x, y], ...]
+    center: Optional[List[int]] = Field(default=None, min_length=2, max_length=2)
+    radius: Optional[int] = Field(default=None, ge=0, le=255)
+    startDeg: Optional[float] = None
+    endDeg: Optional[float] = None
+    turns: Optional[float] = None
+    easing: Optional[str] = None  # "linear", "ease-in", "ease-out", "ease-in-out"
+    rateHz: Optional[int] = Field(default=None, ge=1, le=1000)
+
+class TrajectoryReq(DeviceTarget, TrajectoryFields):
+    shape: str
+    durationMs: int = Field(default=1000, ge=0, le=60000)
+
+class RawSendReq(DeviceTarget):
     hex: Optional[str] = None
     bytes: Optional[List[int]] = None
     timeoutMs: int = 500
     maxBytes: int = 255
 
-class ComboButtonReq(BaseModel):
+class ComboButtonReq(DeviceTarget):
     buttons: List[str]
     durationMs: int = Field(default=50, ge=0, le=2000)
 
-class ActionStep(BaseModel):
-    type: str  # "button", "hat", "stick", "wait", "combo"
+    def report(self) -> SwitchReport:
+        return state_report(self.buttons)
+
+class ActionStep(TrajectoryFields):
+    type: str  # "button", "hat", "stick", "trajectory", "wait", "combo", "state", "release", "loop", "section", "call"
     button: Optional[str] = None
     buttons: Optional[List[str]] = None
     direction: Optional[str] = None
@@ -59,26 +116,50 @@ class ActionStep(BaseModel):
     rx: Optional[int] = None
     ry: Optional[int] = None
     durationMs: int = Field(default=50, ge=0, le=5000)
-
-class SequenceReq(BaseModel):
+    hold: bool = False  # state: keep the inputs held after the step instead of releasing them
+    # 控制流：loop / section 的子步骤，call 调用的已保存宏
+    steps: Optional[List["ActionStep"]] = None
+    count: Optional[int] = Field(default=None, ge=1)  # loop iterations; omitted = until cancelled
+    label: Optional[str] = None
+    macro: Optional[str] = None
+
+class SequenceReq(DeviceTarget):
     steps: List[ActionStep]
     repeatCount: int = Field(default=1, ge=1, le=100)
+    background: bool = False  # return a job ID immediately instead of waiting
+    priority: Optional[str] = None  # interactive | normal | background; default by background
+    dryRun: bool = False   # return the planned frames and timing without touching the serial port
+    profile: bool = False  # play, and add the dry-run profile with a planned-vs-actual comparison
 
 class MacroReq(BaseModel):
     name: str
     steps: List[ActionStep]
 
-class ExecuteMacroReq(BaseModel):
+class ExecuteMacroReq(DeviceTarget):
     name: str
     repeatCount: int = Field(default=1, ge=1, le=100)
+    background: bool = False
+    priority: Optional[str] = None
+    dryRun: bool = False
+    profile: bool = False
 
-class LEDReq(BaseModel):
+class FanoutReq(BaseModel):
+    name: str
+    devices: List[str] = Field(min_length=1)
+    repeatCount: int = Field(default=1, ge=1, le=100)
+    startDelayMs: int = Field(default=50, ge=0, le=5000)  # lead time so every device starts on the same deadline
+
+class ScriptFlashReq(DeviceTarget):
+    name: str
+    repeatCount: int = Field(default=1, ge=0, le=65535)  # 0 = loop until /script/stop
+
+class LEDReq(DeviceTarget):
     state: bool  # True = ON, False = OFF
 
-class ControllerModeReq(BaseModel):
+class ControllerModeReq(DeviceTarget):
     mode: int = Field(default=0, ge=0, le=2)  # 0=Pro, 1=JoyConL, 2=JoyConR
 
-class ControllerColorReq(BaseModel):
+class ControllerColorReq(DeviceTarget):
     body_r: int = Field(default=0, ge=0, le=255)
     body_g: int = Field(default=0, ge=0, le=255)
     body_b: int = Field(default=0, ge=0, le=255)
@@ -86,106 +167,141 @@ class ControllerColorReq(BaseModel):
     button_g: int = Field(default=0, ge=0, le=255)
     button_b: int = Field(default=0, ge=0, le=255)
 
-class BatchRequest(BaseModel):
+class BatchRequest(DeviceTarget):
     commands: List[Dict[str, Any]]
+    background: bool = False
+    priority: Optional[str] = None
+    dryRun: bool = False
+    profile: bool = False
+
+class ControllerState(BaseModel):
+    buttons: List[str] = []
+    hat: Optional[str] = None
+    lx: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
+    ly: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
+    rx: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
+    ry: int = Field(default=SwitchStick.STICK_CENTER, ge=0, le=255)
+
+class StateReq(DeviceTarget, ControllerState):
+    durationMs: int = Field(default=50, ge=0, le=5000)
+    hold: bool = False  # keep the state until the next report instead of releasing after durationMs
+
+    def report(self) -> SwitchReport:
+        return state_report(self.buttons, self.hat, self.lx, self.ly, self.rx, self.ry)
+
+class WaitReq(DeviceTarget):
+    durationMs: int = Field(default=100, ge=0, le=60000)
+
+class TimingConfigReq(BaseModel):
+    precision: bool = False
+    spinUs: int = Field(default=2000, ge=0, le=20000)
+    cpu: Optional[int] = Field(default=None, ge=0)
+    window: int = Field(default=1, ge=1, le=64)  # >1 pipelines report frames with Busy flow control
+    diffFrames: bool = False  # suppress redundant frames and merge short releases
+
+class TraceStartReq(BaseModel):
+    name: Optional[str] = None  # file name in the trace directory; timestamped by default
+
+class TraceReplayReq(DeviceTarget):
+    name: str
+    source: Optional[str] = None  # recorded device to replay; the first one recorded by default
+    repeatCount: int = Field(default=1, ge=1, le=100)
+    background: bool = False
+
+# Commands accepted in /batch besides "wait"
+BATCH_COMMANDS = {
+    "button": PressButtonReq,
+    "hat": PressHatReq,
+    "stick": StickReq,
+    "combo": ComboButtonReq,
+}
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter_ns()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_METRICS.observe(
+        request.method, route.path if route else "unmatched", response.status_code, time.perf_counter_ns() - start
+    )
+    return response
 
 @app.get("/ports")
-def ports():
-    return [{"device": d, "desc": desc} for d, desc in list_serial_ports()]
+def ports(refresh: bool = False):
+    """Serial ports, cached until a device node is added or removed; refresh=true enumerates again"""
+    return [{"device": d, "desc": desc} for d, desc in PORTS.list(refresh)]
 
 @app.post("/connect")
-def connect(req: ConnectReq):
+async def connect(req: ConnectReq):
     try:
-        SER.connect(req.port, req.baud)
-        return {"ok": True, "port": req.port}
+        return await CORE.connect(req.device, req.port, req.baud)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _http_error(e, 400)
 
 @app.post("/disconnect")
-def disconnect():
-    SER.disconnect()
-    return {"ok": True}
+async def disconnect(device: str = DEFAULT_DEVICE):
+    await CORE.disconnect(device)
+    return {"ok": True, "device": device}
 
 @app.get("/status")
-def status():
-    return {"connected": SER.connected, "port": SER.port}
+async def status(device: str = DEFAULT_DEVICE):
+    return await CORE.status(device)
+
+@app.get("/devices")
+async def list_devices():
+    """List connected devices"""
+    return {"devices": await CORE.list_devices()}
 
 @app.post("/init")
-def init():
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
+async def init(device: str = DEFAULT_DEVICE):
     try:
-        resp = SER.handshake()
+        resp = await CORE.handshake(device)
         return {"ok": True, "respHex": resp.hex()}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _http_error(e, 400)
 
 @app.post("/press/button")
-def press_button(req: PressButtonReq):
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
-    try:
-        try:
-            btn = SwitchButton[req.button.upper()]
-        except KeyError:
-            raise HTTPException(status_code=400, detail=f"Unknown button: {req.button}")
-        report = SwitchReport(button=btn.value)
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=req.durationMs/1000.0)
-        if req.durationMs > 0:
-            time.sleep(req.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-        return {"ok": True}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def press_button(req: PressButtonReq):
+    await _press(req)
+    return {"ok": True}
 
 @app.post("/press/hat")
-def press_hat(req: PressHatReq):
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
-    try:
-        try:
-            hat = SwitchHAT[req.direction.upper()]
-        except KeyError:
-            raise HTTPException(status_code=400, detail=f"Unknown direction: {req.direction}")
-        report = SwitchReport(HAT=hat.value)
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=req.durationMs/1000.0)
-        if req.durationMs > 0:
-            time.sleep(req.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-        return {"ok": True}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def press_hat(req: PressHatReq):
+    await _press(req)
+    return {"ok": True}
 
 @app.post("/stick")
-def stick(req: StickReq):
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
+async def stick(req: StickReq):
+    await _press(req)
+    return {"ok": True}
+
+@app.post("/state")
+async def set_state(req: StateReq):
+    """Set buttons, HAT and both sticks in one report; with hold it stays until the next report"""
+    await _press(req)
+    return {"ok": True}
+
+@app.post("/stick/trajectory")
+async def stick_trajectory(req: TrajectoryReq):
+    """Move a stick along a sampled path, then release to center"""
     try:
-        report = SwitchReport(
-            LX=req.lx, LY=req.ly, RX=req.rx, RY=req.ry
-        )
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=req.durationMs/1000.0)
-        if req.durationMs > 0:
-            time.sleep(req.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-        return {"ok": True}
+        timeline = tuple(trajectory_timeline(req))
+    except CompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return await CORE.run(req.device, timeline, info={"frames": len(timeline)}, priority="interactive")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/reset")
-def reset():
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
+async def reset(device: str = DEFAULT_DEVICE):
     try:
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-        return {"ok": True}
+        return await CORE.send_frame(device, RESET_REPORT.to_bytes())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/raw/send")
-def raw_send(req: RawSendReq):
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
+async def raw_send(req: RawSendReq):
     if not req.hex and not req.bytes:
         raise HTTPException(status_code=400, detail="hex or bytes is required")
     try:
@@ -193,198 +309,385 @@ def raw_send(req: RawSendReq):
             data = bytes.fromhex(req.hex)
         else:
             data = bytes([b & 0xFF for b in (req.bytes or [])])
-        resp = SER.send_and_recv(data, max_bytes=req.maxBytes, timeout=req.timeoutMs/1000.0)
+        resp = await CORE.raw_send(req.device, data, req.maxBytes, req.timeoutMs/1000.0)
         return {"ok": True, "respHex": resp.hex()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/press/combo")
-def press_combo(req: ComboButtonReq):
+async def press_combo(req: ComboButtonReq):
     """Press multiple buttons simultaneously"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
-    try:
-        button_mask = 0
-        for btn_name in req.buttons:
-            try:
-                btn = SwitchButton[btn_name.upper()]
-                button_mask |= btn.value
-            except KeyError:
-                raise HTTPException(status_code=400, detail=f"Unknown button: {btn_name}")
-        
-        report = SwitchReport(button=button_mask)
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=req.durationMs/1000.0)
-        if req.durationMs > 0:
-            time.sleep(req.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-        return {"ok": True, "buttons": req.buttons}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    await _press(req)
+    return {"ok": True, "buttons": req.buttons}
 
 @app.post("/sequence")
-def execute_sequence(req: SequenceReq):
+async def execute_sequence(req: SequenceReq):
     """Execute a sequence of actions"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
     try:
-        for _ in range(req.repeatCount):
-            for step in req.steps:
-                _execute_action_step(step)
-        return {"ok": True, "steps": len(req.steps), "repeats": req.repeatCount}
+        timeline = compile_program(req.steps)
+    except CompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    info = {"steps": len(req.steps), "repeats": req.repeatCount}
+    try:
+        return await CORE.run(
+            req.device, timeline, req.repeatCount, info, req.background, "sequence", len(req.steps), req.priority,
+            req.dryRun, req.profile,
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/macro/save")
-def save_macro(req: MacroReq):
+async def save_macro(req: MacroReq):
     """Save a macro for later execution"""
-    MACROS[req.name] = [step.dict() for step in req.steps]
-    return {"ok": True, "name": req.name, "steps": len(req.steps)}
+    try:
+        timeline = compile_program(req.steps)
+    except CompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await CORE.save_macro(req.name, [step.dict() for step in req.steps], timeline)
 
 @app.get("/macro/list")
-def list_macros():
-    """List all saved macros"""
-    return {"macros": [{"name": name, "steps": len(steps)} for name, steps in MACROS.items()]}
+async def list_macros(prefix: str = "", offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """List saved macros by name, one page at a time, optionally only names starting with prefix"""
+    return await CORE.list_macros(prefix, offset, limit)
 
 @app.get("/macro/{name}")
-def get_macro(name: str):
-    """Get macro details"""
-    if name not in MACROS:
-        raise HTTPException(status_code=404, detail=f"Macro not found: {name}")
-    return {"name": name, "steps": MACROS[name]}
+async def get_macro(name: str, version: Optional[int] = None):
+    """Get macro details, of the current or a given version"""
+    try:
+        return await CORE.get_macro(name, version)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.get("/macro/{name}/versions")
+async def macro_versions(name: str):
+    """List the saved versions of a macro"""
+    try:
+        return await CORE.macro_versions(name)
+    except Exception as e:
+        raise _http_error(e)
 
 @app.delete("/macro/{name}")
-def delete_macro(name: str):
+async def delete_macro(name: str):
     """Delete a saved macro"""
-    if name not in MACROS:
-        raise HTTPException(status_code=404, detail=f"Macro not found: {name}")
-    del MACROS[name]
-    return {"ok": True, "name": name}
+    try:
+        return await CORE.delete_macro(name)
+    except Exception as e:
+        raise _http_error(e)
 
 @app.post("/macro/execute")
-def execute_macro(req: ExecuteMacroReq):
+async def execute_macro(req: ExecuteMacroReq):
     """Execute a saved macro"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
-    if req.name not in MACROS:
-        raise HTTPException(status_code=404, detail=f"Macro not found: {req.name}")
     try:
-        for _ in range(req.repeatCount):
-            for step_dict in MACROS[req.name]:
-                step = ActionStep(**step_dict)
-                _execute_action_step(step)
-        return {"ok": True, "name": req.name, "repeats": req.repeatCount}
+        return await CORE.run_macro(
+            req.device, req.name, req.repeatCount, req.background, req.priority, req.dryRun, req.profile
+        )
+    except Exception as e:
+        raise _http_error(e)
+
+@app.post("/macro/fanout")
+async def fanout_macro(req: FanoutReq):
+    """Execute a saved macro on several devices with aligned start times"""
+    try:
+        return await CORE.fanout(req.name, req.devices, req.repeatCount, req.startDelayMs)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.post("/script/flash")
+async def flash_script(req: ScriptFlashReq):
+    """Compile a saved macro into a firmware script and upload it to the device"""
+    try:
+        size = await CORE.flash_macro(req.device, req.name, req.repeatCount)
+        return {"ok": True, "name": req.name, "repeats": req.repeatCount, "bytes": size}
+    except Exception as e:
+        raise _http_error(e)
+
+@app.post("/script/start")
+async def start_script(device: str = DEFAULT_DEVICE):
+    """Run the flashed script on the device"""
+    try:
+        resp = await CORE.script_start(device)
+        return {"ok": True, "respHex": resp.hex()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+@app.post("/script/stop")
+async def stop_script(device: str = DEFAULT_DEVICE):
+    """Stop the script running on the device"""
+    try:
+        resp = await CORE.script_stop(device)
+        return {"ok": True, "respHex": resp.hex()}
+    except Exception as e:
+        raise _http_error(e)
 
 @app.post("/led")
-def control_led(req: LEDReq):
+async def control_led(req: LEDReq):
     """Control device LED"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
     try:
         cmd = bytes([Command.Ready, Command.Ready, Command.LED, 1 if req.state else 0])
-        resp = SER.send_and_recv(cmd, max_bytes=8, timeout=0.5)
+        resp = await CORE.transact(req.device, cmd)
         return {"ok": True, "state": req.state, "respHex": resp.hex()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.get("/version")
-def get_version():
+async def get_version(device: str = DEFAULT_DEVICE):
     """Get firmware version"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
     try:
         cmd = bytes([Command.Ready, Command.Ready, Command.Version])
-        resp = SER.send_and_recv(cmd, max_bytes=32, timeout=0.5)
+        resp = await CORE.transact(device, cmd)
         return {"ok": True, "respHex": resp.hex(), "version": resp.decode('utf-8', errors='ignore').strip()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/controller/mode")
-def change_controller_mode(req: ControllerModeReq):
+async def change_controller_mode(req: ControllerModeReq):
     """Change controller mode (Pro/JoyConL/JoyConR)"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
     try:
         cmd = bytes([Command.Ready, Command.Ready, Command.ChangeControllerMode, req.mode])
-        resp = SER.send_and_recv(cmd, max_bytes=8, timeout=0.5)
+        resp = await CORE.transact(req.device, cmd)
         return {"ok": True, "mode": req.mode, "respHex": resp.hex()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/controller/color")
-def change_controller_color(req: ControllerColorReq):
+async def change_controller_color(req: ControllerColorReq):
     """Change controller color"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
     try:
         cmd = bytes([
             Command.Ready, Command.Ready, Command.ChangeControllerColor,
             req.body_r, req.body_g, req.body_b,
             req.button_r, req.button_g, req.button_b
         ])
-        resp = SER.send_and_recv(cmd, max_bytes=8, timeout=0.5)
+        resp = await CORE.transact(req.device, cmd)
         return {"ok": True, "respHex": resp.hex()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/unpair")
-def unpair_controller():
+async def unpair_controller(device: str = DEFAULT_DEVICE):
     """Unpair controller from console"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
     try:
         cmd = bytes([Command.Ready, Command.Ready, Command.UnPair])
-        resp = SER.send_and_recv(cmd, max_bytes=8, timeout=0.5)
+        resp = await CORE.transact(device, cmd)
         return {"ok": True, "respHex": resp.hex()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/batch")
-def batch_execute(req: BatchRequest):
-    """Execute multiple commands in batch"""
-    if not SER.connected:
-        raise HTTPException(status_code=400, detail="Serial not connected")
-    
-    results = []
+async def batch_execute(req: BatchRequest):
+    """Execute multiple commands in batch
+
+    The whole batch is compiled first and rejected with per-command errors if
+    any command is invalid; otherwise it plays as a single timeline.
+    """
+    timeline: List[TimelineEntry] = []
+    errors = []
+    held = RESET_FRAME
     for i, cmd in enumerate(req.commands):
         try:
-            cmd_type = cmd.get("type")
-            if cmd_type == "button":
-                btn_req = PressButtonReq(**cmd)
-                press_button(btn_req)
-            elif cmd_type == "hat":
-                hat_req = PressHatReq(**cmd)
-                press_hat(hat_req)
-            elif cmd_type == "stick":
-                stick_req = StickReq(**cmd)
-                stick(stick_req)
-            elif cmd_type == "combo":
-                combo_req = ComboButtonReq(**cmd)
-                press_combo(combo_req)
-            elif cmd_type == "wait":
-                wait_ms = cmd.get("durationMs", 100)
-                time.sleep(wait_ms / 1000.0)
-            else:
-                results.append({"index": i, "ok": False, "error": f"Unknown command type: {cmd_type}"})
-                continue
-            results.append({"index": i, "ok": True})
+            entries = _batch_entries(i, cmd, held)
         except Exception as e:
-            results.append({"index": i, "ok": False, "error": str(e)})
-    
-    return {"ok": True, "results": results}
+            errors.append({"index": i, "error": str(e)})
+            continue
+        held = held_after(entries, held)
+        timeline.extend(entries)
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
+    if held != RESET_FRAME:
+        # 批量结束时释放 state 命令仍按住的输入
+        timeline.append(TimelineEntry(len(req.commands) - 1, RESET_FRAME, 0))
+    try:
+        return await CORE.run_batch(
+            req.device, tuple(timeline), len(req.commands), req.background, req.priority, req.dryRun, req.profile
+        )
+    except Exception as e:
+        raise _http_error(e)
+
+@app.get("/jobs")
+async def list_jobs():
+    """List queued, running and recently finished jobs"""
+    return {"jobs": await CORE.list_jobs()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get job state and progress"""
+    try:
+        return await CORE.get_job(job_id)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a job; a running job is stopped and the controller reset immediately"""
+    try:
+        return await CORE.cancel_job(job_id)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Get the final result of a finished job"""
+    try:
+        return await CORE.job_result(job_id)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.websocket("/ws/input")
+async def input_stream(ws: WebSocket, rateHz: int = DEFAULT_RATE_HZ, device: str = DEFAULT_DEVICE):
+    """Stream full controller states; the latest one is sampled at rateHz and only changes are sent"""
+    await ws.accept()
+    if not (await CORE.status(device))["connected"]:
+        await ws.close(code=1011, reason="Serial not connected")
+        return
+
+    async def send(frame: bytes):
+        await CORE.send_frame(device, frame)
+
+    streamer = LatestStateStreamer(send, max(1, min(rateHz, 1000)))
+    ticker = asyncio.create_task(streamer.run())
+    try:
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            try:
+                msg = json.loads(message.get("text") or message.get("bytes") or "")
+                if not isinstance(msg, dict):
+                    raise ValueError("message must be a JSON object")
+            except ValueError as e:
+                await ws.send_json({"ok": False, "error": str(e)})
+                continue
+            if msg.get("type") == "stats":
+                await ws.send_json({"ok": True, **streamer.stats()})
+                continue
+            try:
+                state = ControllerState(**msg)
+                report = state_report(state.buttons, state.hat, state.lx, state.ly, state.rx, state.ry)
+            except ValueError as e:
+                await ws.send_json({"ok": False, "error": str(e)})
+                continue
+            streamer.update(report.to_bytes())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        ticker.cancel()
+        await asyncio.wait([ticker])
+        if (await CORE.status(device))["connected"]:
+            await streamer.close()
+
+@app.get("/timing/config")
+async def get_timing_config():
+    """Get the timeline executor timing mode"""
+    return await CORE.timing_config()
+
+@app.post("/timing/config")
+async def set_timing_config(req: TimingConfigReq):
+    """Switch precision (sleep + spin) timing, CPU pinning, frame pipelining and frame diffing"""
+    try:
+        config = await CORE.configure(req.dict())
+    except Exception as e:
+        raise _http_error(e, 400)
+    return {"ok": True, **config}
+
+@app.get("/timing/output")
+async def get_output_counters(device: str = DEFAULT_DEVICE):
+    """Frames sent vs suppressed by the report-diffing output stage"""
+    try:
+        return await CORE.output(device)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.get("/timing/jitter")
+async def get_jitter(device: str = DEFAULT_DEVICE):
+    """Histogram of frame lateness against scheduled deadlines"""
+    try:
+        return await CORE.jitter(device)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.get("/timing/queue")
+async def get_queue_stats(device: str = DEFAULT_DEVICE):
+    """Runs waiting for the device by priority, queue-wait per priority and preemption count"""
+    try:
+        return await CORE.queue_stats(device)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.delete("/timing/jitter")
+async def reset_jitter(device: str = DEFAULT_DEVICE):
+    """Clear the jitter histogram"""
+    try:
+        await CORE.reset_jitter(device)
+    except Exception as e:
+        raise _http_error(e)
+    return {"ok": True}
+
+@app.post("/trace/start")
+async def start_trace(req: TraceStartReq):
+    """Record every report frame sent to any device into a binary trace file"""
+    try:
+        return await CORE.trace_start(req.name)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.post("/trace/stop")
+async def stop_trace():
+    """Stop recording and flush the trace file"""
+    try:
+        return await CORE.trace_stop()
+    except Exception as e:
+        raise _http_error(e)
+
+@app.get("/trace/list")
+async def list_traces():
+    """List recorded traces and the recording in progress"""
+    return await CORE.list_traces()
+
+@app.get("/trace/{name}")
+async def get_trace(name: str):
+    """Per-device frame counts and durations of a trace"""
+    try:
+        return await CORE.trace_info(name)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.post("/trace/replay")
+async def replay_trace(req: TraceReplayReq):
+    """Replay one recorded device's frames at their recorded times"""
+    try:
+        return await CORE.replay_trace(req.device, req.name, req.source, req.repeatCount, req.background)
+    except Exception as e:
+        raise _http_error(e)
+
+@app.post("/mcp")
+async def mcp_endpoint(request: Request):
+    """MCP streamable HTTP transport: one JSON-RPC message or batch per POST, answered as JSON"""
+    response = await MCP.handle_text(await request.body())
+    if response is None:
+        return Response(status_code=202)
+    return Response(response, media_type="application/json")
 
 @app.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint"""
+    status = await CORE.status(DEFAULT_DEVICE)
+    summary = await CORE.summary()
     return {
         "status": "healthy",
-        "connected": SER.connected,
-        "port": SER.port,
-        "macros_count": len(MACROS),
+        "connected": status["connected"],
+        "port": status["port"],
+        "devices_count": summary["devices"],
+        "macros_count": summary["macros"],
         "version": "2.0.0"
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: serial link and timing per device, HTTP latency per endpoint"""
+    return PlainTextResponse(
+        await CORE.metrics() + HTTP_METRICS.render(), media_type="text/plain; version=0.0.4"
+    )
+
 @app.get("/buttons")
 def list_buttons():
     """List all available buttons"""
@@ -395,54 +698,58 @@ def list_directions():
     """List all available HAT directions"""
     return {"directions": [hat.name for hat in SwitchHAT]}
 
-def _execute_action_step(step: ActionStep):
-    """Internal helper to execute a single action step"""
-    if step.type == "button":
-        if not step.button:
-            raise ValueError("button field required for type=button")
-        btn = SwitchButton[step.button.upper()]
-        report = SwitchReport(button=btn.value)
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=step.durationMs/1000.0)
-        if step.durationMs > 0:
-            time.sleep(step.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-    
-    elif step.type == "combo":
-        if not step.buttons:
-            raise ValueError("buttons field required for type=combo")
-        button_mask = 0
-        for btn_name in step.buttons:
-            btn = SwitchButton[btn_name.upper()]
-            button_mask |= btn.value
-        report = SwitchReport(button=button_mask)
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=step.durationMs/1000.0)
-        if step.durationMs > 0:
-            time.sleep(step.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-    
-    elif step.type == "hat":
-        if not step.direction:
-            raise ValueError("direction field required for type=hat")
-        hat = SwitchHAT[step.direction.upper()]
-        report = SwitchReport(HAT=hat.value)
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=step.durationMs/1000.0)
-        if step.durationMs > 0:
-            time.sleep(step.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-    
-    elif step.type == "stick":
-        lx = step.lx if step.lx is not None else SwitchStick.STICK_CENTER
-        ly = step.ly if step.ly is not None else SwitchStick.STICK_CENTER
-        rx = step.rx if step.rx is not None else SwitchStick.STICK_CENTER
-        ry = step.ry if step.ry is not None else SwitchStick.STICK_CENTER
-        report = SwitchReport(LX=lx, LY=ly, RX=rx, RY=ry)
-        SER.send_and_recv(report.to_bytes(), max_bytes=8, timeout=step.durationMs/1000.0)
-        if step.durationMs > 0:
-            time.sleep(step.durationMs / 1000.0)
-        SER.send_and_recv(RESET_REPORT.to_bytes(), max_bytes=8, timeout=0.5)
-    
-    elif step.type == "wait":
-        time.sleep(step.durationMs / 1000.0)
-    
-    else:
-        raise ValueError(f"Unknown action type: {step.type}")
\ No newline at end of file
+def _http_error(e: Exception, status: int = 500) -> HTTPException:
+    """Broker errors keep their own status; anything else maps to ``status``."""
+    return HTTPException(status_code=getattr(e, "status", status), detail=str(e))
+
+async def _press(req: Any):
+    """Internal helper to press a report for req.durationMs and release"""
+    try:
+        timeline = tuple(_press_entries(req))
+    except CompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        await CORE.run(req.device, timeline, priority="interactive")
+    except Exception as e:
+        raise _http_error(e)
+
+def _press_entries(req: Any, held: bytes = RESET_FRAME) -> List[TimelineEntry]:
+    """Press ``req``'s report on top of the inputs ``held``, then release back to them"""
+    if isinstance(req, StateReq):
+        # 完整的控制器状态，替换按住的输入；hold 时不释放，直到下一帧报告
+        if req.hold:
+            return [TimelineEntry(0, req.report().to_bytes(), req.durationMs)]
+        return press_timeline(req.report(), req.durationMs, 0, held)
+    return press_timeline(overlay(req.report(), held, isinstance(req, StickReq)), req.durationMs, 0, held)
+
+def _batch_entries(index: int, cmd: Dict[str, Any], held: bytes = RESET_FRAME) -> List[TimelineEntry]:
+    """Compile one batch command into timeline entries tagged with its index, on top of the inputs ``held``"""
+    cmd_type = cmd.get("type")
+    if cmd_type == "wait":
+        return [TimelineEntry(index, None, max(0, int(cmd.get("durationMs", 100))))]
+    if cmd_type == "trajectory":
+        return trajectory_timeline(TrajectoryReq(**cmd), index, held)
+    if cmd_type in ("state", "release"):
+        return compile_step(ActionStep(**cmd), index, held)
+    if cmd_type not in BATCH_COMMANDS:
+        raise ValueError(f"Unknown command type: {cmd_type}")
+    req = BATCH_COMMANDS[cmd_type](**cmd)
+    return press_timeline(overlay(req.report(), held, cmd_type == "stick"), req.durationMs, index, held)
+
+# MCP tools: the REST handlers and request models above, on the same broker.
+# Frame tools are compiled by the MCP server and batched into one timeline.
+MCP = McpServer("easycon-mcp-service", app.version, CORE)
+MCP.tool("connect", ConnectReq, "Open the serial port of an EasyCon adapter as a device", connect)
+MCP.tool("init", DeviceTarget, "Handshake with the adapter", lambda req: init(req.device))
+MCP.tool("status", DeviceTarget, "Connection status of a device", lambda req: status(req.device))
+MCP.frame_tool("press_button", PressButtonReq, "Press a button for durationMs, then release", _press_entries)
+MCP.frame_tool("press_combo", ComboButtonReq, "Press several buttons together for durationMs, then release", _press_entries)
+MCP.frame_tool("press_hat", PressHatReq, "Press a D-pad direction for durationMs, then release", _press_entries)
+MCP.frame_tool("stick", StickReq, "Hold both sticks at the given positions for durationMs, then center", _press_entries)
+MCP.frame_tool("set_state", StateReq, "Set buttons, HAT and both sticks in one report for durationMs; hold keeps it until the next report", _press_entries)
+MCP.frame_tool("stick_trajectory", TrajectoryReq, "Move a stick along a ramp, arc, circle or spline", lambda req, held: trajectory_timeline(req, 0, held))
+MCP.frame_tool("wait", WaitReq, "Hold the current state for durationMs", lambda req, held: [TimelineEntry(0, None, req.durationMs)])
+MCP.frame_tool("reset", DeviceTarget, "Release every input", lambda req, held: [TimelineEntry(0, RESET_FRAME, 0)])
+MCP.tool("sequence", SequenceReq, "Play a sequence of steps, including loops, sections and macro calls", execute_sequence)
+MCP.tool("macro_save", MacroReq, "Save a macro; each save adds a version", save_macro)
+MCP.tool("macro_execute", ExecuteMacroReq, "Play a saved macro", execute_macro)
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+from mcp_service.arbiter import LinkArbiter
+from mcp_service.async_serial import AsyncEasyConSerial
+from mcp_service.metrics import Histogram
+
+NS_PER_MS = 1_000_000
+
+KEEPALIVE_MS = int(os.environ.get("EASYCON_KEEPALIVE_MS", "2000"))  # idle time before a Hello is sent; 0 = off
+KEEPALIVE_TIMEOUT = 0.2
+KEEPALIVE_MISSES = 3               # unanswered keepalives in a row before the link counts as lost
+RECONNECT_BACKOFF = (0.05, 5.0)    # first and longest wait between reconnect attempts (s)
+
+# 恢复时间直方图桶上界（秒）
+RECOVERY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+class LinkSupervisor:
+    """Keeps one device's link up without clients calling /connect and /init again.
+
+    A port error closes the link (``AsyncEasyConSerial.lose``) and wakes the
+    supervisor, which reopens the same port and re-handshakes, backing off
+    exponentially until it works; requests meanwhile fail fast. While the
+    link is idle it sends a Hello every ``keepalive_ms`` so the USB link
+    stays awake, and a run of unanswered keepalives counts as a lost link.
+    No keepalive is sent while a run holds the device's ``arbiter``; idle
+    time counts from the last frame written.
+    Recovery time is measured from the error to the completed handshake.
+    """
+
+    def __init__(self, link: AsyncEasyConSerial, arbiter: Optional[LinkArbiter] = None, keepalive_ms: int = KEEPALIVE_MS):
+        self.link = link
+        self.arbiter = arbiter
+        self.keepalive_ms = keepalive_ms
+        self.state = "stopped"  # "connected", "reconnecting" or "stopped"
+        self.recovery = Histogram(RECOVERY_BUCKETS)
+        self.reconnects = 0
+        self.attempts = 0
+        self.keepalives = 0
+        self.misses = 0
+        self.last_recovery_ns: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Supervise the (connected) link from now on; must be called on the event loop."""
+        self.stop()
+        self._wake = asyncio.Event()
+        self.link.on_lost = self._on_lost
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.link.on_lost = None
+        self.state = "stopped"
+
+    def _on_lost(self, error: BaseException):
+        self.last_error = str(error)
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if not self.link.connected:
+                await self._recover()
+            self.state = "connected"
+            if self.keepalive_ms <= 0:
+                await self._wake.wait()
+                continue
+            # 距上次写入满 keepalive_ms 才发送，正常收发期间不会有额外请求
+            idle_ns = time.perf_counter_ns() - self.link.metrics.last_write_ns
+            remaining = self.keepalive_ms * NS_PER_MS - idle_ns
+            if remaining <= 0 and self._in_use():
+                # 运行占用设备时（包括帧间的长按等待）不打扰，一个周期后按其最后一帧重新计时
+                remaining = self.keepalive_ms * NS_PER_MS
+            if remaining > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), remaining / 1e9)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._keepalive()
+
+    def _in_use(self) -> bool:
+        return self.link.busy or (self.arbiter is not None and self.arbiter.held)
+
+    async def _keepalive(self):
+        try:
+            alive = await self.link.ping(KEEPALIVE_TIMEOUT)
+        except RuntimeError:
+            return  # 链路已断开，lose() 已唤醒
+        self.keepalives += 1
+        if alive:
+            self.misses = 0
+        else:
+            self.misses += 1
+            if self.misses >= KEEPALIVE_MISSES:
+                self.misses = 0
+                self.link.lose(RuntimeError(f"No reply to {KEEPALIVE_MISSES} keepalives"))
+
+    async def _recover(self):
+        self.state = "reconnecting"
+        lost_at = self.link.lost_at or time.perf_counter_ns()
+        delay = RECONNECT_BACKOFF[0]
+        while True:
+            self.attempts += 1
+            try:
+                self.link.reopen()
+                await self.link.handshake()
+                break
+            except (OSError, RuntimeError) as e:
+                self.last_error = str(e)
+                if self.link.connected:
+                    self.link.lose(e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_BACKOFF[1])
+        recovery_ns = time.perf_counter_ns() - lost_at
+        self.recovery.observe(recovery_ns)
+        self.last_recovery_ns = recovery_ns
+        self.reconnects += 1
+        self.misses = 0
+        self.link.lost_at = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "reconnects": self.reconnects,
+            "attempts": self.attempts,
+            "lastRecoveryMs": None if self.last_recovery_ns is None else round(self.last_recovery_ns / NS_PER_MS, 3),
+            "lastError": self.last_error,
+            "keepalives": self.keepalives,
+            "keepaliveMs": self.keepalive_ms,
+        }
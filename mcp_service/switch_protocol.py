@@ -1,6 +1,13 @@
+import sys
+from array import array
 from enum import Enum
-from dataclasses import dataclass
-from typing import List
+from itertools import repeat
+from typing import Any, Dict, Iterable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 可选，没有时逐帧做整数运算
+    np = None
 
 class SwitchButton(Enum):
     Y = 0x01
@@ -36,48 +43,154 @@ class SwitchStick:
     STICK_CENMAX = 192
     STICK_MAX = 255
 
-@dataclass
+# 7 字节指令拼成 56 位整数后展开成 8 字节：每字节放一个 7bit 分片，最后一字节 OR 0x80 作为结束标志
+def _spread(n: int) -> int:
+    n = (n >> 28) << 32 | (n & 0x0FFFFFFF)
+    n = (n & 0x0FFFC0000FFFC000) << 2 | (n & 0x00003FFF00003FFF)
+    n = (n & 0x3F803F803F803F80) << 1 | (n & 0x007F007F007F007F)
+    return n | 0x80
+
+def _gather(n: int) -> int:
+    n &= 0x7F7F7F7F7F7F7F7F
+    n = (n & 0x7F007F007F007F00) >> 1 | (n & 0x007F007F007F007F)
+    n = (n & 0x3FFF00003FFF0000) >> 2 | (n & 0x00003FFF00003FFF)
+    return (n & 0x0FFFFFFF00000000) >> 4 | (n & 0x0FFFFFFF)
+
+def _command(button: int, hat: int, lx: int, ly: int, rx: int, ry: int) -> int:
+    return (button & 0xFFFF) << 40 | (hat & 0xFF) << 32 | (lx & 0xFF) << 24 | (ly & 0xFF) << 16 | (rx & 0xFF) << 8 | (ry & 0xFF)
+
+_CENTER = SwitchStick.STICK_CENTER
+
+def _pack(button: int, hat: int, lx: int, ly: int, rx: int, ry: int) -> bytes:
+    # 热路径：_command 与 _spread 内联展开
+    n = (button & 0xFFFF) << 40 | (hat & 0xFF) << 32 | (lx & 0xFF) << 24 | (ly & 0xFF) << 16 | (rx & 0xFF) << 8 | (ry & 0xFF)
+    n = (n >> 28) << 32 | (n & 0x0FFFFFFF)
+    n = (n & 0x0FFFC0000FFFC000) << 2 | (n & 0x00003FFF00003FFF)
+    n = (n & 0x3F803F803F803F80) << 1 | (n & 0x007F007F007F007F)
+    return (n | 0x80).to_bytes(8, "big")
+
+# 常用状态（全空、单个按键、单个方向，摇杆居中）的帧预先编码
+COMMON_FRAMES: Dict[Tuple[int, int], bytes] = {
+    (0, SwitchHAT.CENTER.value): _pack(0, SwitchHAT.CENTER.value, _CENTER, _CENTER, _CENTER, _CENTER),
+    **{(b.value, SwitchHAT.CENTER.value): _pack(b.value, SwitchHAT.CENTER.value, _CENTER, _CENTER, _CENTER, _CENTER) for b in SwitchButton},
+    **{(0, h.value): _pack(0, h.value, _CENTER, _CENTER, _CENTER, _CENTER) for h in SwitchHAT},
+}
+
+def encode_report(
+    button: int = 0,
+    hat: int = SwitchHAT.CENTER.value,
+    lx: int = _CENTER,
+    ly: int = _CENTER,
+    rx: int = _CENTER,
+    ry: int = _CENTER,
+) -> bytes:
+    """Encode one report; common states come from COMMON_FRAMES without packing."""
+    if lx == ly == rx == ry == _CENTER:
+        frame = COMMON_FRAMES.get((button, hat))
+        if frame is not None:
+            return frame
+    return _pack(button, hat, lx, ly, rx, ry)
+
 class SwitchReport:
-    button: int = 0
-    HAT: int = SwitchHAT.CENTER.value
-    LX: int = SwitchStick.STICK_CENTER
-    LY: int = SwitchStick.STICK_CENTER
-    RX: int = SwitchStick.STICK_CENTER
-    RY: int = SwitchStick.STICK_CENTER
+    """Controller state for one report frame (slotted, no per-instance dict)."""
+
+    __slots__ = ("button", "HAT", "LX", "LY", "RX", "RY")
+
+    def __init__(
+        self,
+        button: int = 0,
+        HAT: int = SwitchHAT.CENTER.value,
+        LX: int = _CENTER,
+        LY: int = _CENTER,
+        RX: int = _CENTER,
+        RY: int = _CENTER,
+    ):
+        self.button = button
+        self.HAT = HAT
+        self.LX = LX
+        self.LY = LY
+        self.RX = RX
+        self.RY = RY
+
+    def __repr__(self) -> str:
+        return (
+            f"SwitchReport(button={self.button!r}, HAT={self.HAT!r}, "
+            f"LX={self.LX!r}, LY={self.LY!r}, RX={self.RX!r}, RY={self.RY!r})"
+        )
+
+    def __eq__(self, other: Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    __hash__ = None  # mutable, like the dataclass it replaces
+
+    def astuple(self) -> Tuple[int, int, int, int, int, int]:
+        return (self.button, self.HAT, self.LX, self.LY, self.RX, self.RY)
 
     def reset(self):
         self.button = 0
         self.HAT = SwitchHAT.CENTER.value
-        self.LX = SwitchStick.STICK_CENTER
-        self.LY = SwitchStick.STICK_CENTER
-        self.RX = SwitchStick.STICK_CENTER
-        self.RY = SwitchStick.STICK_CENTER
+        self.LX = _CENTER
+        self.LY = _CENTER
+        self.RX = _CENTER
+        self.RY = _CENTER
 
     def to_bytes(self) -> bytes:
-        # 7 字节指令 -> 7bit 分片 -> 8 字节包（最后一字节 OR 0x80 作为结束标志）
-        command = [
-            (self.button >> 8) & 0xFF,
-            self.button & 0xFF,
-            self.HAT & 0xFF,
-            self.LX & 0xFF,
-            self.LY & 0xFF,
-            self.RX & 0xFF,
-            self.RY & 0xFF,
-        ]
-        packet: List[int] = []
-        n = 0
-        bits = 0
-        for b in command:
-            n = (n << 8) | (b & 0xFF)
-            bits += 8
-            while bits >= 7:
-                bits -= 7
-                packet.append((n >> bits) & 0x7F)
-                n &= (1 << bits) - 1
-        while len(packet) < 8:
-            packet.append(0)
-        packet = packet[:8]
-        packet[7] |= 0x80
-        return bytes(packet)
-
-RESET_REPORT = SwitchReport()
\ No newline at end of file
+        return encode_report(self.button, self.HAT, self.LX, self.LY, self.RX, self.RY)
+
+    @classmethod
+    def from_bytes(cls, packet: bytes) -> "SwitchReport":
+        # to_bytes 的逆过程：8 个 7bit 分片（56 bit）-> 7 字节指令
+        n = _gather(int.from_bytes(packet[:8], "big"))
+        return cls(n >> 40 & 0xFFFF, n >> 32 & 0xFF, n >> 24 & 0xFF, n >> 16 & 0xFF, n >> 8 & 0xFF, n & 0xFF)
+
+RESET_REPORT = SwitchReport()
+
+def encode_block(
+    button: Any = 0,
+    hat: Any = SwitchHAT.CENTER.value,
+    lx: Any = _CENTER,
+    ly: Any = _CENTER,
+    rx: Any = _CENTER,
+    ry: Any = _CENTER,
+) -> bytes:
+    """Encode many reports into one contiguous buffer of 8-byte frames.
+
+    Each field is an int shared by every frame or a sequence of per-frame
+    values (all sequences the same length). With NumPy installed the whole
+    block is packed in a few array operations.
+    """
+    fields = (button, hat, lx, ly, rx, ry)
+    count = max((len(f) for f in fields if not isinstance(f, int)), default=1)
+    if np is not None:
+        return _encode_block_np(fields, count)
+    columns = [repeat(f, count) if isinstance(f, int) else f for f in fields]
+    words = array("Q", [_spread(_command(b, h, a, c, d, e)) for b, h, a, c, d, e in zip(*columns)])
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tobytes()
+
+def _encode_block_np(fields, count: int) -> bytes:
+    # _command/_spread 只用位运算，直接作用于 uint64 数组
+    columns = [np.broadcast_to(np.asarray(f, dtype=np.int64), (count,)).astype(np.uint64) for f in fields]
+    return _spread(_command(*columns)).astype(">u8").tobytes()
+
+def encode_reports(
+    button: Any = 0,
+    hat: Any = SwitchHAT.CENTER.value,
+    lx: Any = _CENTER,
+    ly: Any = _CENTER,
+    rx: Any = _CENTER,
+    ry: Any = _CENTER,
+) -> List[bytes]:
+    """encode_block() split into one bytes object per frame, for timelines."""
+    data = encode_block(button, hat, lx, ly, rx, ry)
+    return [data[i:i + 8] for i in range(0, len(data), 8)]
+
+def pack_reports(reports: Iterable[SwitchReport]) -> bytes:
+    """Frames for a run of SwitchReports as one contiguous buffer, e.g. for a single serial write."""
+    states = [r.astuple() for r in reports]
+    if not states:
+        return b""
+    return encode_block(*(list(column) for column in zip(*states)))
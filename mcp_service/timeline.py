@@ -0,0 +1,234 @@
+import struct
+from typing import Any, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from mcp_service.switch_protocol import (
+    SwitchReport,
+    RESET_REPORT,
+    SwitchButton,
+    SwitchHAT,
+    SwitchStick,
+    encode_reports,
+)
+from mcp_service.trajectory import DEFAULT_RATE_HZ, STICKS, frame_holds, sample_path
+
+RESET_FRAME = RESET_REPORT.to_bytes()
+
+class TimelineEntry(NamedTuple):
+    step: int                # index of the source step
+    frame: Optional[bytes]   # pre-encoded 8-byte report, None for a pure wait
+    holdMs: int              # time to hold this state before the next entry
+
+Timeline = Tuple[TimelineEntry, ...]
+
+class CompileError(ValueError):
+    def __init__(self, step: Optional[int], message: str):
+        super().__init__(message if step is None else f"step {step}: {message}")
+        self.step = step
+
+def _button(name: str, step: Optional[int]) -> int:
+    try:
+        return SwitchButton[name.upper()].value
+    except KeyError:
+        raise CompileError(step, f"Unknown button: {name}")
+
+def _hat(name: str, step: Optional[int]) -> int:
+    try:
+        return SwitchHAT[name.upper()].value
+    except KeyError:
+        raise CompileError(step, f"Unknown direction: {name}")
+
+def _axis(value: Optional[int], field: str, step: Optional[int]) -> int:
+    if value is None:
+        return SwitchStick.STICK_CENTER
+    if not SwitchStick.STICK_MIN <= value <= SwitchStick.STICK_MAX:
+        raise CompileError(step, f"{field} out of range: {value}")
+    return value
+
+def state_report(
+    buttons: Optional[List[str]] = None,
+    hat: Optional[str] = None,
+    lx: Optional[int] = None,
+    ly: Optional[int] = None,
+    rx: Optional[int] = None,
+    ry: Optional[int] = None,
+    step: Optional[int] = None,
+) -> SwitchReport:
+    """Full controller state in one report; omitted fields are neutral."""
+    mask = 0
+    for name in buttons or []:
+        mask |= _button(name, step)
+    return SwitchReport(
+        button=mask,
+        HAT=_hat(hat, step) if hat else SwitchHAT.CENTER.value,
+        LX=_axis(lx, "lx", step),
+        LY=_axis(ly, "ly", step),
+        RX=_axis(rx, "rx", step),
+        RY=_axis(ry, "ry", step),
+    )
+
+def overlay(report: SwitchReport, held: bytes, sticks: bool = False) -> SwitchReport:
+    """``report`` pressed on top of the held state: its buttons are added, a centered
+    HAT keeps the held direction and, unless ``sticks``, the held axes are kept."""
+    if held == RESET_FRAME:
+        return report
+    base = SwitchReport.from_bytes(held)
+    base.button |= report.button
+    if report.HAT != SwitchHAT.CENTER.value:
+        base.HAT = report.HAT
+    if sticks:
+        base.LX, base.LY, base.RX, base.RY = report.LX, report.LY, report.RX, report.RY
+    return base
+
+def held_after(entries: Sequence[TimelineEntry], held: bytes = RESET_FRAME) -> bytes:
+    """State held once ``entries`` have played: their last frame, or ``held`` if they send none."""
+    for entry in reversed(entries):
+        if entry.frame is not None:
+            return entry.frame
+    return held
+
+def press_timeline(report: SwitchReport, duration_ms: int, step: int = 0, held: bytes = RESET_FRAME) -> List[TimelineEntry]:
+    """Hold ``report`` for ``duration_ms`` then release to ``held`` (neutral unless a state step holds inputs)."""
+    return [
+        TimelineEntry(step, report.to_bytes(), duration_ms),
+        TimelineEntry(step, held, 0),
+    ]
+
+def trajectory_timeline(spec: Any, step: int = 0, held: bytes = RESET_FRAME) -> List[TimelineEntry]:
+    """Sample a stick trajectory (a trajectory ActionStep or request) into frames, then release.
+
+    Consecutive samples that encode the same report are merged into one
+    longer hold. Held buttons, HAT and the other stick stay as they are.
+    """
+    stick = spec.stick or "left"
+    if stick not in STICKS:
+        raise CompileError(step, f"Unknown stick: {stick}")
+    try:
+        holds = frame_holds(spec.durationMs, spec.rateHz or DEFAULT_RATE_HZ)
+        xs, ys = sample_path(
+            spec.shape, len(holds), spec.points, spec.center, spec.radius,
+            spec.startDeg or 0.0, spec.endDeg, 1.0 if spec.turns is None else spec.turns,
+            spec.easing or "linear",
+        )
+    except ValueError as e:
+        raise CompileError(step, str(e))
+    base = SwitchReport.from_bytes(held)
+    if stick == "left":
+        frames = encode_reports(base.button, base.HAT, xs, ys, base.RX, base.RY)
+    else:
+        frames = encode_reports(base.button, base.HAT, base.LX, base.LY, xs, ys)
+    entries: List[TimelineEntry] = []
+    for frame, hold in zip(frames, holds):
+        if entries and entries[-1].frame == frame:
+            entries[-1] = entries[-1]._replace(holdMs=entries[-1].holdMs + hold)
+        else:
+            entries.append(TimelineEntry(step, frame, hold))
+    entries.append(TimelineEntry(step, held, 0))
+    return entries
+
+def _state(step: Any, index: int, held: bytes) -> SwitchReport:
+    """The held state with a state step's buttons added and its given HAT and axes set."""
+    if not (step.buttons or step.direction or any(v is not None for v in (step.lx, step.ly, step.rx, step.ry))):
+        raise CompileError(index, "state step sets no input")
+    report = SwitchReport.from_bytes(held)
+    for name in step.buttons or []:
+        report.button |= _button(name, index)
+    if step.direction:
+        report.HAT = _hat(step.direction, index)
+    for field in ("lx", "ly", "rx", "ry"):
+        value = getattr(step, field)
+        if value is not None:
+            setattr(report, field.upper(), _axis(value, field, index))
+    return report
+
+def _release(step: Any, index: int, held: bytes) -> SwitchReport:
+    """The held state without the step's buttons, or neutral when it names none."""
+    if not step.buttons:
+        return SwitchReport()
+    report = SwitchReport.from_bytes(held)
+    for name in step.buttons:
+        report.button &= ~_button(name, index)
+    return report
+
+def compile_step(step: Any, index: int = 0, held: bytes = RESET_FRAME) -> List[TimelineEntry]:
+    """Compile one ActionStep into timeline entries (press + release, a sampled trajectory, or a wait).
+
+    ``held`` is the frame of the inputs held by earlier state steps: presses
+    are made on top of it and release back to it, and the last frame of the
+    entries is always the state held after the step.
+    """
+    if step.type == "state":
+        report = _state(step, index, held)
+        if step.hold:
+            return [TimelineEntry(index, report.to_bytes(), step.durationMs)]
+        return press_timeline(report, step.durationMs, index, held)
+    if step.type == "release":
+        return [TimelineEntry(index, _release(step, index, held).to_bytes(), step.durationMs)]
+    sticks = False
+    if step.type == "button":
+        if not step.button:
+            raise CompileError(index, "button field required for type=button")
+        report = SwitchReport(button=_button(step.button, index))
+    elif step.type == "combo":
+        if not step.buttons:
+            raise CompileError(index, "buttons field required for type=combo")
+        mask = 0
+        for name in step.buttons:
+            mask |= _button(name, index)
+        report = SwitchReport(button=mask)
+    elif step.type == "hat":
+        if not step.direction:
+            raise CompileError(index, "direction field required for type=hat")
+        report = SwitchReport(HAT=_hat(step.direction, index))
+    elif step.type == "stick":
+        sticks = True
+        report = SwitchReport(
+            LX=_axis(step.lx, "lx", index),
+            LY=_axis(step.ly, "ly", index),
+            RX=_axis(step.rx, "rx", index),
+            RY=_axis(step.ry, "ry", index),
+        )
+    elif step.type == "trajectory":
+        return trajectory_timeline(step, index, held)
+    elif step.type == "wait":
+        return [TimelineEntry(index, None, step.durationMs)]
+    else:
+        raise CompileError(index, f"Unknown action type: {step.type}")
+    return press_timeline(overlay(report, held, sticks), step.durationMs, index, held)
+
+def compile_steps(steps: Iterable[Any]) -> Timeline:
+    """Compile a list of ActionSteps into an immutable frame timeline; inputs still held at the end are released."""
+    entries: List[TimelineEntry] = []
+    held = RESET_FRAME
+    i = -1
+    for i, step in enumerate(steps):
+        compiled = compile_step(step, i, held)
+        held = held_after(compiled, held)
+        entries.extend(compiled)
+    if held != RESET_FRAME:
+        entries.append(TimelineEntry(i, RESET_FRAME, 0))
+    return tuple(entries)
+
+def timeline_duration_ms(timeline: Timeline) -> int:
+    return sum(entry.holdMs for entry in timeline)
+
+# 时间线的紧凑二进制编码：每条 step(u32) holdMs(u32) 帧长(u8，0 = 纯等待) + 帧字节
+TIMELINE_ENTRY = struct.Struct("<IIB")
+
+def encode_timeline(timeline: Timeline) -> bytes:
+    out = bytearray()
+    for entry in timeline:
+        frame = entry.frame or b""
+        out += TIMELINE_ENTRY.pack(entry.step, entry.holdMs, len(frame) if entry.frame is not None else 0)
+        out += frame
+    return bytes(out)
+
+def decode_timeline(data: bytes) -> Timeline:
+    entries: List[TimelineEntry] = []
+    offset = 0
+    while offset < len(data):
+        step, hold, size = TIMELINE_ENTRY.unpack_from(data, offset)
+        offset += TIMELINE_ENTRY.size
+        frame = bytes(data[offset:offset + size]) if size else None
+        offset += size
+        entries.append(TimelineEntry(step, frame, hold))
+    return tuple(entries)
@@ -0,0 +1,259 @@
+"""Binary traces of the report frames sent to each device, and their replay.
+
+A trace file is a small header followed by fixed-size records, appended in
+blocks as they fill. Links hand each sent frame to their ``TraceChannel``,
+which only packs it into a preallocated buffer; the file is written when
+the buffer is full. ``TraceReader`` memory-maps the file and streams
+records from it, so replaying a multi-hour trace reads it page by page.
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from mcp_service.program import Streamed
+from mcp_service.timeline import RESET_FRAME, TimelineEntry
+
+NS_PER_MS = 1_000_000
+
+DEFAULT_TRACE_DIR = "traces"
+TRACE_SUFFIX = ".trace"
+TRACE_NAME = re.compile(r"^[\w.-]{1,64}$")
+
+# 头部：魔数 版本 记录大小 墙钟起点(ns)
+TRACE_HEADER = struct.Struct("<4sHHq")
+TRACE_MAGIC = b"ECTR"
+TRACE_VERSION = 1
+# 记录：相对起点的单调时钟(ns) 设备槽位 类型 有效字节数 数据(8 字节)
+TRACE_RECORD = struct.Struct("<qHBB8s")
+RECORD_REPORT = 0
+RECORD_DEVICE = 1  # 设备名（UTF-8，每条 8 字节，按顺序拼接），先于该设备的第一帧
+
+TRACE_BUFFER_RECORDS = 1024  # records per channel buffer, about 8 s at 125 frames/s
+READ_CHUNK_RECORDS = 4096
+
+# 发送路径上避免属性查找
+_pack_record = TRACE_RECORD.pack_into
+_RECORD_SIZE = TRACE_RECORD.size
+_BUFFER_SIZE = TRACE_RECORD.size * TRACE_BUFFER_RECORDS
+
+class TraceRecord(NamedTuple):
+    tNs: int      # perf_counter_ns offset from the start of the recording
+    device: int   # device slot
+    kind: int
+    size: int     # bytes of ``data`` in use
+    data: bytes
+
+class TraceChannel:
+    """One device's view of a recording; ``record()`` is called from the link's send path."""
+
+    __slots__ = ("_recorder", "_slot", "_start", "_buf", "_pos", "frames")
+
+    def __init__(self, recorder: "TraceRecorder", slot: int, device: str, start_ns: int):
+        self._recorder = recorder
+        self._slot = slot
+        self._start = start_ns
+        self._buf = bytearray(_BUFFER_SIZE)
+        self._pos = 0
+        self.frames = 0
+        name = device.encode()
+        for i in range(0, len(name), 8):
+            piece = name[i:i + 8]
+            self._append(0, RECORD_DEVICE, piece)
+
+    def _append(self, t_ns: int, kind: int, data: bytes):
+        TRACE_RECORD.pack_into(self._buf, self._pos, t_ns, self._slot, kind, len(data), data)
+        self._pos += TRACE_RECORD.size
+        if self._pos == _BUFFER_SIZE:
+            self.flush()
+
+    def record(self, frame: bytes, sent_ns: int):
+        """Add a report frame written at ``sent_ns`` (perf_counter_ns)."""
+        pos = self._pos
+        _pack_record(self._buf, pos, sent_ns - self._start, self._slot, RECORD_REPORT, len(frame), frame)
+        self._pos = pos = pos + _RECORD_SIZE
+        self.frames += 1
+        if pos == _BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        # 录制结束后仍在运行的流水线写入的帧直接丢弃
+        if self._pos and self._recorder is not None:
+            self._recorder._write(memoryview(self._buf)[:self._pos])
+        self._pos = 0
+
+class TraceRecorder:
+    """Appends every report sent on attached links to one trace file.
+
+    Each device gets a ``TraceChannel`` with its own buffer, so the send
+    path takes no lock; full buffers are appended under the recorder's
+    lock. Records of one device are in send order, different devices'
+    blocks may interleave.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.startedAt = time.time()
+        self._file = open(path, "xb")
+        self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size, time.time_ns()))
+        self._file.flush()
+        self._start = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._channels: Dict[str, TraceChannel] = {}
+        self.bytes = TRACE_HEADER.size
+
+    def channel(self, device: str) -> TraceChannel:
+        channel = self._channels.get(device)
+        if channel is None:
+            channel = TraceChannel(self, len(self._channels), device, self._start)
+            self._channels[device] = channel
+        return channel
+
+    def _write(self, block: memoryview):
+        with self._lock:
+            self._file.write(block)
+            self._file.flush()
+            self.bytes += len(block)
+
+    @property
+    def frames(self) -> int:
+        return sum(channel.frames for channel in self._channels.values())
+
+    def close(self):
+        """Flush every channel and close the file; detach the channels from their links first."""
+        for channel in self._channels.values():
+            channel.flush()
+            channel._recorder = None
+        self._file.close()
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "name": os.path.basename(self.path)[:-len(TRACE_SUFFIX)],
+            "devices": list(self._channels),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "startedAt": self.startedAt,
+        }
+
+class TraceReader:
+    """Memory-mapped, read-only view of a trace file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < TRACE_HEADER.size:
+                raise ValueError("Not a trace file")
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            self._file.close()
+            raise
+        magic, version, record_size, self.startedNs = TRACE_HEADER.unpack_from(self._mm)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != TRACE_RECORD.size:
+            self.close()
+            raise ValueError("Not a trace file")
+        # 录制中的文件只读到最后一条完整记录
+        self.count = (size - TRACE_HEADER.size) // TRACE_RECORD.size
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "TraceReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> TraceRecord:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return TraceRecord._make(TRACE_RECORD.unpack_from(self._mm, TRACE_HEADER.size + index * TRACE_RECORD.size))
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[TraceRecord]:
+        """Records ``start`` to ``stop``, unpacked a chunk at a time from the mapping."""
+        stop = self.count if stop is None else min(stop, self.count)
+        for first in range(start, stop, READ_CHUNK_RECORDS):
+            last = min(first + READ_CHUNK_RECORDS, stop)
+            chunk = self._mm[TRACE_HEADER.size + first * TRACE_RECORD.size:TRACE_HEADER.size + last * TRACE_RECORD.size]
+            for record in TRACE_RECORD.iter_unpack(chunk):
+                yield TraceRecord._make(record)
+
+    def devices(self) -> Dict[str, int]:
+        """Device name -> slot, from the name records (which come before each device's frames)."""
+        names: Dict[int, bytes] = {}
+        for record in self.records():
+            if record.kind == RECORD_DEVICE:
+                names[record.device] = names.get(record.device, b"") + record.data[:record.size]
+        return {name.decode(): slot for slot, name in names.items()}
+
+    def slot(self, device: Optional[str] = None) -> int:
+        """Slot of ``device``; slot 0 (the first device recorded) when omitted."""
+        if device is None:
+            return 0
+        slot = self.devices().get(device)
+        if slot is None:
+            raise ValueError(f"Device not in trace: {device}")
+        return slot
+
+    def info(self) -> Dict[str, object]:
+        """Per-device frame counts and durations; reads the whole file."""
+        stats: Dict[int, List[int]] = {}  # slot -> [frames, first tNs, last tNs]
+        for record in self.records():
+            if record.kind == RECORD_REPORT:
+                entry = stats.setdefault(record.device, [0, record.tNs, record.tNs])
+                entry[0] += 1
+                entry[2] = record.tNs
+        devices = []
+        for name, slot in self.devices().items():
+            frames, first, last = stats.get(slot, (0, 0, 0))
+            devices.append({"device": name, "frames": frames, "durationMs": round((last - first) / NS_PER_MS, 3)})
+        return {"records": self.count, "startedAt": self.startedNs / 1e9, "devices": devices}
+
+class TraceReplay(Streamed):
+    """Frames of one recorded device as a playable timeline, streamed from a TraceReader.
+
+    Entries are held for the recorded gap to the next frame, in fractional
+    milliseconds, so the deadline scheduler reproduces the recorded send
+    times to the nanosecond. The first frame plays at offset 0, and a final
+    neutral frame is added when the recording ended with an input held.
+    """
+
+    __slots__ = ("reader", "slot", "duration_ms")
+
+    def __init__(self, reader: TraceReader, slot: int):
+        self.reader = reader
+        self.slot = slot
+        first = next(self._frames(), None)
+        last = None
+        # 从文件末尾向前找最后一帧，不必读完整个文件
+        for index in range(len(reader) - 1, -1, -1):
+            record = reader[index]
+            if record.device == slot and record.kind == RECORD_REPORT:
+                last = record
+                break
+        self.duration_ms = (last.tNs - first.tNs) / NS_PER_MS if first is not None else 0
+
+    def _frames(self) -> Iterator[TraceRecord]:
+        return (r for r in self.reader.records() if r.device == self.slot and r.kind == RECORD_REPORT)
+
+    def walk(self, progress=None) -> Iterator[TimelineEntry]:
+        previous: Optional[TraceRecord] = None
+        index = 0
+        for record in self._frames():
+            if previous is not None:
+                yield TimelineEntry(index, previous.data[:previous.size], (record.tNs - previous.tNs) / NS_PER_MS)
+                index += 1
+            previous = record
+        if previous is not None:
+            frame = previous.data[:previous.size]
+            yield TimelineEntry(index, frame, 0)
+            if frame != RESET_FRAME:
+                yield TimelineEntry(index, RESET_FRAME, 0)
@@ -0,0 +1,151 @@
+"""Analog stick trajectories sampled into per-frame stick positions.
+
+Every shape is a function of the normalised time ``t`` (0..1) written once
+against an ``xp`` namespace: with NumPy installed it is evaluated for all
+frames in one pass over arrays, otherwise per sample with ``math``.
+"""
+import bisect
+import math
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from mcp_service.switch_protocol import SwitchStick
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 可选
+    np = None
+
+SHAPES = ("ramp", "arc", "circle", "spline")
+STICKS = ("left", "right")
+DEFAULT_RATE_HZ = 125  # one frame per 8ms USB poll
+DEFAULT_RADIUS = 127
+
+# 缓动函数只用算术运算，对标量和数组同样适用
+EASINGS = {
+    "linear": lambda t: t,
+    "ease-in": lambda t: t * t,
+    "ease-out": lambda t: t * (2 - t),
+    "ease-in-out": lambda t: t * t * (3 - 2 * t),
+}
+
+Path = Callable[[Any, Any], Tuple[Any, Any]]
+
+def frame_holds(duration_ms: int, rate_hz: int = DEFAULT_RATE_HZ) -> List[int]:
+    """Hold time of each sampled frame; whole milliseconds that sum to ``duration_ms``."""
+    count = max(1, min(duration_ms, round(duration_ms * rate_hz / 1000)))
+    edges = [round(i * duration_ms / count) for i in range(count + 1)]
+    return [b - a for a, b in zip(edges, edges[1:])]
+
+def sample_path(
+    shape: str,
+    count: int,
+    points: Optional[Sequence[Sequence[int]]] = None,
+    center: Optional[Sequence[int]] = None,
+    radius: Optional[int] = None,
+    start_deg: float = 0.0,
+    end_deg: Optional[float] = None,
+    turns: float = 1.0,
+    easing: str = "linear",
+) -> Tuple[List[int], List[int]]:
+    """Stick X/Y for ``count`` evenly spaced samples, the last one at the end of the path.
+
+    ``ramp`` runs straight through ``points`` at constant speed, ``spline`` a
+    Catmull-Rom curve through them. ``arc`` sweeps ``start_deg`` to ``end_deg``
+    and ``circle`` ``turns`` full turns (negative for clockwise) around
+    ``center``; 0 degrees is right and 90 is up.
+    """
+    if easing not in EASINGS:
+        raise ValueError(f"Unknown easing: {easing}")
+    if shape in ("ramp", "spline"):
+        path = _polyline(_waypoints(points)) if shape == "ramp" else _catmull_rom(_waypoints(points))
+    elif shape in ("arc", "circle"):
+        if shape == "arc" and end_deg is None:
+            raise ValueError("endDeg required for shape=arc")
+        sweep = end_deg - start_deg if shape == "arc" else 360.0 * turns
+        path = _arc(center, radius, start_deg, sweep)
+    else:
+        raise ValueError(f"Unknown trajectory shape: {shape}")
+    ease = EASINGS[easing]
+    ts = [i / (count - 1) for i in range(count)] if count > 1 else [1.0]
+    if np is not None:
+        x, y = path(ease(np.array(ts)), np)
+        return _clamp_np(x), _clamp_np(y)
+    xy = [path(ease(t), math) for t in ts]
+    return [_clamp(x) for x, _ in xy], [_clamp(y) for _, y in xy]
+
+def _waypoints(points: Optional[Sequence[Sequence[int]]]) -> List[Tuple[int, int]]:
+    if not points or len(points) < 2:
+        raise ValueError("points needs at least 2 [x, y] waypoints")
+    result = []
+    for point in points:
+        if len(point) != 2:
+            raise ValueError(f"waypoint must be [x, y]: {list(point)}")
+        for value in point:
+            if not SwitchStick.STICK_MIN <= value <= SwitchStick.STICK_MAX:
+                raise ValueError(f"waypoint out of range: {list(point)}")
+        result.append((point[0], point[1]))
+    return result
+
+def _polyline(points: List[Tuple[int, int]]) -> Path:
+    # 按累计长度插值，各段匀速
+    cumulative = [0.0]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        cumulative.append(cumulative[-1] + math.hypot(x1 - x0, y1 - y0))
+    total = cumulative[-1] or 1.0
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+
+    def path(t, xp):
+        d = t * total
+        if xp is np:
+            return np.interp(d, cumulative, xs), np.interp(d, cumulative, ys)
+        i = min(max(bisect.bisect_right(cumulative, d) - 1, 0), len(points) - 2)
+        span = cumulative[i + 1] - cumulative[i]
+        s = (d - cumulative[i]) / span if span else 0.0
+        return xs[i] + (xs[i + 1] - xs[i]) * s, ys[i] + (ys[i + 1] - ys[i]) * s
+    return path
+
+def _catmull_rom(points: List[Tuple[int, int]]) -> Path:
+    # 端点重复一次作为首尾控制点
+    padded = [points[0], *points, points[-1]]
+    xs = [p[0] for p in padded]
+    ys = [p[1] for p in padded]
+    segments = len(points) - 1
+    if np is not None:
+        xs, ys = np.array(xs, dtype=float), np.array(ys, dtype=float)
+
+    def path(t, xp):
+        u = t * segments
+        if xp is np:
+            i = np.minimum(np.floor(u).astype(int), segments - 1)
+        else:
+            i = min(int(u), segments - 1)
+        s = u - i
+        return _cr(xs, i, s), _cr(ys, i, s)
+    return path
+
+def _cr(v, i, s):
+    p0, p1, p2, p3 = v[i], v[i + 1], v[i + 2], v[i + 3]
+    return 0.5 * (
+        2 * p1
+        + (p2 - p0) * s
+        + (2 * p0 - 5 * p1 + 4 * p2 - p3) * s * s
+        + (3 * p1 - p0 - 3 * p2 + p3) * s * s * s
+    )
+
+def _arc(center: Optional[Sequence[int]], radius: Optional[int], start_deg: float, sweep_deg: float) -> Path:
+    cx, cy = center or (SwitchStick.STICK_CENTER, SwitchStick.STICK_CENTER)
+    r = DEFAULT_RADIUS if radius is None else radius
+    start, sweep = math.radians(start_deg), math.radians(sweep_deg)
+
+    def path(t, xp):
+        theta = start + sweep * t
+        # 摇杆 Y 轴向下为正，向上为 0
+        return cx + r * xp.cos(theta), cy - r * xp.sin(theta)
+    return path
+
+def _clamp(v: float) -> int:
+    return min(SwitchStick.STICK_MAX, max(SwitchStick.STICK_MIN, round(v)))
+
+def _clamp_np(v) -> List[int]:
+    return np.clip(np.rint(v), SwitchStick.STICK_MIN, SwitchStick.STICK_MAX).astype(np.int64).tolist()
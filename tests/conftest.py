@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+# 测试不写工作目录里的宏数据库
+os.environ.setdefault("EASYCON_MACROS", ":memory:")
+
+from mcp_service.emulator import EasyConEmulator, PtyEmulator
+
+@pytest.fixture
+def emulator():
+    """A PtyEmulator serving a fresh EasyConEmulator; the device is ``emulator.device``."""
+    with PtyEmulator(EasyConEmulator(seed=1)) as pty:
+        yield pty
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from mcp_service.async_serial import AsyncFramePipeline
+from mcp_service.serial_service import Reply
+from mcp_service.switch_protocol import SwitchButton, SwitchReport
+
+class BusyThenUnpluggedPort:
+    """Answers the first frame with Busy, then fails every later write."""
+
+    is_open = True
+
+    def __init__(self):
+        self.pending = b""
+        self.writes = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def read(self, size):
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def write(self, frame):
+        self.writes += 1
+        if self.writes > 1:
+            raise OSError(5, "Input/output error")
+        self.pending += bytes([Reply.Busy])
+        return len(frame)
+
+def test_port_error_on_busy_resend_is_raised_by_drain():
+    port = BusyThenUnpluggedPort()
+
+    async def send():
+        pipeline = AsyncFramePipeline(port, timeout=0.2)
+        pipeline.start()
+        await pipeline.submit(SwitchReport(button=SwitchButton.A.value).to_bytes())
+        await pipeline.drain()
+
+    with pytest.raises(OSError):
+        asyncio.run(send())
+    assert port.writes == 2
@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from mcp_service.devices import DeviceRegistry
+
+def test_connect_again_keeps_the_supervisor_running(emulator):
+    async def run():
+        registry = DeviceRegistry()
+        device = registry.connect("d", emulator.port)
+        try:
+            await asyncio.sleep(0.01)
+            with pytest.raises(RuntimeError, match="Already connected"):
+                registry.connect("d", emulator.port)
+            await asyncio.sleep(0.01)
+            assert device.connected
+            assert device.supervisor.state == "connected"
+            assert device.supervisor._task is not None and not device.supervisor._task.done()
+        finally:
+            registry.disconnect("d")
+    asyncio.run(run())
+
+def test_failed_connect_does_not_register_the_device():
+    async def run():
+        registry = DeviceRegistry()
+        with pytest.raises(OSError):
+            registry.connect("d", "/dev/nonexistent-easycon")
+        assert registry.get("d") is None
+    asyncio.run(run())
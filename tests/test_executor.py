@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from mcp_service.devices import Device
+from mcp_service.scheduler import RunProgress, TimingConfig
+from mcp_service.switch_protocol import SwitchReport
+from mcp_service.timeline import RESET_FRAME, TimelineEntry
+
+# 固定线程模式需要 sched_setaffinity（Linux）
+CPU = min(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+pinned = pytest.mark.skipif(CPU is None, reason="CPU pinning not supported")
+
+def _presses(count: int, hold_ms: int = 5):
+    """``count`` distinct reports, each held ``hold_ms``, then neutral."""
+    timeline = [TimelineEntry(i, SwitchReport(button=i + 1).to_bytes(), hold_ms) for i in range(count)]
+    return tuple(timeline) + (TimelineEntry(count - 1, RESET_FRAME, 0),)
+
+def _play(port: str, timeline, config: TimingConfig = TimingConfig(), **kwargs):
+    async def run():
+        device = Device("test")
+        device.executor.configure(config)
+        device.link.connect(port)
+        try:
+            return await device.play(timeline, **kwargs)
+        finally:
+            device.link.disconnect()
+    return asyncio.run(run())
+
+def _applied(emulator):
+    return [report.button for _, report in emulator.device.reports]
+
+@pytest.mark.parametrize("config", [
+    TimingConfig(),
+    TimingConfig(window=4),
+    TimingConfig(precision=True, spinUs=500),
+    pytest.param(TimingConfig(cpu=CPU), marks=pinned),
+    pytest.param(TimingConfig(cpu=CPU, window=4), marks=pinned),
+], ids=["stop-and-wait", "pipelined", "precision", "pinned", "pinned-pipelined"])
+def test_frames_reach_the_device_in_order(emulator, config):
+    timeline = _presses(10)
+    timing = _play(emulator.port, timeline, config)
+    assert timing.frames == 11
+    assert _applied(emulator) == list(range(1, 11)) + [0]
+    assert timing.plannedNs == 50_000_000
+    assert timing.actualNs >= timing.plannedNs
+    if config.window > 1:
+        assert timing.link == {"sent": 11, "acked": 11, "busy": 0, "resent": 0, "lost": 0}
+
+def test_progress_and_step_trace(emulator):
+    progress = RunProgress()
+    timing = _play(emulator.port, _presses(4), progress=progress, repeat=2, trace_steps=True)
+    assert progress.repeat == 1 and progress.step == 3
+    assert [step for step, _, _ in timing.steps] == [0, 1, 2, 3] * 2
+
+@pytest.mark.parametrize("config", [
+    TimingConfig(),
+    TimingConfig(window=4),
+    pytest.param(TimingConfig(cpu=CPU), marks=pinned),
+], ids=["stop-and-wait", "pipelined", "pinned"])
+def test_busy_frames_are_resent(emulator, config):
+    emulator.device.busy_rate = 0.3
+    timing = _play(emulator.port, _presses(30, hold_ms=2), config)
+    assert emulator.device.busy > 0
+    # 重发后设备停在最后一帧
+    assert emulator.device.report == SwitchReport()
+    if config.window > 1:
+        assert timing.link["busy"] == emulator.device.busy
+        assert timing.link["lost"] == 0
+    else:
+        assert _applied(emulator) == list(range(1, 31)) + [0]
+
+def test_diff_frames_keep_a_final_hold(emulator):
+    held = SwitchReport(button=1, LX=0)
+    timeline = (TimelineEntry(0, held.to_bytes(), 10),)
+    timing = _play(emulator.port, timeline, TimingConfig(diffFrames=True))
+    assert emulator.device.report == held
+    assert timing.output == {"sent": 1, "suppressed": 0}
+
+def test_cancel_stops_the_run_and_frees_the_device(emulator):
+    async def run():
+        device = Device("test")
+        device.link.connect(emulator.port)
+        try:
+            task = asyncio.get_running_loop().create_task(device.play(_presses(100, hold_ms=10)))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            sent = len(emulator.device.reports)
+            assert 0 < sent < 100 and not device.arbiter.held
+            # 链路和设备都已释放：下一个运行立即开始
+            timing = await device.play(_presses(2))
+            assert timing.queuedNs < 5_000_000
+        finally:
+            device.link.disconnect()
+    asyncio.run(run())
+
+@pinned
+def test_reconfigure_during_a_pinned_run_does_not_block(emulator):
+    async def run():
+        device = Device("test")
+        device.executor.configure(TimingConfig(cpu=CPU))
+        device.link.connect(emulator.port)
+        try:
+            task = asyncio.get_running_loop().create_task(device.play(_presses(20, hold_ms=10)))
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            device.executor.configure(TimingConfig())
+            assert time.perf_counter() - start < 0.05 and not task.done()
+            timing = await task
+            assert timing.frames == 21
+            assert (await device.play(_presses(2))).frames == 3
+        finally:
+            device.link.disconnect()
+    asyncio.run(run())
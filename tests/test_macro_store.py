@@ -0,0 +1,61 @@
+import pytest
+
+from mcp_service.macro_store import MacroStore
+from mcp_service.program import Program, compile_program
+from mcp_service.server import ActionStep
+
+PRESS_A = [{"type": "button", "button": "A", "durationMs": 40}]
+PRESS_B = [{"type": "button", "button": "B", "durationMs": 60}, {"type": "wait", "durationMs": 10}]
+LOOP = [{"type": "loop", "count": 5, "steps": PRESS_A}]
+
+def _compile(steps):
+    return compile_program([ActionStep(**step) for step in steps])
+
+@pytest.fixture
+def store(tmp_path):
+    store = MacroStore(str(tmp_path / "macros.db"))
+    yield store
+    store.close()
+
+def test_each_save_adds_a_version(store):
+    assert store.save("m", PRESS_A, _compile(PRESS_A)) == 1
+    assert store.save("m", PRESS_B, _compile(PRESS_B)) == 2
+    assert [v["version"] for v in store.versions("m")] == [1, 2]
+    assert store.get("m")["steps"] == PRESS_B
+    assert store.get("m", version=1)["steps"] == PRESS_A
+    assert store.get("m", version=3) is None
+    assert store.compiled("m").timeline == _compile(PRESS_B)
+
+def test_versions_continue_after_delete(store):
+    store.save("m", PRESS_A, _compile(PRESS_A))
+    assert store.delete("m") and "m" not in store
+    assert store.compiled("m") is None
+    assert store.save("m", PRESS_B, _compile(PRESS_B)) == 2
+    assert len(store.versions("m")) == 2
+
+def test_compiled_is_cached_by_version(store):
+    store.save("m", PRESS_A, _compile(PRESS_A))
+    first = store.compiled("m")
+    assert store.compiled("m") is first
+    store.save("m", PRESS_B, _compile(PRESS_B))
+    assert store.compiled("m").version == 2
+
+def test_other_processes_see_new_versions(store, tmp_path):
+    store.save("m", PRESS_A, _compile(PRESS_A))
+    other = MacroStore(store.path)
+    try:
+        assert other.compiled("m").timeline == _compile(PRESS_A)
+        other.save("m", LOOP, _compile(LOOP))
+    finally:
+        other.close()
+    # 缓存的是版本 1，数据库已指向版本 2：重新解码
+    macro = store.compiled("m")
+    assert macro.version == 2 and isinstance(macro.timeline, Program)
+    assert list(macro.timeline.walk()) == list(_compile(LOOP).walk())
+
+def test_list_pages_by_prefix(store):
+    for name in ("farm-1", "farm-2", "farm-3", "menu"):
+        store.save(name, PRESS_A, _compile(PRESS_A))
+    items, total = store.list("farm-", offset=1, limit=1)
+    assert total == 3 and [item["name"] for item in items] == ["farm-2"]
+    assert len(store) == 4
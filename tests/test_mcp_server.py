@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from mcp_service.mcp_server import INVALID_PARAMS, INVALID_REQUEST, McpServer
+from mcp_service.server import MCP
+
+def _handle(message):
+    return asyncio.run(MCP.handle(message))
+
+def _call(params, msg_id=1):
+    return {"jsonrpc": "2.0", "id": msg_id, "method": "tools/call", "params": params}
+
+@pytest.mark.parametrize("message", [
+    _call([1]),
+    _call("status"),
+    _call({"name": "status", "arguments": [1]}),
+    _call({"name": "press_button", "arguments": "A"}),
+    {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": [1]},
+], ids=["params-list", "params-string", "arguments-list", "frame-arguments-string", "initialize"])
+def test_params_that_are_not_objects_are_invalid(message):
+    assert _handle(message)["error"]["code"] == INVALID_PARAMS
+
+def test_batch_answers_each_bad_call():
+    responses = _handle([_call([1], 1), _call({"name": "wait", "arguments": [2]}, 2), {"jsonrpc": "2.0", "id": 3, "method": 7}])
+    assert [(r["id"], r["error"]["code"]) for r in responses] == [(1, INVALID_PARAMS), (2, INVALID_PARAMS), (3, INVALID_REQUEST)]
+
+def test_tool_validation_errors_are_tool_results():
+    server = McpServer("test", "0", core=None)
+    result = asyncio.run(server.handle(_call({"name": "missing"})))
+    assert result["error"]["code"] == INVALID_PARAMS
+    result = _handle(_call({"name": "press_button", "arguments": {"button": "A", "durationMs": -1}}))
+    assert result["result"]["isError"]
@@ -0,0 +1,92 @@
+import pytest
+
+from mcp_service.program import Program, compile_program, decode_program, encode_program
+from mcp_service.server import ActionStep
+from mcp_service.switch_protocol import SwitchButton, SwitchReport
+from mcp_service.timeline import RESET_FRAME, CompileError, TimelineEntry, compile_steps
+
+A = SwitchButton.A.value
+L = SwitchButton.L.value
+
+def _steps(*specs):
+    return [ActionStep(**spec) for spec in specs]
+
+def _frame(**fields) -> bytes:
+    return SwitchReport(**fields).to_bytes()
+
+def test_steps_without_control_flow_stay_flat():
+    steps = _steps({"type": "button", "button": "A"}, {"type": "wait", "durationMs": 10})
+    assert compile_program(steps) == compile_steps(steps)
+
+def test_loop_walks_its_body_count_times():
+    program = compile_program(_steps(
+        {"type": "loop", "count": 3, "label": "mash", "steps": [
+            {"type": "button", "button": "A", "durationMs": 20},
+            {"type": "wait", "durationMs": 30},
+        ]},
+        {"type": "button", "button": "B", "durationMs": 10},
+    ))
+    assert isinstance(program, Program)
+    assert program.duration_ms == 3 * 50 + 10
+    entries = list(program.walk())
+    assert len(entries) == program.length == 3 * 3 + 2
+    assert [e.step for e in entries[:3]] == [1, 1, 2]
+    assert entries[-2].step == 3
+
+def test_endless_loop_has_no_duration():
+    program = compile_program(_steps({"type": "loop", "steps": [{"type": "button", "button": "A"}]}))
+    assert program.endless and program.duration_ms is None
+
+def test_loop_may_hold_inputs_it_releases():
+    program = compile_program(_steps(
+        {"type": "loop", "count": 2, "steps": [
+            {"type": "state", "buttons": ["L"], "hold": True, "durationMs": 10},
+            {"type": "button", "button": "A", "durationMs": 10},
+            {"type": "release", "durationMs": 0},
+        ]},
+    ))
+    frames = [e.frame for e in program.walk()]
+    assert frames[:4] == [_frame(button=L), _frame(button=L | A), _frame(button=L), RESET_FRAME]
+    assert len(frames) == 8
+
+def test_loop_must_end_holding_what_it_started_with():
+    with pytest.raises(CompileError, match="same inputs"):
+        compile_program(_steps(
+            {"type": "loop", "count": 2, "steps": [{"type": "state", "buttons": ["L"], "hold": True}]},
+        ))
+
+def test_held_state_is_released_at_the_end():
+    program = compile_program(_steps(
+        {"type": "section", "label": "grab", "steps": [{"type": "state", "buttons": ["L"], "hold": True}]},
+    ))
+    assert list(program.walk())[-1] == TimelineEntry(1, RESET_FRAME, 0)
+
+def test_call_links_the_callee():
+    callee = compile_steps(_steps({"type": "button", "button": "A", "durationMs": 15}))
+    program = compile_program(_steps({"type": "call", "macro": "mash"}, {"type": "wait", "durationMs": 5}))
+    assert not program.linked
+    linked = program.link({"mash": callee}.__getitem__)
+    assert linked.duration_ms == 20
+    assert tuple(linked.walk())[:2] == callee
+
+def test_call_while_holding_is_rejected():
+    with pytest.raises(CompileError, match="release held inputs"):
+        compile_program(_steps(
+            {"type": "state", "buttons": ["L"], "hold": True},
+            {"type": "call", "macro": "mash"},
+        ))
+
+def test_calls_that_recurse_are_rejected():
+    program = compile_program(_steps({"type": "call", "macro": "self"}))
+    with pytest.raises(ValueError, match="calls itself"):
+        program.link(lambda name: program, ("self",))
+
+def test_encoded_program_round_trip():
+    program = compile_program(_steps(
+        {"type": "loop", "count": 4, "label": "x", "steps": [{"type": "hat", "direction": "TOP"}]},
+        {"type": "call", "macro": "other"},
+    ))
+    decoded = decode_program(encode_program(program))
+    assert (decoded.code, decoded.chunks, decoded.labels, decoded.calls) == (
+        program.code, program.chunks, program.labels, program.calls
+    )
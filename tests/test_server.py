@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+from mcp_service.server import app
+
+def test_input_stream_answers_bad_messages_and_stays_open(emulator):
+    with TestClient(app) as client:
+        assert client.post("/connect", json={"port": emulator.port}).status_code == 200
+        try:
+            with client.websocket_connect("/ws/input") as ws:
+                for bad in ("not json", "[1, 2]", "3", '{"lx": 999}'):
+                    ws.send_text(bad)
+                    reply = ws.receive_json()
+                    assert reply["ok"] is False and reply["error"]
+                ws.send_bytes(b"\xff")
+                assert ws.receive_json()["ok"] is False
+                ws.send_json({"type": "stats"})
+                assert ws.receive_json()["ok"] is True
+        finally:
+            client.post("/disconnect")
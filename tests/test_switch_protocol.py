@@ -0,0 +1,47 @@
+import pytest
+
+from mcp_service.switch_protocol import (
+    COMMON_FRAMES,
+    SwitchButton,
+    SwitchHAT,
+    SwitchReport,
+    encode_block,
+    encode_report,
+    encode_reports,
+    pack_reports,
+)
+
+REPORTS = [
+    SwitchReport(),
+    SwitchReport(button=SwitchButton.A.value),
+    SwitchReport(HAT=SwitchHAT.TOP_LEFT.value),
+    SwitchReport(button=0xFFFF, HAT=0xFF, LX=0, LY=255, RX=1, RY=254),
+    SwitchReport(button=0x1234, HAT=SwitchHAT.RIGHT.value, LX=17, LY=200, RX=128, RY=3),
+]
+
+@pytest.mark.parametrize("report", REPORTS, ids=repr)
+def test_report_round_trip(report):
+    frame = report.to_bytes()
+    assert len(frame) == 8
+    # 前 7 字节各放 7 bit，最后一字节带结束标志
+    assert all(b < 0x80 for b in frame[:7]) and frame[7] & 0x80
+    assert SwitchReport.from_bytes(frame) == report
+
+def test_common_frames_match_packed_encoding():
+    for (button, hat), frame in COMMON_FRAMES.items():
+        assert frame == encode_block(button, hat)
+        assert SwitchReport.from_bytes(frame) == SwitchReport(button=button, HAT=hat)
+    assert encode_report(SwitchButton.B.value, lx=0) == encode_block(SwitchButton.B.value, lx=0)
+
+def test_encode_reports_matches_encode_report():
+    xs = [0, 64, 128, 192, 255]
+    frames = encode_reports(SwitchButton.L.value, SwitchHAT.CENTER.value, xs, 128, 255, [1, 2, 3, 4, 5])
+    assert frames == [
+        encode_report(SwitchButton.L.value, SwitchHAT.CENTER.value, x, 128, 255, ry)
+        for x, ry in zip(xs, [1, 2, 3, 4, 5])
+    ]
+    assert encode_block() == SwitchReport().to_bytes()
+
+def test_pack_reports():
+    assert pack_reports(REPORTS) == b"".join(r.to_bytes() for r in REPORTS)
+    assert pack_reports([]) == b""
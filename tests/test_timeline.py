@@ -0,0 +1,85 @@
+import pytest
+
+from mcp_service.server import ActionStep
+from mcp_service.switch_protocol import SwitchButton, SwitchHAT, SwitchReport
+from mcp_service.timeline import (
+    RESET_FRAME,
+    CompileError,
+    TimelineEntry,
+    compile_step,
+    compile_steps,
+    decode_timeline,
+    encode_timeline,
+    held_after,
+)
+
+A = SwitchButton.A.value
+B = SwitchButton.B.value
+L = SwitchButton.L.value
+
+def _steps(*specs):
+    return [ActionStep(**spec) for spec in specs]
+
+def _frame(**fields) -> bytes:
+    return SwitchReport(**fields).to_bytes()
+
+def test_button_press_then_release():
+    (step,) = _steps({"type": "button", "button": "A", "durationMs": 80})
+    assert compile_step(step, 3) == [TimelineEntry(3, _frame(button=A), 80), TimelineEntry(3, RESET_FRAME, 0)]
+
+def test_state_hold_keeps_inputs_under_later_presses():
+    timeline = compile_steps(_steps(
+        {"type": "state", "buttons": ["L"], "lx": 0, "hold": True, "durationMs": 20},
+        {"type": "button", "button": "A", "durationMs": 30},
+        {"type": "hat", "direction": "LEFT", "durationMs": 10},
+    ))
+    held = _frame(button=L, LX=0)
+    assert timeline == (
+        TimelineEntry(0, held, 20),
+        TimelineEntry(1, _frame(button=L | A, LX=0), 30),
+        TimelineEntry(1, held, 0),
+        TimelineEntry(2, _frame(button=L, HAT=SwitchHAT.LEFT.value, LX=0), 10),
+        TimelineEntry(2, held, 0),
+        # 结束时仍按住：补一帧释放
+        TimelineEntry(2, RESET_FRAME, 0),
+    )
+
+def test_state_without_hold_releases_to_held():
+    timeline = compile_steps(_steps(
+        {"type": "state", "buttons": ["L"], "hold": True, "durationMs": 0},
+        {"type": "state", "buttons": ["B"], "ry": 255, "durationMs": 40},
+    ))
+    assert timeline[1:3] == (
+        TimelineEntry(1, _frame(button=L | B, RY=255), 40),
+        TimelineEntry(1, _frame(button=L), 0),
+    )
+
+def test_release_named_buttons_or_everything():
+    timeline = compile_steps(_steps(
+        {"type": "state", "buttons": ["L", "B"], "hold": True, "durationMs": 10},
+        {"type": "release", "buttons": ["B"], "durationMs": 5},
+        {"type": "release", "durationMs": 0},
+    ))
+    assert [e.frame for e in timeline] == [_frame(button=L | B), _frame(button=L), RESET_FRAME]
+    assert held_after(timeline) == RESET_FRAME
+
+def test_state_must_set_an_input():
+    with pytest.raises(CompileError, match="sets no input"):
+        compile_steps(_steps({"type": "state", "hold": True}))
+
+def test_unknown_button_names_the_step():
+    with pytest.raises(CompileError, match="step 1"):
+        compile_steps(_steps({"type": "wait"}, {"type": "button", "button": "Q"}))
+
+def test_held_after_skips_waits():
+    entries = [TimelineEntry(0, _frame(button=A), 10), TimelineEntry(1, None, 50)]
+    assert held_after(entries) == _frame(button=A)
+    assert held_after([TimelineEntry(0, None, 5)], _frame(button=B)) == _frame(button=B)
+
+def test_encoded_timeline_round_trip():
+    timeline = compile_steps(_steps(
+        {"type": "combo", "buttons": ["A", "B"], "durationMs": 30},
+        {"type": "wait", "durationMs": 100},
+        {"type": "trajectory", "shape": "circle", "durationMs": 60},
+    ))
+    assert decode_timeline(encode_timeline(timeline)) == timeline